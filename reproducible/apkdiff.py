@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Compare two APKs entry by entry from their zip central directories.
+
+Entries are matched by name and compared on CRC32, sizes, compression method
+and zip metadata (central directory order, timestamps, attributes, central
+and local extra fields, data alignment). Nothing is inflated, so a report
+takes seconds even for large APKs. Signing artifacts are reported but kept
+out of the summary counts.
+
+Usage:
+    ./apkdiff.py <official-apk> <rebuilt-apk> [--json REPORT]
+
+Exit status: 0 if no entry differs, 1 otherwise.
+"""
+
+from __future__ import annotations
+
+import argparse
+import bisect
+import json
+import re
+import struct
+import sys
+import zipfile
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Tuple
+
+from apkzip import LOCAL_HEADER_SIZE
+
+LOCAL_HEADER_SIG = b"PK\x03\x04"
+# zipalign uses 4 bytes for stored entries and 4 KiB/16 KiB pages for uncompressed native libs.
+ALIGNMENTS = (16384, 4096, 4)
+SIGNING_ENTRY_RE = re.compile(
+    r"META-INF/(?:[^/]+\.(?:RSA|DSA|EC|SF|MF|DSIG)|CERT\.[^/]+|CHANGES\.[^/]+|com/android/metadata)|(?:.*/)?stamp-cert-sha256|.*\.idsig"
+)
+# Report field -> ZipInfo attribute, in report order. CRC and file_size decide whether content differs.
+CONTENT_FIELDS = {"crc": "CRC", "file_size": "file_size"}
+METADATA_FIELDS = {
+    "compress_size": "compress_size",
+    "compress_type": "compress_type",
+    "date_time": "date_time",
+    "flag_bits": "flag_bits",
+    "create_system": "create_system",
+    "create_version": "create_version",
+    "extract_version": "extract_version",
+    "internal_attr": "internal_attr",
+    "external_attr": "external_attr",
+    "extra": "extra",
+    "comment": "comment",
+}
+
+
+class EntryInfo(NamedTuple):
+    index: int
+    info: zipfile.ZipInfo
+    local_extra: bytes
+    alignment: int
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("official_apk", help="Reference APK")
+    parser.add_argument("rebuilt_apk", help="APK to compare against the reference")
+    parser.add_argument("--json", default=None, help="Write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    report = diff_apks(Path(args.official_apk), Path(args.rebuilt_apk))
+    if args.json:
+        write_report(report, Path(args.json))
+        print_summary(report)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    sys.exit(0 if report["identical"] else 1)
+
+
+def diff_apks(official_apk: Path, rebuilt_apk: Path) -> Dict[str, Any]:
+    """Build a JSON-serializable report of every entry and header field that differs."""
+    official, official_comment, official_dupes = read_entries(official_apk)
+    rebuilt, rebuilt_comment, rebuilt_dupes = read_entries(rebuilt_apk)
+
+    common = [name for name in official if name in rebuilt]
+    moved = moved_entries(common, [rebuilt[name].index for name in common])
+
+    entries: List[Dict[str, Any]] = []
+    for name in common:
+        fields = compare_entry(official[name], rebuilt[name])
+        if name in moved:
+            fields["order"] = [official[name].index, rebuilt[name].index]
+        if fields:
+            content = any(field in fields for field in CONTENT_FIELDS)
+            entries.append({"name": name, "content": content, "signing": is_signing_entry(name), "fields": fields})
+
+    only_official = [name for name in official if name not in rebuilt]
+    only_rebuilt = [name for name in rebuilt if name not in official]
+    archive: Dict[str, Any] = {}
+    if official_comment != rebuilt_comment:
+        archive["comment"] = [_jsonable(official_comment), _jsonable(rebuilt_comment)]
+    if official_dupes or rebuilt_dupes:
+        archive["duplicates"] = [official_dupes, rebuilt_dupes]
+
+    relevant = [entry for entry in entries if not entry["signing"]]
+    summary = {
+        "official_entries": len(official),
+        "rebuilt_entries": len(rebuilt),
+        "only_in_official": sum(not is_signing_entry(name) for name in only_official),
+        "only_in_rebuilt": sum(not is_signing_entry(name) for name in only_rebuilt),
+        "content_differs": sum(entry["content"] for entry in relevant),
+        "metadata_differs": sum(not entry["content"] for entry in relevant),
+        "signing_entries_differ": len(entries) - len(relevant)
+        + sum(map(is_signing_entry, only_official))
+        + sum(map(is_signing_entry, only_rebuilt)),
+    }
+    identical = not (summary["only_in_official"] or summary["only_in_rebuilt"] or relevant or archive)
+    return {
+        "official": str(official_apk),
+        "rebuilt": str(rebuilt_apk),
+        "identical": identical,
+        "summary": summary,
+        "archive": archive,
+        "only_in_official": only_official,
+        "only_in_rebuilt": only_rebuilt,
+        "entries": entries,
+    }
+
+
+def read_entries(apk: Path) -> Tuple[Dict[str, EntryInfo], bytes, List[str]]:
+    """Central directory entries keyed by name (first occurrence wins), the archive comment and duplicate names."""
+    entries: Dict[str, EntryInfo] = {}
+    duplicates: List[str] = []
+    with zipfile.ZipFile(apk) as zf, apk.open("rb") as fh:
+        for index, info in enumerate(zf.infolist()):
+            if info.filename in entries:
+                duplicates.append(info.filename)
+                continue
+            local_extra, data_offset = read_local_header(fh, info)
+            entries[info.filename] = EntryInfo(index, info, local_extra, alignment(data_offset))
+        return entries, zf.comment, duplicates
+
+
+def read_local_header(fh: BinaryIO, info: zipfile.ZipInfo) -> Tuple[bytes, int]:
+    """Return the local header's extra field and the offset of the entry data."""
+    fh.seek(info.header_offset)
+    header = fh.read(LOCAL_HEADER_SIZE)
+    if len(header) != LOCAL_HEADER_SIZE or header[:4] != LOCAL_HEADER_SIG:
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename!r}")
+    n, m = struct.unpack("<HH", header[26:30])
+    fh.seek(n, 1)
+    return fh.read(m), info.header_offset + LOCAL_HEADER_SIZE + n + m
+
+
+def moved_entries(names: List[str], positions: List[int]) -> set[str]:
+    """Names outside the longest run kept in the same relative order, i.e. the fewest entries that moved."""
+    tails: List[int] = []  # tails[k]: index into names ending the best increasing run of length k + 1
+    tail_positions: List[int] = []
+    previous = [-1] * len(names)
+    for i, position in enumerate(positions):
+        k = bisect.bisect_left(tail_positions, position)
+        if k:
+            previous[i] = tails[k - 1]
+        if k == len(tails):
+            tails.append(i)
+            tail_positions.append(position)
+        else:
+            tails[k] = i
+            tail_positions[k] = position
+    kept = set()
+    i = tails[-1] if tails else -1
+    while i >= 0:
+        kept.add(i)
+        i = previous[i]
+    return {name for i, name in enumerate(names) if i not in kept}
+
+
+def alignment(offset: int) -> int:
+    for boundary in ALIGNMENTS:
+        if offset % boundary == 0:
+            return boundary
+    return 1
+
+
+def compare_entry(official: EntryInfo, rebuilt: EntryInfo) -> Dict[str, Any]:
+    fields: Dict[str, Any] = {}
+    for field, attr in {**CONTENT_FIELDS, **METADATA_FIELDS}.items():
+        a, b = getattr(official.info, attr), getattr(rebuilt.info, attr)
+        if a != b:
+            fields[field] = [f"{a:08x}", f"{b:08x}"] if field == "crc" else [_jsonable(a), _jsonable(b)]
+    if official.local_extra != rebuilt.local_extra:
+        fields["local_extra"] = [official.local_extra.hex(), rebuilt.local_extra.hex()]
+    # Data offsets shift with any earlier change; only the alignment of stored entries is meaningful.
+    stored = zipfile.ZIP_STORED in (official.info.compress_type, rebuilt.info.compress_type)
+    if stored and official.alignment != rebuilt.alignment:
+        fields["alignment"] = [official.alignment, rebuilt.alignment]
+    return fields
+
+
+def is_signing_entry(name: str) -> bool:
+    return bool(SIGNING_ENTRY_RE.fullmatch(name))
+
+
+def write_report(report: Dict[str, Any], path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2) + "\n")
+
+
+def print_summary(report: Dict[str, Any]) -> None:
+    summary = report["summary"]
+    if report["identical"]:
+        print(f"No entry differences ({summary['official_entries']} entries; signing entries differ: {summary['signing_entries_differ']})")
+        return
+    print(
+        f"Entries differ: content={summary['content_differs']} metadata={summary['metadata_differs']} "
+        f"only-official={summary['only_in_official']} only-rebuilt={summary['only_in_rebuilt']} "
+        f"signing={summary['signing_entries_differ']}"
+    )
+    for entry in report["entries"]:
+        if not entry["signing"]:
+            print(f"  {'content ' if entry['content'] else 'metadata'} {entry['name']}: {', '.join(entry['fields'])}")
+    for key in ("only_in_official", "only_in_rebuilt"):
+        for name in report[key]:
+            if not is_signing_entry(name):
+                print(f"  {key.replace('_', '-')} {name}")
+    for field, values in report["archive"].items():
+        print(f"  archive {field}: {values}")
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Signing-block-agnostic payload digests for APKs (APK Signature Scheme v2/v3).
+
+An APK is split into the sections the v2/v3 schemes sign: zip entry data up
+to the APK Signing Block, the central directory and the EOCD record (with its
+central directory offset pointed at where the signing block starts). Two
+APKs whose sections hash the same carry the same payload whatever signing
+block they have, so a signed official APK can be checked against an
+unsigned rebuild without writing a re-signed copy.
+
+For each APK this computes the scheme's chunked digest (1 MiB chunks hashed
+in parallel, then a top-level digest over the chunk digests) and a plain
+SHA-256 over the same bytes, and extracts the content digests the v2/v3
+signers recorded in the signing block.
+
+Usage:
+    ./apksig.py <official-apk> <rebuilt-apk> [--jobs N]
+
+Exit status: 0 if the payloads match, 1 otherwise.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from dexfile import Error
+
+EOCD_SIG = b"PK\x05\x06"
+EOCD_SIZE = 22
+EOCD_MAX_COMMENT = 0xFFFF
+APK_SIG_BLOCK_MAGIC = b"APK Sig Block 42"
+APK_SIG_BLOCK_MIN_SIZE = 32
+APK_SIGNATURE_SCHEME_V2_BLOCK_ID = 0x7109871A
+APK_SIGNATURE_SCHEME_V3_BLOCK_ID = 0xF05368C0
+CHUNK_SIZE = 1024 * 1024
+# Signature algorithm id -> content digest it signs (verity algorithms are not chunked digests).
+CONTENT_DIGESTS = {
+    0x0101: "chunked-sha256",
+    0x0102: "chunked-sha512",
+    0x0103: "chunked-sha256",
+    0x0104: "chunked-sha512",
+    0x0201: "chunked-sha256",
+    0x0202: "chunked-sha512",
+    0x0301: "chunked-sha256",
+}
+SCHEMES = {APK_SIGNATURE_SCHEME_V2_BLOCK_ID: "v2", APK_SIGNATURE_SCHEME_V3_BLOCK_ID: "v3"}
+
+
+class ApkSections(NamedTuple):
+    """Byte ranges the v2/v3 schemes sign, plus the EOCD rewritten as if no signing block were present."""
+
+    entries_end: int
+    central_dir_offset: int
+    central_dir_size: int
+    eocd: bytes
+    signing_block: Tuple[int, int] | None
+
+
+class PayloadDigest(NamedTuple):
+    chunked_sha256: str
+    sha256: str
+    signed: bool
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("official_apk", help="Signed reference APK")
+    parser.add_argument("rebuilt_apk", help="APK whose payload is compared (signed or not)")
+    parser.add_argument("--jobs", type=int, default=0, help="Threads for chunk digests (0 = one per CPU; default: 0)")
+    args = parser.parse_args()
+
+    official, rebuilt = Path(args.official_apk), Path(args.rebuilt_apk)
+    try:
+        official_digest = payload_digest(official, args.jobs)
+        rebuilt_digest = payload_digest(rebuilt, args.jobs)
+    except Error as exc:
+        sys.stderr.write(f"{exc}\n")
+        sys.exit(1)
+    for apk, digest in ((official, official_digest), (rebuilt, rebuilt_digest)):
+        print(f"{apk.name}: chunked-sha256={digest.chunked_sha256} sha256={digest.sha256} signing-block={'yes' if digest.signed else 'no'}")
+    for scheme, algorithm, digest in signed_digests(official):
+        state = "matches" if digest == rebuilt_digest.chunked_sha256 else "differs" if algorithm == "chunked-sha256" else "not checked"
+        print(f"{official.name} {scheme} signer {algorithm}={digest} ({state} for {rebuilt.name})")
+    same = official_digest[:2] == rebuilt_digest[:2]
+    print("Payloads match." if same else "Payloads differ.")
+    sys.exit(0 if same else 1)
+
+
+def read_sections(fh: mmap.mmap | bytes) -> ApkSections:
+    size = len(fh)
+    search_from = max(0, size - EOCD_SIZE - EOCD_MAX_COMMENT)
+    eocd_offset = fh.rfind(EOCD_SIG, search_from)
+    while eocd_offset >= 0 and eocd_offset + EOCD_SIZE <= size:
+        comment_len = struct.unpack_from("<H", fh, eocd_offset + 20)[0]
+        if eocd_offset + EOCD_SIZE + comment_len == size:
+            break
+        eocd_offset = fh.rfind(EOCD_SIG, search_from, eocd_offset)
+    if eocd_offset < 0 or eocd_offset + EOCD_SIZE > size:
+        raise Error("End of central directory record not found")
+    cd_size, cd_offset = struct.unpack_from("<II", fh, eocd_offset + 12)
+    if cd_offset == 0xFFFFFFFF or cd_offset + cd_size != eocd_offset:
+        raise Error("ZIP64 or non-contiguous central directory is not supported")
+
+    entries_end = cd_offset
+    signing_block = None
+    if cd_offset >= APK_SIG_BLOCK_MIN_SIZE and fh[cd_offset - 16 : cd_offset] == APK_SIG_BLOCK_MAGIC:
+        block_size = struct.unpack_from("<Q", fh, cd_offset - 24)[0]
+        block_start = cd_offset - block_size - 8
+        if block_start < 0 or struct.unpack_from("<Q", fh, block_start)[0] != block_size:
+            raise Error("Malformed APK Signing Block")
+        entries_end = block_start
+        signing_block = (block_start, cd_offset)
+    eocd = bytearray(fh[eocd_offset:])
+    struct.pack_into("<I", eocd, 16, entries_end)
+    return ApkSections(entries_end, cd_offset, cd_size, bytes(eocd), signing_block)
+
+
+def payload_digest(apk: Path, jobs: int = 0) -> PayloadDigest:
+    """Chunked SHA-256 (as signed by v2/v3) and plain SHA-256 of the APK with its signing block left out."""
+    with _mapped(apk) as mm:
+        sections = read_sections(mm)
+        with memoryview(mm) as view:
+            parts = [
+                view[: sections.entries_end],
+                view[sections.central_dir_offset : sections.central_dir_offset + sections.central_dir_size],
+                memoryview(sections.eocd),
+            ]
+            chunks = [part[pos : pos + CHUNK_SIZE] for part in parts for pos in range(0, len(part), CHUNK_SIZE)]
+            # hashlib drops the GIL for large buffers, so plain threads hash chunks in parallel.
+            with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+                plain = pool.submit(_sha256_parts, parts)
+                chunk_digests = list(pool.map(_chunk_digest, chunks))
+                sha256 = plain.result()
+            top = hashlib.sha256(b"\x5a" + struct.pack("<I", len(chunks)))
+            for digest in chunk_digests:
+                top.update(digest)
+            del chunks, parts
+    return PayloadDigest(top.hexdigest(), sha256, sections.signing_block is not None)
+
+
+def signed_digests(apk: Path) -> List[Tuple[str, str, str]]:
+    """(scheme, content digest algorithm, hex digest) for every v2/v3 signer in the APK Signing Block."""
+    with _mapped(apk) as mm:
+        sections = read_sections(mm)
+        if not sections.signing_block:
+            return []
+        start, end = sections.signing_block
+        pairs = _id_value_pairs(bytes(mm[start + 8 : end - 24]))
+    found: List[Tuple[str, str, str]] = []
+    for block_id, scheme in SCHEMES.items():
+        if block_id not in pairs:
+            continue
+        for signer in _length_prefixed(_first_value(pairs[block_id])):
+            signed_data = _first_value(signer)
+            for digest in _length_prefixed(_first_value(signed_data)):
+                algorithm_id = struct.unpack_from("<I", digest)[0]
+                value = _first_value(digest[4:])
+                found.append((scheme, CONTENT_DIGESTS.get(algorithm_id, f"0x{algorithm_id:04x}"), value.hex()))
+    return found
+
+
+@contextlib.contextmanager
+def _mapped(apk: Path) -> Iterator[mmap.mmap]:
+    """apk mapped read-only; a file too short to hold an EOCD record (mmap rejects an empty one) raises Error."""
+    with apk.open("rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size < EOCD_SIZE:
+            raise Error(f"{apk.name} is {size} bytes, too short to be an APK")
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def _chunk_digest(chunk: memoryview) -> bytes:
+    h = hashlib.sha256(b"\xa5" + struct.pack("<I", len(chunk)))
+    h.update(chunk)
+    return h.digest()
+
+
+def _sha256_parts(parts: List[memoryview]) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        for pos in range(0, len(part), CHUNK_SIZE):
+            h.update(part[pos : pos + CHUNK_SIZE])
+    return h.hexdigest()
+
+
+def _id_value_pairs(data: bytes) -> Dict[int, bytes]:
+    pairs: Dict[int, bytes] = {}
+    pos = 0
+    while pos + 12 <= len(data):
+        length, block_id = struct.unpack_from("<QI", data, pos)
+        if length < 4 or pos + 8 + length > len(data):
+            raise Error("Malformed APK Signing Block pair")
+        pairs[block_id] = data[pos + 12 : pos + 8 + length]
+        pos += 8 + length
+    return pairs
+
+
+def _first_value(data: bytes) -> bytes:
+    """The leading uint32-length-prefixed value; v3 signers put plain fields after it."""
+    if len(data) < 4:
+        raise Error("Truncated APK Signing Block value")
+    length = struct.unpack_from("<I", data)[0]
+    if 4 + length > len(data):
+        raise Error("Malformed length-prefixed value in APK Signing Block")
+    return data[4 : 4 + length]
+
+
+def _length_prefixed(data: bytes) -> List[bytes]:
+    """Split a sequence of uint32-length-prefixed values."""
+    values = []
+    pos = 0
+    while pos + 4 <= len(data):
+        length = struct.unpack_from("<I", data, pos)[0]
+        if pos + 4 + length > len(data):
+            raise Error("Malformed length-prefixed value in APK Signing Block")
+        values.append(data[pos + 4 : pos + 4 + length])
+        pos += 4 + length
+    return values
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Low-level zip helpers for rewriting APKs reproducibly.
+
+Entries are appended to a zipfile.ZipFile opened for writing, with headers
+finished exactly the way ZipFile.open(zinfo, "w") does, so callers can mix
+these helpers with the stdlib writer. On top of that:
+
+- copy_raw_entry() copies an entry's compressed bytes verbatim;
+- write_entry() deflates with explicit level/memLevel/strategy, which the
+  stdlib writer cannot express;
+- detect_deflate_params() fingerprints the parameters an entry was deflated
+  with by comparing a bounded prefix of the stream.
+"""
+
+from __future__ import annotations
+
+import struct
+import zipfile
+import zlib
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+from dexfile import DexBuffer, Error
+
+COPY_BUFSIZE = 1024 * 1024
+DATA_DESCRIPTOR_FLAG = 0x08
+DATA_DESCRIPTOR_SIG = 0x08074B50
+LOCAL_HEADER_SIZE = 30
+
+# Compressed bytes compared per candidate before trusting a fingerprint, and the
+# most uncompressed input fed to a candidate while screening.
+FINGERPRINT_BYTES = 64 * 1024
+FINGERPRINT_INPUT = 4 * 1024 * 1024
+FINGERPRINT_CHUNK = 16 * 1024
+
+
+class DeflateParams(NamedTuple):
+    level: int
+    mem_level: int = 8
+    strategy: int = zlib.Z_DEFAULT_STRATEGY
+
+    def compressobj(self) -> "zlib._Compress":
+        return zlib.compressobj(self.level, zlib.DEFLATED, -15, self.mem_level, self.strategy)
+
+
+def _candidates() -> List[DeflateParams]:
+    # zipfile's own settings (memLevel 8, default strategy) first, in the historical
+    # LEVELS order, so the first full match is the one the old detector picked.
+    # Level 0 is left out: its stored blocks follow the writer's input chunking, so
+    # the stream cannot be reproduced from the data alone.
+    ordered = [DeflateParams(level) for level in (9, 6, 4, 1, 8, 7, 5, 3, 2)]
+    for mem_level in (9, 7, 6, 5, 4, 3, 2, 1):
+        ordered += [DeflateParams(level, mem_level) for level in range(9, 0, -1)]
+    for mem_level in (8, 9):
+        # Z_FILTERED only changes the lazy matcher (levels 4-9); Z_FIXED applies to every
+        # non-stored level; Huffman-only and RLE ignore the level once it is non-zero.
+        ordered += [DeflateParams(level, mem_level, zlib.Z_FILTERED) for level in range(9, 3, -1)]
+        ordered += [DeflateParams(level, mem_level, zlib.Z_FIXED) for level in range(9, 0, -1)]
+        ordered += [DeflateParams(9, mem_level, zlib.Z_HUFFMAN_ONLY), DeflateParams(9, mem_level, zlib.Z_RLE)]
+    return ordered
+
+
+DEFLATE_CANDIDATES = _candidates()
+_params_cache: Dict[Tuple[int, int, int], DeflateParams] = {}
+
+
+def data_offset(fh_raw: BinaryIO, info: zipfile.ZipInfo) -> int:
+    """Offset of the entry's compressed data, past the local header's name and extra field."""
+    fh_raw.seek(info.header_offset)
+    n, m = struct.unpack("<HH", fh_raw.read(LOCAL_HEADER_SIZE)[26:30])
+    return info.header_offset + LOCAL_HEADER_SIZE + n + m
+
+
+def iter_raw(fh_raw: BinaryIO, info: zipfile.ZipInfo, bufsize: int = COPY_BUFSIZE) -> Iterator[bytes]:
+    """Yield the entry's stored (still compressed) bytes."""
+    fh_raw.seek(data_offset(fh_raw, info))
+    size = info.compress_size
+    while size > 0:
+        data = fh_raw.read(min(size, bufsize))
+        if not data:
+            raise Error(f"Truncated data for {info.filename!r}")
+        size -= len(data)
+        yield data
+
+
+def iter_buffer(data: DexBuffer, bufsize: int = COPY_BUFSIZE) -> Iterator[memoryview]:
+    with memoryview(data) as view:
+        for pos in range(0, len(view), bufsize):
+            yield view[pos : pos + bufsize]
+
+
+def iter_entry(zf_in: zipfile.ZipFile, info: zipfile.ZipInfo, bufsize: int = COPY_BUFSIZE) -> Iterator[bytes]:
+    """Yield the entry's uncompressed bytes."""
+    with zf_in.open(info) as fh_in:
+        while True:
+            data = fh_in.read(bufsize)
+            if not data:
+                return
+            yield data
+
+
+def copy_raw_entry(fh_raw: BinaryIO, info: zipfile.ZipInfo, zf_out: zipfile.ZipFile, zinfo: zipfile.ZipInfo) -> None:
+    """Append an untouched entry by copying its compressed bytes verbatim.
+
+    The local header, data descriptor and central directory record are exactly
+    what recompressing at the original settings would produce.
+    """
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    zip64 = _begin_entry(zf_out, zinfo)
+    for data in iter_raw(fh_raw, info):
+        zf_out.fp.write(data)
+    _finish_entry(zf_out, zinfo, zip64)
+
+
+def write_entry(
+    zf_out: zipfile.ZipFile, zinfo: zipfile.ZipInfo, file_size: int, chunks: Iterable[bytes], params: DeflateParams | None
+) -> None:
+    """Append an entry from uncompressed chunks, deflating with params unless it is stored.
+
+    With memLevel 8 and the default strategy this writes the same bytes as
+    ZipFile.writestr(zinfo, data) at params.level.
+    """
+    zinfo.file_size = file_size
+    zinfo.CRC = 0
+    zinfo.compress_size = 0
+    zip64 = _begin_entry(zf_out, zinfo)
+    compressor = params.compressobj() if zinfo.compress_type == zipfile.ZIP_DEFLATED and params else None
+    crc = size = compress_size = 0
+    for data in chunks:
+        crc = zlib.crc32(data, crc)
+        size += len(data)
+        if compressor:
+            data = compressor.compress(data)
+        compress_size += len(data)
+        zf_out.fp.write(data)
+    if compressor:
+        tail = compressor.flush()
+        compress_size += len(tail)
+        zf_out.fp.write(tail)
+    if size != file_size:
+        raise Error(f"Size mismatch for {zinfo.filename!r}: expected {file_size}, wrote {size}")
+    if not zip64 and max(size, compress_size) > zipfile.ZIP64_LIMIT:
+        raise Error(f"{zinfo.filename!r} is too large for a non-ZIP64 entry")
+    zinfo.CRC = crc
+    zinfo.compress_size = compress_size
+    _finish_entry(zf_out, zinfo, zip64)
+
+
+def _begin_entry(zf_out: zipfile.ZipFile, zinfo: zipfile.ZipInfo) -> bool:
+    # Mirrors ZipFile._open_to_write().
+    zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+    if zip64 and not zf_out._allowZip64:
+        raise zipfile.LargeZipFile("Filesize would require ZIP64 extensions")
+    fh_out = zf_out.fp
+    fh_out.seek(zf_out.start_dir)
+    zinfo.header_offset = fh_out.tell()
+    zf_out._writecheck(zinfo)
+    zf_out._didModify = True
+    fh_out.write(zinfo.FileHeader(zip64))
+    return zip64
+
+
+def _finish_entry(zf_out: zipfile.ZipFile, zinfo: zipfile.ZipInfo, zip64: bool) -> None:
+    # Mirrors _ZipWriteFile.close().
+    fh_out = zf_out.fp
+    if zinfo.flag_bits & DATA_DESCRIPTOR_FLAG:
+        fmt = "<LLQQ" if zip64 else "<LLLL"
+        fh_out.write(struct.pack(fmt, DATA_DESCRIPTOR_SIG, zinfo.CRC, zinfo.compress_size, zinfo.file_size))
+        zf_out.start_dir = fh_out.tell()
+    else:
+        zf_out.start_dir = fh_out.tell()
+        fh_out.seek(zinfo.header_offset)
+        fh_out.write(zinfo.FileHeader(zip64))
+        fh_out.seek(zf_out.start_dir)
+    zf_out.filelist.append(zinfo)
+    zf_out.NameToInfo[zinfo.filename] = zinfo
+
+
+def detect_deflate_params(fh_raw: BinaryIO, zf_in: zipfile.ZipFile, info: zipfile.ZipInfo) -> DeflateParams:
+    """Find the deflate parameters that reproduce a deflated entry's compressed stream.
+
+    Entries up to FINGERPRINT_INPUT bytes are checked exactly and the first
+    matching candidate wins. Larger entries are screened against the first
+    FINGERPRINT_BYTES of the stream, bailing out at the first differing byte;
+    a unique survivor is accepted, several survivors are fully recompressed
+    in candidate order. Results are cached per (CRC, size, compressed size).
+    """
+    key = (info.CRC, info.file_size, info.compress_size)
+    cached = _params_cache.get(key)
+    if cached is not None:
+        return cached
+    with zf_in.open(info) as fh_in:
+        head = fh_in.read(FINGERPRINT_INPUT)
+    complete = len(head) == info.file_size
+    fh_raw.seek(data_offset(fh_raw, info))
+    expected = fh_raw.read(info.compress_size if complete else min(info.compress_size, FINGERPRINT_BYTES))
+    survivors: List[DeflateParams] = []
+    for params in DEFLATE_CANDIDATES:
+        verdict = _screen(params, head, complete, expected)
+        if verdict:
+            result = params
+            break
+        if verdict is None:
+            survivors.append(params)
+    else:
+        result = survivors[0] if len(survivors) == 1 else _full_match(fh_raw, zf_in, info, survivors)
+    _params_cache[key] = result
+    return result
+
+
+def _screen(params: DeflateParams, head: bytes, complete: bool, expected: bytes) -> bool | None:
+    """False if params cannot produce the stream, True if they reproduce all of it, None if only the prefix is known to match."""
+    compressor = params.compressobj()
+    size = 0
+    view = memoryview(head)
+    for pos in range(0, len(head), FINGERPRINT_CHUNK):
+        out = compressor.compress(view[pos : pos + FINGERPRINT_CHUNK])
+        if not _continues(out, expected, size, complete):
+            return False
+        size += len(out)
+        if not complete and size >= len(expected):
+            return None
+    if not complete:
+        return None
+    out = compressor.flush()
+    return _continues(out, expected, size, complete) and size + len(out) == len(expected)
+
+
+def _continues(out: bytes, expected: bytes, offset: int, complete: bool) -> bool:
+    part = expected[offset : offset + len(out)]
+    if complete and len(part) < len(out):
+        return False
+    return out[: len(part)] == part
+
+
+def _full_match(fh_raw: BinaryIO, zf_in: zipfile.ZipFile, info: zipfile.ZipInfo, candidates: List[DeflateParams]) -> DeflateParams:
+    if candidates:
+        raw_crc = 0
+        for data in iter_raw(fh_raw, info):
+            raw_crc = zlib.crc32(data, raw_crc)
+        for params in candidates:
+            compressor = params.compressobj()
+            crc = size = 0
+            for data in iter_entry(zf_in, info):
+                out = compressor.compress(data)
+                crc = zlib.crc32(out, crc)
+                size += len(out)
+            out = compressor.flush()
+            if size + len(out) == info.compress_size and zlib.crc32(out, crc) == raw_crc:
+                return params
+    raise Error(f"Unable to determine compression parameters for {info.filename!r}")
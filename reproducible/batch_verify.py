@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Verify a backlog of releases: run verify_apk.py for every (tag, APK) pair of a manifest.
+
+The base image is pulled once (and the git mirrors fetched once, with
+VERIFY_GIT_MIRROR=true). Builds (`verify_apk.py --stage build`) then
+run concurrently, as many as the Docker host's CPUs allow at
+GRADLE_WORKERS_MAX workers each and its memory allows at --build-memory
+each. Every finished build is handed to a separate pool of diff workers
+(`--stage diff`). Each stage's output goes to a log file, and a consolidated
+summary is written as JSON and printed as a table.
+
+Manifest: one `<tag> <official-apk>` pair per line (blank lines and `#`
+comments are skipped), or a JSON list of {"tag": ..., "apk": ...} objects.
+
+Usage:
+    ./batch_verify.py <manifest> [--max-builds N] [--build-memory SIZE] [--diff-jobs N] [--out-dir DIR]
+
+Exit status: 0 if every APK matched, 2 if any mismatched or only partially
+matched (see VERIFY_ALLOW_PARTIAL_MATCH), 1 if any stage failed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import NamedTuple
+
+import verify_apk
+from fix_pg_map_id import parse_size
+from verify_apk import FAIL_EMOJI, INFO_EMOJI, OK_EMOJI, STEP_EMOJI, WARN_EMOJI
+
+BUILD_MEMORY_DEFAULT = "10G"
+DIFF_JOBS_DEFAULT = 4
+SUMMARY_NAME = "summary.json"
+# verify_apk.py exit status -> outcome of the diff stage.
+DIFF_OUTCOMES = {0: "match", 2: "mismatch", 4: "partial match"}
+
+
+class BatchEntry(NamedTuple):
+    tag: str
+    apk: Path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", help="Text or JSON manifest of (tag, official APK) pairs")
+    parser.add_argument("--max-builds", type=int, default=0, help="Concurrent builds (0 = derive from Docker CPUs and memory; default: 0)")
+    parser.add_argument(
+        "--build-memory",
+        type=parse_size,
+        default=os.environ.get("VERIFY_BUILD_MEMORY", BUILD_MEMORY_DEFAULT),
+        help=f"Memory reserved per build, e.g. 8G (default: VERIFY_BUILD_MEMORY or {BUILD_MEMORY_DEFAULT})",
+    )
+    parser.add_argument("--diff-jobs", type=int, default=DIFF_JOBS_DEFAULT, help=f"Concurrent diff stages (default: {DIFF_JOBS_DEFAULT})")
+    parser.add_argument("--out-dir", default=None, help="Logs and summary (default artifacts/reproducible/batch)")
+    args = parser.parse_args()
+
+    root_dir = Path(__file__).resolve().parent.parent
+    entries = read_manifest(Path(args.manifest))
+    out_dir = Path(args.out_dir).resolve() if args.out_dir else root_dir / "artifacts" / "reproducible" / "batch"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    verify_apk.need_cmd("docker")
+
+    base_image = os.environ.get("VERIFY_BASE_IMAGE", verify_apk.BASE_IMAGE_DEFAULT)
+    base_tag = verify_apk.read_base_tag()
+    if not base_tag:
+        sys.stderr.write("Missing base image tag; set VERIFY_BASE_TAG or create reproducible/base_image_tag.txt\n")
+        sys.exit(1)
+    platform = os.environ.get("VERIFY_DOCKER_PLATFORM", verify_apk.DOCKER_PLATFORM_DEFAULT)
+    pull_base = os.environ.get("VERIFY_PULL_BASE", "true").lower() == "true"
+    os.chdir(root_dir)
+    verify_apk.ensure_base_image(base_image, base_tag, pull_base, platform)
+    git_mirror = os.environ.get("VERIFY_GIT_MIRROR", "false").lower() == "true"
+    if git_mirror:
+        # One fetch covers every release; the runs below only read the mirrors.
+        mirror_root = Path(os.environ.get("VERIFY_GIT_MIRROR_DIR", root_dir / "artifacts" / "reproducible" / "git")).resolve()
+        repo_url = os.environ.get("VERIFY_REPO_URL", verify_apk.REPO_URL_DEFAULT)
+        print(f"{STEP_EMOJI} Updating git mirrors in {mirror_root}...")
+        for index, entry in enumerate(entries):
+            verify_apk.resolve_ref_in_mirror(entry.tag, repo_url, mirror_root, fetch=index == 0)
+
+    workers_max = int(os.environ.get("GRADLE_WORKERS_MAX", verify_apk.GRADLE_WORKERS_MAX_DEFAULT))
+    max_builds = args.max_builds or build_slots(workers_max, args.build_memory)
+    print(f"{INFO_EMOJI} Verifying {len(entries)} releases: {max_builds} concurrent builds, {args.diff_jobs} concurrent diffs")
+
+    env = os.environ.copy()
+    env["VERIFY_PULL_BASE"] = "false"
+    env["VERIFY_BASE_TAG"] = base_tag
+    if git_mirror:
+        env["VERIFY_GIT_FETCH"] = "false"
+    # Per-run caches must not be shared between concurrent builds; let each run create its own.
+    env.pop("VERIFY_GRADLE_CACHE", None)
+    env.pop("VERIFY_M2_CACHE", None)
+    # The diff stage's exit status is the verdict, so mismatches must not be masked.
+    env.pop("VERIFY_ALLOW_MISMATCH", None)
+
+    start = time.perf_counter()
+    results = {
+        entry.tag: {"tag": entry.tag, "apk": str(entry.apk), "work_dir": str(root_dir / "artifacts" / "reproducible" / (verify_apk.sanitize(entry.tag) or "latest"))}
+        for entry in entries
+    }
+    with ThreadPoolExecutor(max_workers=max_builds) as build_pool, ThreadPoolExecutor(max_workers=max(1, args.diff_jobs)) as diff_pool:
+        builds = {build_pool.submit(run_stage, entry, "build", out_dir, env): entry for entry in entries}
+        diffs: list[Future] = []
+        # Start each diff as soon as its build is done, while other builds keep running.
+        for future in as_completed(builds):
+            result = future.result()
+            results[result["tag"]].update(result)
+            if result["build"] == 0:
+                diffs.append(diff_pool.submit(run_stage, builds[future], "diff", out_dir, env))
+        for future in diffs:
+            result = future.result()
+            results[result["tag"]].update(result)
+
+    summary = [finish_result(results[entry.tag]) for entry in entries]
+    (out_dir / SUMMARY_NAME).write_text(json.dumps({"elapsed": round(time.perf_counter() - start, 1), "releases": summary}, indent=2) + "\n")
+    print_summary(summary)
+    print(f"{INFO_EMOJI} Summary written to {out_dir / SUMMARY_NAME}")
+    outcomes = {result["outcome"] for result in summary}
+    sys.exit(0 if outcomes <= {"match"} else 2 if outcomes <= {"match", "mismatch", "partial match"} else 1)
+
+
+def read_manifest(path: Path) -> list[BatchEntry]:
+    text = path.read_text()
+    if path.suffix == ".json":
+        entries = [BatchEntry(item["tag"], Path(item["apk"])) for item in json.loads(text)]
+    else:
+        entries = []
+        for number, line in enumerate(text.splitlines(), 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split(None, 1)
+            if len(parts) != 2:
+                sys.stderr.write(f"{path}:{number}: expected '<tag> <official-apk>'\n")
+                sys.exit(1)
+            entries.append(BatchEntry(parts[0], Path(parts[1])))
+    entries = [BatchEntry(entry.tag, (path.parent / entry.apk).resolve()) for entry in entries]
+    # Work dirs, app images and build containers are all named after the tag.
+    seen: set[str] = set()
+    for entry in entries:
+        tag_safe = verify_apk.sanitize(entry.tag)
+        if tag_safe in seen:
+            sys.stderr.write(f"Duplicate tag in manifest: {entry.tag}\n")
+            sys.exit(1)
+        seen.add(tag_safe)
+        if not entry.apk.exists():
+            sys.stderr.write(f"Official APK not found: {entry.apk}\n")
+            sys.exit(1)
+    return entries
+
+
+def docker_resources() -> tuple[int, int]:
+    """CPUs and memory (bytes) of the Docker host, falling back to this machine's."""
+    result = verify_apk.run(["docker", "info", "--format", "{{.NCPU}} {{.MemTotal}}"], check=False, capture_output=True)
+    parts = result.stdout.split() if result.returncode == 0 else []
+    if len(parts) == 2 and all(part.isdigit() for part in parts):
+        return int(parts[0]), int(parts[1])
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        memory = 0
+    return os.cpu_count() or 1, memory
+
+
+def build_slots(workers_max: int, build_memory: int) -> int:
+    cpus, memory = docker_resources()
+    by_cpu = cpus // max(1, workers_max)
+    by_memory = memory // build_memory if memory and build_memory else by_cpu
+    slots = max(1, min(by_cpu, by_memory))
+    print(f"{INFO_EMOJI} Docker host: {cpus} CPUs, {memory / 1024**3:.1f} GiB -> {slots} build slots")
+    return slots
+
+
+def run_stage(entry: BatchEntry, stage: str, out_dir: Path, env: dict) -> dict:
+    """Run one verify_apk.py stage for entry, logging to <out-dir>/<tag>.<stage>.log."""
+    log = out_dir / f"{verify_apk.sanitize(entry.tag)}.{stage}.log"
+    cmd = [sys.executable, str(Path(__file__).with_name("verify_apk.py")), entry.tag, str(entry.apk), "--stage", stage]
+    print(f"{STEP_EMOJI} {entry.tag}: {stage} started (log: {log})")
+    start = time.perf_counter()
+    with log.open("w") as fh:
+        returncode = subprocess.run(cmd, stdout=fh, stderr=subprocess.STDOUT, env=env, check=False).returncode
+    elapsed = round(time.perf_counter() - start, 1)
+    emoji = OK_EMOJI if returncode == 0 else WARN_EMOJI if stage == "diff" and returncode in DIFF_OUTCOMES else FAIL_EMOJI
+    print(f"{emoji} {entry.tag}: {stage} finished with status {returncode} in {elapsed}s")
+    return {"tag": entry.tag, stage: returncode, f"{stage}_seconds": elapsed, f"{stage}_log": str(log)}
+
+
+def finish_result(result: dict) -> dict:
+    if result.get("build") != 0:
+        result["outcome"] = "build failed"
+    else:
+        result["outcome"] = DIFF_OUTCOMES.get(result.get("diff", 1), "diff failed")
+    return result
+
+
+def print_summary(summary: list[dict]) -> None:
+    width = max([len(result["tag"]) for result in summary] + [3])
+    print(f"{'tag':<{width}}  {'outcome':<12} {'build':>8} {'diff':>8}")
+    for result in summary:
+        build = f"{result['build_seconds']}s" if "build_seconds" in result else "-"
+        diff = f"{result['diff_seconds']}s" if "diff_seconds" in result else "-"
+        print(f"{result['tag']:<{width}}  {result['outcome']:<12} {build:>8} {diff:>8}")
+
+
+if __name__ == "__main__":
+    main()
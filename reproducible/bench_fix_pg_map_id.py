@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark DEX map-id patching: copying regex rewrite vs in-place patch.
+
+For every classes*.dex in the APK this runs the legacy copying rewrite and the
+in-place patch on identical input, checks that both produce the same bytes and
+CRC32, and reports wall time plus peak Python heap allocated on top of the
+input buffer (via tracemalloc).
+
+Usage:
+    ./bench_fix_pg_map_id.py <apk> [<map-id-hex>] [--repeat N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import time
+import tracemalloc
+import zipfile
+from typing import Callable, Tuple
+
+import dexfile
+import fix_pg_map_id
+from fix_pg_map_id import CLASSES_DEX_RE, DexBuffer
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("apk", help="APK whose classes*.dex are patched")
+    parser.add_argument("map_id", nargs="?", default=None, help="Target map-id (default: embedded map-id with every digit bumped)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant; the fastest is reported (default: 3)")
+    args = parser.parse_args()
+
+    print(f"{'dex':<16} {'size':>10} {'copy s':>8} {'copy peak':>10} {'inplace s':>10} {'inplace peak':>13}")
+    with zipfile.ZipFile(args.apk) as zf:
+        for info in zf.infolist():
+            if not CLASSES_DEX_RE.fullmatch(info.filename):
+                continue
+            original = zf.read(info)
+            map_id = (args.map_id or _bumped_map_id(original)).encode()
+            copy_time, copy_peak, copy_out = _measure(
+                lambda: original, lambda data: fix_pg_map_id._fix_dex_id_checksum_resized(data, map_id), args.repeat
+            )
+            inplace_time, inplace_peak, inplace_out = _measure(
+                lambda: bytearray(original), lambda data: fix_pg_map_id._fix_dex_id_checksum(data, map_id), args.repeat
+            )
+            if (bytes(copy_out[0]), copy_out[1]) != (bytes(inplace_out[0]), inplace_out[1]):
+                raise fix_pg_map_id.Error(f"In-place and copying patch disagree for {info.filename!r}")
+            print(
+                f"{info.filename:<16} {_mib(len(original)):>10} {copy_time:>8.3f} {_mib(copy_peak):>10} "
+                f"{inplace_time:>10.3f} {_mib(inplace_peak):>13}"
+            )
+
+
+def _measure(
+    make_input: Callable[[], DexBuffer], fn: Callable[[DexBuffer], Tuple[DexBuffer, int]], repeat: int
+) -> Tuple[float, int, Tuple[DexBuffer, int]]:
+    """Return (best wall time, peak traced allocation, result); timing runs are not traced."""
+    best_time = float("inf")
+    result: Tuple[DexBuffer, int] | None = None
+    for _ in range(repeat):
+        data = make_input()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn(data)
+        best_time = min(best_time, time.perf_counter() - start)
+    data = make_input()
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert result is not None
+    return best_time, peak, result
+
+
+def _bumped_map_id(data: bytes) -> str:
+    current = dexfile.get_pg_map_id(data)
+    if not current:
+        raise fix_pg_map_id.Error("No pg-map-id found; pass a map-id explicitly")
+    return "".join(f"{(int(c, 16) + 1) % 16:x}" for c in current)
+
+
+def _mib(size: int) -> str:
+    return f"{size / (1024 * 1024):.2f}MiB"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Content-addressed store for the APKs and reports verify_apk.py keeps.
+
+Each distinct file is stored once, read-only, under <store>/sha256/<ab>/<digest>.
+Work and report directories get one of three things, in order of preference:
+a reflink (copy-on-write clone) of the blob, a hardlink to it, or a plain
+copy when the store is on another filesystem. So an official or rebuilt APK
+takes its size on disk once, however many tags and report views refer to it.
+
+Files are only ever put into place from the store and never written through.
+verify_apk.py unlinks a destination before it regenerates it, so a hardlinked
+blob cannot be modified by accident.
+
+`gc` deletes blobs that no file under the scanned roots refers to. A file
+refers to a blob when it is a hardlink of it or has the same size and SHA-256
+(the sha256sums.json sidecars are reused where they are current). Blobs
+younger than --min-age are always kept, since a running verification may be
+about to link them.
+
+Usage:
+    ./blobstore.py gc [--store DIR] [--root DIR ...] [--min-age HOURS] [--dry-run]
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+# Linux FICLONE ioctl (_IOW(0x94, 9, int)): share src's extents with dst (btrfs, XFS, bcachefs, ...).
+FICLONE = 0x40049409
+# Shared by every tool that hashes files (verify_apk.py, checkpoint.py, buildcache.py).
+HASH_BUFSIZE = 1024 * 1024
+# Per-directory sidecar of {name: {sha256, size, mtime_ns}} that lets a digest be reused while the file is unchanged.
+HASH_MANIFEST = "sha256sums.json"
+MIN_AGE_HOURS_DEFAULT = 1.0
+
+
+def blob_path(store: Path, digest: str) -> Path:
+    return store / "sha256" / digest[:2] / digest
+
+
+def add(store: Path, src: Path, digest: str) -> Path:
+    """Store a copy (reflink if possible) of src under digest unless the blob exists already; return the blob path."""
+    blob = blob_path(store, digest)
+    if blob.exists():
+        return blob
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    staging = blob.with_name(f".{digest}.{os.getpid()}.tmp")
+    try:
+        _reflink(src, staging)
+    except OSError:
+        shutil.copyfile(src, staging)
+    staging.chmod(0o444)
+    staging.replace(blob)
+    return blob
+
+
+def link(store: Path, digest: str, dest: Path) -> str:
+    """Put the blob for digest at dest (replacing dest); return how: "reflink", "hardlink" or "copy"."""
+    blob = blob_path(store, digest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    dest.unlink(missing_ok=True)
+    try:
+        _reflink(blob, dest)
+        return "reflink"
+    except OSError:
+        pass
+    try:
+        os.link(blob, dest)
+        return "hardlink"
+    except OSError:
+        pass
+    shutil.copyfile(blob, dest)
+    dest.chmod(0o644)
+    return "copy"
+
+
+def collect_garbage(store: Path, roots: list[Path], min_age: float, dry_run: bool = False) -> tuple[int, int]:
+    """Delete blobs not referenced from roots and older than min_age seconds; return (blobs removed, bytes freed)."""
+    blobs = {path.name: path for path in (store / "sha256").glob("*/*") if path.is_file() and not path.name.startswith(".")}
+    inodes = {(st.st_dev, st.st_ino): name for name, st in ((name, path.stat()) for name, path in blobs.items())}
+    sizes = {path.stat().st_size for path in blobs.values()}
+    referenced: set[str] = set()
+    for root in roots:
+        for directory, dirnames, filenames in os.walk(root):
+            if Path(directory).resolve() == store.resolve():
+                dirnames.clear()
+                continue
+            sidecar = load_hash_manifest(Path(directory))
+            for filename in filenames:
+                path = Path(directory) / filename
+                st = path.lstat()
+                if not path.is_file() or path.is_symlink() or st.st_size not in sizes:
+                    continue
+                if (st.st_dev, st.st_ino) in inodes:
+                    referenced.add(inodes[(st.st_dev, st.st_ino)])
+                    continue
+                entry = sidecar.get(filename) or {}
+                current = entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns
+                digest = entry.get("sha256") if current else sha256_file(path)
+                if digest in blobs:
+                    referenced.add(digest)
+    removed = freed = 0
+    cutoff = time.time() - min_age
+    for name, path in blobs.items():
+        st = path.stat()
+        if name in referenced or st.st_mtime > cutoff:
+            continue
+        removed += 1
+        freed += st.st_size
+        if not dry_run:
+            path.unlink()
+            try:
+                path.parent.rmdir()
+            except OSError:
+                pass
+    return removed, freed
+
+
+def _reflink(src: Path, dest: Path) -> None:
+    if sys.platform != "linux":
+        raise OSError("reflinks are only attempted on Linux")
+    import fcntl
+
+    with src.open("rb") as fh_src, dest.open("xb") as fh_dest:
+        try:
+            fcntl.ioctl(fh_dest.fileno(), FICLONE, fh_src.fileno())
+        except OSError:
+            dest.unlink(missing_ok=True)
+            raise
+
+
+def load_hash_manifest(directory: Path) -> dict:
+    try:
+        return json.loads((directory / HASH_MANIFEST).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    buf = bytearray(HASH_BUFSIZE)
+    view = memoryview(buf)
+    with path.open("rb", buffering=0) as fh:
+        while n := fh.readinto(buf):
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def main() -> None:
+    root_dir = Path(__file__).resolve().parent.parent
+    default_store = Path(os.environ.get("VERIFY_BLOB_DIR", root_dir / "artifacts" / "reproducible" / "blobs"))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    gc = sub.add_parser("gc", help="Delete unreferenced blobs")
+    gc.add_argument("--store", type=Path, default=default_store, help="Blob store (default: VERIFY_BLOB_DIR or artifacts/reproducible/blobs)")
+    gc.add_argument("--root", type=Path, action="append", help="Directory whose files keep blobs alive; repeatable (default: artifacts/reproducible)")
+    gc.add_argument("--min-age", type=float, default=MIN_AGE_HOURS_DEFAULT, help=f"Keep blobs younger than this many hours (default: {MIN_AGE_HOURS_DEFAULT})")
+    gc.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+    args = parser.parse_args()
+
+    roots = args.root or [root_dir / "artifacts" / "reproducible"]
+    removed, freed = collect_garbage(args.store, roots, args.min_age * 3600, args.dry_run)
+    action = "Would remove" if args.dry_run else "Removed"
+    print(f"{action} {removed} unreferenced blobs ({freed / 1024**2:.1f} MiB) from {args.store}")
+
+
+if __name__ == "__main__":
+    main()
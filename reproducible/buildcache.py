@@ -0,0 +1,145 @@
+"""
+Persistent, integrity-checked dependency cache for verify_apk.py builds.
+
+A snapshot holds the dependency part of a Gradle user home (caches/modules-2
+and wrapper/dists) and of a Maven home (repository), keyed by the SHA-256 of
+the build's dependency inputs (every *.lockfile, gradle/libs.versions.toml,
+gradle/verification-metadata.xml and the wrapper properties) plus the base
+image. Its manifest records a SHA-256 for every file; a snapshot is only used
+when its key matches and every file still hashes to the recorded digest.
+
+Warm builds never write to a snapshot: Gradle reads modules-2 through a
+read-only mount (GRADLE_RO_DEP_CACHE), the wrapper distribution and the Maven
+repository are copied into the fresh per-run homes. After every N warm builds,
+the next warm build is followed by a cold control build of the same commit,
+so the control always has a warm digest to compare with. Any warm and cold
+builds of one commit that hash differently discard the snapshot and fail the
+run.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from blobstore import sha256_file
+
+CACHE_MANIFEST = "manifest.json"
+CACHE_STATE = "state.json"
+# Paths copied out of a finished build, relative to the Gradle and Maven homes.
+GRADLE_PARTS = ("caches/modules-2", "wrapper/dists")
+MAVEN_PARTS = ("repository",)
+# Lock files, GC markers and half-downloaded files are per-process state, not dependency contents.
+SNAPSHOT_IGNORE = shutil.ignore_patterns("*.lock", "gc.properties", "*.part", "*.ok", "*.tmp")
+
+
+def cache_key(inputs: dict[str, str], base_ref: str) -> str:
+    """Key over the dependency input files (path -> SHA-256) and the base image reference."""
+    payload = json.dumps({"inputs": inputs, "base": base_ref}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def snapshot_dir(cache_root: Path, key: str) -> Path:
+    return cache_root / key[:16]
+
+
+def open_snapshot(cache_root: Path, key: str) -> Path | None:
+    """The snapshot for key if its manifest matches and every file verifies, otherwise None (a bad snapshot is removed)."""
+    snapshot = snapshot_dir(cache_root, key)
+    try:
+        manifest = json.loads((snapshot / CACHE_MANIFEST).read_text())
+    except (OSError, ValueError):
+        return None
+    if manifest.get("key") != key:
+        print(f"Cache snapshot {snapshot} was made for different dependency inputs; ignoring it.")
+        return None
+    files: dict[str, str] = manifest.get("files", {})
+    actual = _hash_tree(snapshot, exclude=CACHE_MANIFEST)
+    if actual != files:
+        changed = sorted(name for name in files.keys() | actual.keys() if files.get(name) != actual.get(name))
+        print(f"Cache snapshot {snapshot} failed verification ({len(changed)} files differ, e.g. {changed[0]}); discarding it.")
+        discard_snapshot(cache_root, key)
+        return None
+    return snapshot
+
+
+def save_snapshot(cache_root: Path, key: str, inputs: dict[str, str], gradle_home: Path, maven_home: Path) -> Path:
+    """Copy the dependency parts of a cold build's homes into a new snapshot and write its manifest."""
+    snapshot = snapshot_dir(cache_root, key)
+    staging = snapshot.with_name(f"{snapshot.name}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    for home, target, parts in ((gradle_home, "gradle", GRADLE_PARTS), (maven_home, "m2", MAVEN_PARTS)):
+        for part in parts:
+            src = home / part
+            if src.is_dir():
+                shutil.copytree(src, staging / target / part, ignore=SNAPSHOT_IGNORE, symlinks=True)
+    staging.mkdir(parents=True, exist_ok=True)
+    manifest = {"key": key, "inputs": inputs, "created": int(time.time()), "files": _hash_tree(staging)}
+    (staging / CACHE_MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+    shutil.rmtree(snapshot, ignore_errors=True)
+    staging.rename(snapshot)
+    return snapshot
+
+
+def discard_snapshot(cache_root: Path, key: str) -> None:
+    shutil.rmtree(snapshot_dir(cache_root, key), ignore_errors=True)
+
+
+def seed_homes(snapshot: Path, gradle_home: Path, maven_home: Path) -> Path:
+    """Copy the wrapper distribution and Maven repository into the per-run homes; return the read-only Gradle cache dir."""
+    for part in GRADLE_PARTS[1:]:
+        if (snapshot / "gradle" / part).is_dir():
+            shutil.copytree(snapshot / "gradle" / part, gradle_home / part, symlinks=True, dirs_exist_ok=True)
+    for part in MAVEN_PARTS:
+        if (snapshot / "m2" / part).is_dir():
+            shutil.copytree(snapshot / "m2" / part, maven_home / part, symlinks=True, dirs_exist_ok=True)
+    return snapshot / "gradle" / "caches"
+
+
+def cold_run_due(cache_root: Path, every: int) -> bool:
+    """True when `every` warm builds have run since a cold build was last compared with a warm one (every <= 0 disables the control)."""
+    return every > 0 and load_state(cache_root).get("warm_runs_since_cold", 0) >= every
+
+
+def record_build(cache_root: Path, key: str, commit: str, mode: str, apk_sha256: str) -> str | None:
+    """Remember the rebuilt APK digest of a "cold" or "warm" build of commit; return the other mode's digest if it disagrees."""
+    state = load_state(cache_root)
+    builds = state.setdefault("builds", {}).setdefault(key, {}).setdefault(commit, {})
+    builds[mode] = apk_sha256
+    if mode == "warm":
+        state["warm_runs_since_cold"] = state.get("warm_runs_since_cold", 0) + 1
+    elif builds.get("warm"):
+        # Only a cold build that could be checked against a warm one counts as a control.
+        state["warm_runs_since_cold"] = 0
+    save_state(cache_root, state)
+    cold = builds.get("cold")
+    if mode == "warm" and cold and cold != apk_sha256:
+        return cold
+    if mode == "cold" and builds.get("warm") and builds["warm"] != apk_sha256:
+        return builds["warm"]
+    return None
+
+
+def load_state(cache_root: Path) -> dict:
+    try:
+        return json.loads((cache_root / CACHE_STATE).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(cache_root: Path, state: dict) -> None:
+    cache_root.mkdir(parents=True, exist_ok=True)
+    (cache_root / CACHE_STATE).write_text(json.dumps(state, indent=2, sort_keys=True) + "\n")
+
+
+def _hash_tree(root: Path, exclude: str = "") -> dict[str, str]:
+    """SHA-256 of every regular file under root, keyed by its POSIX path relative to root."""
+    names = sorted(path.relative_to(root).as_posix() for path in root.rglob("*") if path.is_file() and not path.is_symlink())
+    names = [name for name in names if name != exclude]
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+        return dict(zip(names, pool.map(sha256_file, [root / name for name in names])))
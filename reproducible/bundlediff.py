@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Compare a rebuilt App Bundle with an official bundle or with split APKs, entry by entry.
+
+The official side is either an .aab or the split APKs Play delivered for one
+device. They can come from `adb pull` (base.apk, split_config.<config>.apk,
+split_<module>.apk) or from `bundletool build-apks` (<module>-master.apk,
+<module>-<config>.apk). Split entries are mapped back to their bundle paths:
+base/dex/classes.dex is classes.dex in base.apk, base/root/X is X, and
+BUNDLE-METADATA/.../baseline.prof is assets/dexopt/baseline.prof. Entries
+that bundletool converts (the proto manifest, resources.pb and compiled XML
+resources) cannot be compared byte for byte. They are listed as
+`not_comparable`, and a report with any of them is not `complete`: matching
+entries alone do not prove the manifest or the resources match. Bundle
+entries that the given splits do not carry (other ABIs or densities) are
+counted separately.
+
+Entries are compared on CRC32 and size from the central directories. Only
+entries that differ are inflated, in chunks and side by side, to find the
+first differing offset. Nothing is extracted, and memory stays bounded however
+large the bundle is.
+
+Usage:
+    ./bundlediff.py <official.aab | split-apk-dir | split.apk ...> <rebuilt.aab> [--json REPORT]
+
+Exit status: 0 if every entry was compared and none differs, 1 if an entry
+differs, 4 if no compared entry differs but some could not be compared.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+import zipfile
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple
+
+import apkzip
+from apkdiff import is_signing_entry
+
+BUNDLE_PROF_DIR = "BUNDLE-METADATA/com.android.tools.build.profiles/"
+# Module subdirectories whose files keep their relative path in the split APKs.
+MODULE_DIRS = ("assets/", "lib/", "res/")
+# Bundle-level entries and per-module protobuf metadata that no APK carries.
+BUNDLE_ONLY_RE = re.compile(r"BundleConfig\.pb|BUNDLE-METADATA/.*|META-INF/.*|[^/]+/(?:assets|native|apex)\.pb")
+# Exit status when the compared entries match but converted entries could not be compared (verify_apk.py uses it too).
+PARTIAL_MATCH_EXIT = 4
+SPLIT_NAME_RES = (
+    re.compile(r"(?P<module>base)\.apk"),
+    re.compile(r"split_config\..+\.apk"),
+    re.compile(r"split_(?P<module>[^.]+)(?:\.config\..+)?\.apk"),
+    re.compile(r"(?P<module>[^-]+)-.+\.apk"),
+)
+
+
+class Entry(NamedTuple):
+    archive: Path
+    info: zipfile.ZipInfo
+    converted: bool  # rewritten by bundletool on its way into an APK
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("official", nargs="+", help="Official .aab, a directory of split APKs, or the split APKs themselves")
+    parser.add_argument("rebuilt", help="Rebuilt .aab")
+    parser.add_argument("--json", default=None, help="Write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    official = [Path(path) for path in args.official]
+    if len(official) == 1 and official[0].is_dir():
+        official = split_apks(official[0])
+    if not official:
+        parser.error("no split APKs found")
+    report = diff_bundle(official, Path(args.rebuilt))
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2) + "\n")
+        print_summary(report)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    sys.exit(1 if not report["identical"] else 0 if report["complete"] else PARTIAL_MATCH_EXIT)
+
+
+def split_apks(directory: Path) -> List[Path]:
+    """The split APKs in directory, base first; universal/standalone APKs are left out."""
+    apks = [path for path in sorted(directory.glob("*.apk")) if not path.name.startswith(("standalone", "universal"))]
+    return sorted(apks, key=lambda path: path.name not in ("base.apk", "base-master.apk"))
+
+
+def split_module(apk_name: str) -> str:
+    """Module a split APK belongs to, from its file name (config splits of base are base)."""
+    for pattern in SPLIT_NAME_RES:
+        match = pattern.fullmatch(apk_name)
+        if match:
+            return match.groupdict().get("module") or "base"
+    raise ValueError(f"Unrecognized split APK name {apk_name!r}")
+
+
+def base_split(apks: List[Path]) -> Path:
+    """The base module's master split, which holds its dex files."""
+    for apk in apks:
+        if apk.name in ("base.apk", "base-master.apk"):
+            return apk
+    raise ValueError("No base.apk or base-master.apk among the split APKs")
+
+
+def archive_entries(archive: Path) -> Dict[str, Entry]:
+    """Entries of archive under their own names (first occurrence wins)."""
+    entries: Dict[str, Entry] = {}
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            if not info.is_dir():
+                entries.setdefault(info.filename, Entry(archive, info, False))
+    return entries
+
+
+def bundle_entries(aab: Path) -> Tuple[Dict[str, Entry], List[str]]:
+    """Entries of aab keyed by <module>:<path in the module's APKs>, and the bundle-only entry names."""
+    entries: Dict[str, Entry] = {}
+    bundle_only: List[str] = []
+    with zipfile.ZipFile(aab) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            key, converted = apk_path(info.filename)
+            if key is None:
+                bundle_only.append(info.filename)
+            else:
+                entries.setdefault(key, Entry(aab, info, converted))
+    return entries, bundle_only
+
+
+def apk_path(name: str) -> Tuple[str | None, bool]:
+    """(<module>:<path in the APK>, converted) for a bundle entry name, or (None, False) if no APK carries it."""
+    if name.startswith(BUNDLE_PROF_DIR) and name.endswith((".prof", ".profm")):
+        return f"base:assets/dexopt/{name[len(BUNDLE_PROF_DIR):]}", False
+    if BUNDLE_ONLY_RE.fullmatch(name) or "/" not in name:
+        return None, False
+    module, rest = name.split("/", 1)
+    if rest.startswith("dex/"):
+        return f"{module}:{rest[len('dex/'):]}", False
+    if rest.startswith("root/"):
+        return f"{module}:{rest[len('root/'):]}", False
+    if rest == "manifest/AndroidManifest.xml":
+        return f"{module}:AndroidManifest.xml", True
+    if rest == "resources.pb":
+        return f"{module}:resources.arsc", True
+    if rest.startswith(MODULE_DIRS):
+        return f"{module}:{rest}", rest.startswith("res/") and rest.endswith(".xml")
+    return None, False
+
+
+def split_entries(apks: List[Path]) -> Dict[str, Entry]:
+    """Entries of the split APKs keyed by <module>:<path>; the first split carrying a path wins."""
+    entries: Dict[str, Entry] = {}
+    for apk in apks:
+        module = split_module(apk.name)
+        with zipfile.ZipFile(apk) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                converted = info.filename in ("AndroidManifest.xml", "resources.arsc") or (info.filename.startswith("res/") and info.filename.endswith(".xml"))
+                entries.setdefault(f"{module}:{info.filename}", Entry(apk, info, converted))
+    return entries
+
+
+def diff_bundle(official: List[Path], rebuilt_aab: Path) -> Dict[str, Any]:
+    """Report of every comparable entry whose content differs between official (one .aab or split APKs) and rebuilt_aab."""
+    if len(official) == 1 and official[0].suffix == ".aab":
+        # Bundle against bundle: every entry is compared under its own name.
+        official_entries, rebuilt = archive_entries(official[0]), archive_entries(rebuilt_aab)
+        only_rebuilt = [name for name in rebuilt if name not in official_entries and not is_signing_entry(name)]
+        not_delivered: List[str] = []
+    else:
+        official_entries = split_entries(official)
+        rebuilt, bundle_only = bundle_entries(rebuilt_aab)
+        only_rebuilt = []
+        not_delivered = [key for key in rebuilt if key not in official_entries] + bundle_only
+
+    compared = 0
+    converted: List[str] = []
+    only_official: List[str] = []
+    differing: List[Tuple[str, Entry, Entry]] = []
+    for key, entry in official_entries.items():
+        name = key.split(":", 1)[-1]
+        if entry.converted or rebuilt.get(key, entry).converted:
+            converted.append(key)
+        elif is_signing_entry(name):
+            continue
+        elif key not in rebuilt:
+            only_official.append(key)
+        else:
+            compared += 1
+            other = rebuilt[key]
+            if (entry.info.CRC, entry.info.file_size) != (other.info.CRC, other.info.file_size):
+                differing.append((key, entry, other))
+
+    entries = []
+    with ExitStack() as stack:
+        archives: Dict[Path, zipfile.ZipFile] = {}
+
+        def open_zip(path: Path) -> zipfile.ZipFile:
+            if path not in archives:
+                archives[path] = stack.enter_context(zipfile.ZipFile(path))
+            return archives[path]
+
+        for key, entry, other in differing:
+            entries.append(
+                {
+                    "name": key,
+                    "official": f"{entry.archive.name}!{entry.info.filename}",
+                    "rebuilt": other.info.filename,
+                    "crc": [entry.info.CRC, other.info.CRC],
+                    "file_size": [entry.info.file_size, other.info.file_size],
+                    "first_difference": first_difference(open_zip(entry.archive), entry.info, open_zip(other.archive), other.info),
+                }
+            )
+
+    summary = {
+        "compared": compared,
+        "content_differs": len(entries),
+        "only_in_official": len(only_official),
+        "only_in_rebuilt": len(only_rebuilt),
+        "not_comparable": len(converted),
+        "not_delivered": len(not_delivered),
+    }
+    return {
+        "official": [str(path) for path in official],
+        "rebuilt": str(rebuilt_aab),
+        "identical": not (entries or only_official or only_rebuilt),
+        "complete": not converted,
+        "summary": summary,
+        "only_in_official": only_official,
+        "only_in_rebuilt": only_rebuilt,
+        "not_comparable": converted,
+        "not_delivered": not_delivered,
+        "entries": entries,
+    }
+
+
+def first_difference(zf_a: zipfile.ZipFile, info_a: zipfile.ZipInfo, zf_b: zipfile.ZipFile, info_b: zipfile.ZipInfo) -> int | None:
+    """Offset of the first byte where the two inflated entries differ (or where the shorter one ends); None if equal."""
+    offset = 0
+    chunks_a, chunks_b = _rechunk(apkzip.iter_entry(zf_a, info_a)), _rechunk(apkzip.iter_entry(zf_b, info_b))
+    for chunk_a, chunk_b in zip(chunks_a, chunks_b):
+        if chunk_a != chunk_b:
+            return offset + next((i for i, (a, b) in enumerate(zip(chunk_a, chunk_b)) if a != b), min(len(chunk_a), len(chunk_b)))
+        offset += len(chunk_a)
+    return None if info_a.file_size == info_b.file_size else min(info_a.file_size, info_b.file_size)
+
+
+def _rechunk(chunks: Iterator[bytes], size: int = apkzip.COPY_BUFSIZE) -> Iterator[bytes]:
+    """Re-cut a stream into fixed-size chunks, so two streams can be compared chunk by chunk."""
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        while len(pending) >= size:
+            yield pending[:size]
+            pending = pending[size:]
+    if pending:
+        yield pending
+
+
+def print_summary(report: Dict[str, Any]) -> None:
+    summary = report["summary"]
+    skipped = f"not comparable={summary['not_comparable']}, not in these splits={summary['not_delivered']}"
+    if report["identical"]:
+        print(f"No entry differences ({summary['compared']} entries compared; {skipped})")
+        return
+    print(
+        f"Entries differ: content={summary['content_differs']} only-official={summary['only_in_official']} "
+        f"only-rebuilt={summary['only_in_rebuilt']} ({summary['compared']} compared; {skipped})"
+    )
+    for entry in report["entries"]:
+        print(f"  content {entry['name']}: first difference at byte {entry['first_difference']}")
+    for key in ("only_in_official", "only_in_rebuilt"):
+        for name in report[key]:
+            print(f"  {key.replace('_', '-')} {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Input-keyed stage checkpoints, so that a rerun of verify_apk.py skips work that is already done.
+
+Each expensive stage is keyed by the SHA-256 of its inputs: the Docker/Gradle
+build, the map-id patch, the signature copy and the diff reports. Inputs are
+things like the resolved commit, base image ID, Gradle task, map-id seed, APK
+hashes and tool digests. The outputs a stage produced are recorded in
+<work-dir>/stages.json with their size, mtime and SHA-256.
+
+A rerun skips a stage when its key is unchanged and its outputs are still in
+place and unmodified. The first stage that does run invalidates itself and
+every stage after it: their outputs are removed before the run resumes, so
+nothing stale from the previous run is picked up.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Iterable
+
+from blobstore import sha256_file
+
+STAGE_MANIFEST = "stages.json"
+# Checkpointed stages in run order; --force-stage takes these names.
+STAGES = ("build", "map_id_patch", "signature_copy", "diff_reports")
+
+
+def input_key(inputs: dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def tool_digest(paths: Iterable[Path]) -> str:
+    """SHA-256 over the contents of the scripts and build files a stage runs."""
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(path.name.encode() + b"\0")
+        h.update(path.read_bytes() if path.exists() else b"")
+    return h.hexdigest()
+
+
+class Checkpoints:
+    def __init__(self, work_dir: Path, force: Iterable[str] = ()) -> None:
+        self.work_dir = work_dir
+        self.path = work_dir / STAGE_MANIFEST
+        self.force = set(force)
+        self.skipped: list[str] = []
+        self._resumed = False
+        self._pending: dict[str, str] = {}
+        try:
+            self.stages: dict[str, dict[str, Any]] = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            self.stages = {}
+
+    def skip(self, name: str, inputs: dict[str, Any]) -> bool:
+        """True if stage name already ran with these inputs and its outputs are intact; otherwise invalidate it and what follows."""
+        key = input_key(inputs)
+        entry = self.stages.get(name)
+        if not self._resumed and name not in self.force and entry and entry["key"] == key and self._intact(entry):
+            self.skipped.append(name)
+            return True
+        self._invalidate(name)
+        self._pending[name] = key
+        return False
+
+    def record(self, name: str, outputs: Iterable[Path]) -> None:
+        """Record the outputs of stage name, which skip() let run."""
+        files = {}
+        for path in outputs:
+            if path.is_file():
+                st = path.stat()
+                files[path.relative_to(self.work_dir).as_posix()] = {"sha256": sha256_file(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        self.stages[name] = {"key": self._pending.pop(name), "outputs": files}
+        self.path.write_text(json.dumps(self.stages, indent=2) + "\n")
+
+    def discard(self, name: str) -> None:
+        """Forget stage name when this run takes a path that does not produce it, so its stale outputs are not picked up."""
+        if name in self.stages:
+            self._invalidate(name)
+
+    def _intact(self, entry: dict[str, Any]) -> bool:
+        for name, recorded in entry["outputs"].items():
+            path = self.work_dir / name
+            if not path.is_file():
+                return False
+            st = path.stat()
+            if st.st_size != recorded["size"] or (st.st_mtime_ns != recorded["mtime_ns"] and sha256_file(path) != recorded["sha256"]):
+                return False
+        return True
+
+    def _invalidate(self, name: str) -> None:
+        self._resumed = True
+        later = STAGES[STAGES.index(name) :]
+        for stage in [stage for stage in self.stages if stage in later]:
+            for output in self.stages.pop(stage)["outputs"]:
+                (self.work_dir / output).unlink(missing_ok=True)
+        self.path.write_text(json.dumps(self.stages, indent=2) + "\n")
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Structural diff of two dex files, or of every classes*.dex of two APKs, without dexdump.
+
+Classes are matched by descriptor and methods by name and prototype across
+all dex files, so a class that moved to another classes*.dex is still paired
+(and reported as moved). Only what changed is reported: class attributes,
+fields, methods (access flags, register counts, instructions with pool
+references resolved, try/catch handlers, debug info, annotations), plus
+strings that were added or removed. The dex checksum and signature are never
+compared, and the map-id in the R8 marker and r8-map-id-* strings is masked
+unless --keep-map-id is given.
+
+Usage:
+    ./dexdiff.py <official-apk-or-dex> <rebuilt-apk-or-dex> [--json REPORT] [--keep-map-id]
+
+Exit status: 0 if there is no structural difference, 1 otherwise.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import dexfile
+from dexfile import FIELD, METHOD, NO_INDEX, PROTO, STRING, TYPE, ClassDef, DexBuffer, EncodedMember
+
+MAP_ID_MASK = "<map-id>"
+MARKER_MAP_ID_TEXT_RE = re.compile(r'("pg-map-id":")[0-9a-f]+(")')
+R8_MAP_STRING_TEXT_RE = re.compile(r"(r8-map-id-)[0-9a-f]{32,64}")
+SUMMARY_LINES = 20
+SUMMARY_WIDTH = 200
+
+
+class DexModel:
+    """One dex file with its string/type/proto/field/method pools resolved to text."""
+
+    def __init__(self, name: str, data: DexBuffer, mask_map_id: bool = True) -> None:
+        self.name = name
+        self.data = data
+        self.header = dexfile.read_header(data)
+        strings = dexfile.read_strings(data, self.header)
+        if mask_map_id:
+            strings = [mask_map_ids(value) for value in strings]
+        self.strings = strings
+        self.types = [strings[idx] for idx in dexfile.read_type_ids(data, self.header)]
+        self.protos = [
+            "(" + "".join(self.types[idx] for idx in dexfile.read_type_list(data, proto.parameters_off)) + ")" + self.types[proto.return_type_idx]
+            for proto in dexfile.read_proto_ids(data, self.header)
+        ]
+        self.fields = [f"{self.types[f.class_idx]}->{strings[f.name_idx]}:{self.types[f.type_idx]}" for f in dexfile.read_field_ids(data, self.header)]
+        self.methods = [f"{self.types[m.class_idx]}->{strings[m.name_idx]}{self.protos[m.proto_idx]}" for m in dexfile.read_method_ids(data, self.header)]
+        self.class_defs = {self.types[c.class_idx]: c for c in dexfile.read_class_defs(data, self.header)}
+        self._pools = {STRING: self.strings, TYPE: self.types, PROTO: self.protos, FIELD: self.fields, METHOD: self.methods}
+
+    def resolve(self, kind: str, idx: int) -> Any:
+        if idx in (NO_INDEX, -1):
+            return None
+        pool = self._pools.get(kind)
+        if pool is None:
+            # call_site and method_handle items are not resolved; compare them by index.
+            return f"{kind}@{idx}"
+        return pool[idx] if idx < len(pool) else f"{kind}@{idx}?"
+
+    def same_pools(self, other: DexModel) -> bool:
+        """True if every pool resolves identically, so raw code bytes can be compared as-is."""
+        return all(self._pools[kind] == other._pools[kind] for kind in self._pools)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("official", help="Reference APK or dex")
+    parser.add_argument("rebuilt", help="APK or dex to compare")
+    parser.add_argument("--json", default=None, help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--keep-map-id", action="store_true", help="Report map-id string differences instead of masking them")
+    args = parser.parse_args()
+
+    mask = not args.keep_map_id
+    report = diff_dex(load_dex(Path(args.official), mask), load_dex(Path(args.rebuilt), mask))
+    if args.json:
+        Path(args.json).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.json).write_text(json.dumps(report, indent=2) + "\n")
+        print_summary(report)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    sys.exit(0 if report["identical"] else 1)
+
+
+def mask_map_ids(value: str) -> str:
+    if "map-id" not in value:
+        return value
+    value = R8_MAP_STRING_TEXT_RE.sub(rf"\g<1>{MAP_ID_MASK}", value)
+    if value.startswith(("~~R8{", "~~D8{", "~~L8{")):
+        value = MARKER_MAP_ID_TEXT_RE.sub(rf"\g<1>{MAP_ID_MASK}\g<2>", value)
+    return value
+
+
+def load_dex(path: Path | zipfile.ZipFile, mask_map_id: bool = True) -> List[DexModel]:
+    """Every classes*.dex of an APK (a path or an open ZipFile) in entry order, or the single dex at path."""
+    if isinstance(path, zipfile.ZipFile):
+        return [DexModel(info.filename, path.read(info), mask_map_id) for info in path.infolist() if dexfile.CLASSES_DEX_RE.fullmatch(info.filename)]
+    if not zipfile.is_zipfile(path):
+        return [DexModel(path.name, path.read_bytes(), mask_map_id)]
+    with zipfile.ZipFile(path) as zf:
+        return load_dex(zf, mask_map_id)
+
+
+def diff_dex(official: List[DexModel], rebuilt: List[DexModel]) -> Dict[str, Any]:
+    """JSON-serializable report of the structural differences between two sets of dex files."""
+    official_classes = _classes(official)
+    rebuilt_classes = _classes(rebuilt)
+    same_pools: Dict[Tuple[int, int], bool] = {}
+    multidex = len(official) > 1 or len(rebuilt) > 1
+
+    changed = []
+    for desc, (model_a, cdef_a) in official_classes.items():
+        if desc not in rebuilt_classes:
+            continue
+        model_b, cdef_b = rebuilt_classes[desc]
+        key = (id(model_a), id(model_b))
+        if key not in same_pools:
+            same_pools[key] = model_a.same_pools(model_b)
+        entry = compare_class(model_a, cdef_a, model_b, cdef_b, same_pools[key])
+        if multidex and model_a.name != model_b.name:
+            entry.setdefault("attributes", {})["dex"] = [model_a.name, model_b.name]
+        if entry:
+            changed.append({"class": desc, **entry})
+
+    official_names = {model.name: model for model in official}
+    rebuilt_names = {model.name: model for model in rebuilt}
+    dex_files: Dict[str, Any] = {
+        "only_in_official": [name for name in official_names if name not in rebuilt_names] if multidex else [],
+        "only_in_rebuilt": [name for name in rebuilt_names if name not in official_names] if multidex else [],
+    }
+    pairs = [(model, rebuilt_names.get(name)) for name, model in official_names.items()] if multidex else list(zip(official, rebuilt))
+    for model, other in pairs:
+        name = model.name
+        if other and model.header.version != other.header.version:
+            dex_files.setdefault("version", {})[name] = [model.header.version, other.header.version]
+
+    official_strings = {value for model in official for value in model.strings}
+    rebuilt_strings = {value for model in rebuilt for value in model.strings}
+    classes = {
+        "only_in_official": [desc for desc in official_classes if desc not in rebuilt_classes],
+        "only_in_rebuilt": [desc for desc in rebuilt_classes if desc not in official_classes],
+        "changed": changed,
+    }
+    strings = {"only_in_official": sorted(official_strings - rebuilt_strings), "only_in_rebuilt": sorted(rebuilt_strings - official_strings)}
+    summary = {
+        "official_classes": len(official_classes),
+        "rebuilt_classes": len(rebuilt_classes),
+        "classes_only_in_official": len(classes["only_in_official"]),
+        "classes_only_in_rebuilt": len(classes["only_in_rebuilt"]),
+        "classes_changed": len(changed),
+        "methods_changed": sum(len(entry.get("methods", {}).get("changed", [])) for entry in changed),
+        "methods_added_or_removed": sum(
+            len(entry.get("methods", {}).get("only_in_official", [])) + len(entry.get("methods", {}).get("only_in_rebuilt", [])) for entry in changed
+        ),
+        "strings_only_in_official": len(strings["only_in_official"]),
+        "strings_only_in_rebuilt": len(strings["only_in_rebuilt"]),
+    }
+    identical = not (
+        changed or classes["only_in_official"] or classes["only_in_rebuilt"] or strings["only_in_official"] or strings["only_in_rebuilt"]
+    ) and not any(dex_files.values())
+    return {
+        "official": [model.name for model in official],
+        "rebuilt": [model.name for model in rebuilt],
+        "identical": identical,
+        "summary": summary,
+        "dex_files": dex_files,
+        "classes": classes,
+        "strings": strings,
+    }
+
+
+def compare_class(a: DexModel, cdef_a: ClassDef, b: DexModel, cdef_b: ClassDef, same_pools: bool) -> Dict[str, Any]:
+    entry: Dict[str, Any] = {}
+    attributes = _diff_dict(_class_attributes(a, cdef_a), _class_attributes(b, cdef_b))
+    if attributes:
+        entry["attributes"] = attributes
+
+    data_a = dexfile.read_class_data(a.data, cdef_a.class_data_off)
+    data_b = dexfile.read_class_data(b.data, cdef_b.class_data_off)
+    annotations_a = dexfile.read_annotations_directory(a.data, cdef_a.annotations_off)
+    annotations_b = dexfile.read_annotations_directory(b.data, cdef_b.annotations_off)
+
+    fields_a = _members(a, data_a.static_fields + data_a.instance_fields, a.fields, annotations_a.fields)
+    fields_b = _members(b, data_b.static_fields + data_b.instance_fields, b.fields, annotations_b.fields)
+    fields = _diff_members(fields_a, fields_b, lambda x, y: _diff_dict(x[1], y[1]))
+    if fields:
+        entry["fields"] = fields
+
+    methods_a = _members(a, data_a.direct_methods + data_a.virtual_methods, a.methods, annotations_a.methods, annotations_a.parameters)
+    methods_b = _members(b, data_b.direct_methods + data_b.virtual_methods, b.methods, annotations_b.methods, annotations_b.parameters)
+    methods = _diff_members(methods_a, methods_b, lambda x, y: {**_diff_dict(x[1], y[1]), **compare_code(a, x[0], b, y[0], same_pools)})
+    if methods:
+        entry["methods"] = methods
+    return entry
+
+
+def compare_code(a: DexModel, member_a: EncodedMember, b: DexModel, member_b: EncodedMember, same_pools: bool) -> Dict[str, Any]:
+    if not member_a.code_off or not member_b.code_off:
+        if bool(member_a.code_off) != bool(member_b.code_off):
+            return {"code": [bool(member_a.code_off), bool(member_b.code_off)]}
+        return {}
+    code_a = dexfile.read_code_item(a.data, member_a.code_off)
+    code_b = dexfile.read_code_item(b.data, member_b.code_off)
+    diff: Dict[str, Any] = {}
+    for attr in ("registers_size", "ins_size", "outs_size"):
+        if getattr(code_a, attr) != getattr(code_b, attr):
+            diff[attr] = [getattr(code_a, attr), getattr(code_b, attr)]
+    if not (same_pools and code_a.insns == code_b.insns):
+        insns_a, insns_b = _instructions(a, code_a.insns), _instructions(b, code_b.insns)
+        if insns_a != insns_b:
+            first = next((i for i, (x, y) in enumerate(zip(insns_a, insns_b)) if x != y), min(len(insns_a), len(insns_b)))
+            diff["insns"] = {
+                "count": [len(insns_a), len(insns_b)],
+                "first_difference_pc": [insns_a[first][0] if first < len(insns_a) else None, insns_b[first][0] if first < len(insns_b) else None],
+            }
+    if not (same_pools and code_a.tries == code_b.tries) and _tries(a, code_a) != _tries(b, code_b):
+        diff["tries"] = [code_a.tries_size, code_b.tries_size]
+    if _debug_info(a, code_a) != _debug_info(b, code_b):
+        diff["debug_info"] = True
+    return diff
+
+
+def _classes(models: List[DexModel]) -> Dict[str, Tuple[DexModel, ClassDef]]:
+    classes: Dict[str, Tuple[DexModel, ClassDef]] = {}
+    for model in models:
+        for desc, cdef in model.class_defs.items():
+            classes.setdefault(desc, (model, cdef))
+    return classes
+
+
+def _class_attributes(model: DexModel, cdef: ClassDef) -> Dict[str, Any]:
+    annotations = dexfile.read_annotations_directory(model.data, cdef.annotations_off)
+    static_values = None
+    if cdef.static_values_off:
+        static_values, _ = dexfile.read_encoded_array(model.data, cdef.static_values_off, model.resolve)
+    return {
+        "access_flags": f"0x{cdef.access_flags:x}",
+        "superclass": model.resolve(TYPE, cdef.superclass_idx),
+        "interfaces": [model.types[idx] for idx in dexfile.read_type_list(model.data, cdef.interfaces_off)],
+        "source_file": model.resolve(STRING, cdef.source_file_idx),
+        "annotations": _jsonable(dexfile.read_annotation_set(model.data, annotations.class_annotations_off, model.resolve)),
+        "static_values": _jsonable(static_values),
+    }
+
+
+def _members(
+    model: DexModel,
+    members: List[EncodedMember],
+    pool: List[str],
+    annotations: List[Tuple[int, int]],
+    parameter_annotations: List[Tuple[int, int]] | None = None,
+) -> Dict[str, Tuple[EncodedMember, Dict[str, Any]]]:
+    """Field or method key (without the class prefix) -> (member, comparable attributes)."""
+    annotation_offs = dict(annotations)
+    parameter_offs = dict(parameter_annotations or [])
+    result = {}
+    for member in members:
+        attributes: Dict[str, Any] = {"access_flags": f"0x{member.access_flags:x}"}
+        if member.index in annotation_offs:
+            attributes["annotations"] = _jsonable(dexfile.read_annotation_set(model.data, annotation_offs[member.index], model.resolve))
+        if member.index in parameter_offs:
+            attributes["parameter_annotations"] = _jsonable(dexfile.read_annotation_set_ref_list(model.data, parameter_offs[member.index], model.resolve))
+        result[pool[member.index].split("->", 1)[1]] = (member, attributes)
+    return result
+
+
+def _diff_members(members_a: Dict[str, Any], members_b: Dict[str, Any], compare) -> Dict[str, Any]:
+    changed = []
+    for key, value_a in members_a.items():
+        if key in members_b:
+            diff = compare(value_a, members_b[key])
+            if diff:
+                changed.append({"name": key, "fields": diff})
+    result = {
+        "only_in_official": [key for key in members_a if key not in members_b],
+        "only_in_rebuilt": [key for key in members_b if key not in members_a],
+        "changed": changed,
+    }
+    return result if any(result.values()) else {}
+
+
+def _diff_dict(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    keys = [*a, *(key for key in b if key not in a)]
+    return {key: [a.get(key), b.get(key)] for key in keys if a.get(key) != b.get(key)}
+
+
+def _instructions(model: DexModel, insns: bytes) -> List[Tuple[int, bytes, Tuple[Any, ...]]]:
+    try:
+        return [(pc, units.tobytes(), tuple(model.resolve(kind, idx) for kind, idx in refs)) for pc, units, refs in dexfile.iter_instructions(insns)]
+    except dexfile.Error:
+        # Not decodable (e.g. trailing garbage); fall back to comparing the raw code units.
+        return [(0, insns, ())]
+
+
+def _tries(model: DexModel, code: dexfile.CodeItem) -> Any:
+    if not code.tries_size:
+        return ()
+    return [
+        (start, count, [(model.resolve(TYPE, type_idx), addr) for type_idx, addr in handlers], catch_all)
+        for start, count, handlers, catch_all in dexfile.read_tries(code)
+    ]
+
+
+def _debug_info(model: DexModel, code: dexfile.CodeItem) -> Any:
+    if not code.debug_info_off:
+        return None
+    return dexfile.read_debug_info(model.data, code.debug_info_off, model.resolve)
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, (tuple, list)):
+        return [_jsonable(item) for item in value]
+    return value
+
+
+def print_summary(report: Dict[str, Any]) -> None:
+    summary = report["summary"]
+    if report["identical"]:
+        print(f"No structural differences ({summary['official_classes']} classes)")
+        return
+    print(
+        f"Classes: changed={summary['classes_changed']} only-official={summary['classes_only_in_official']} "
+        f"only-rebuilt={summary['classes_only_in_rebuilt']}; methods: changed={summary['methods_changed']} "
+        f"added/removed={summary['methods_added_or_removed']}; strings: only-official={summary['strings_only_in_official']} "
+        f"only-rebuilt={summary['strings_only_in_rebuilt']}"
+    )
+    lines = []
+    for entry in report["classes"]["changed"]:
+        parts = list(entry.get("attributes", {}))
+        for member_kind in ("fields", "methods"):
+            for change in entry.get(member_kind, {}).get("changed", []):
+                parts.append(f"{change['name']} ({', '.join(change['fields'])})")
+            parts += [f"-{name}" for name in entry.get(member_kind, {}).get("only_in_official", [])]
+            parts += [f"+{name}" for name in entry.get(member_kind, {}).get("only_in_rebuilt", [])]
+        lines.append(f"  {entry['class']}: {'; '.join(parts)}")
+    for key, sign in (("only_in_official", "-"), ("only_in_rebuilt", "+")):
+        lines += [f"  {sign}{desc}" for desc in report["classes"][key]]
+    for line in lines[:SUMMARY_LINES]:
+        print(line if len(line) <= SUMMARY_WIDTH else line[: SUMMARY_WIDTH - 3] + "...")
+    if len(lines) > SUMMARY_LINES:
+        print(f"  ... {len(lines) - SUMMARY_LINES} more classes in the JSON report")
+
+
+if __name__ == "__main__":
+    main()
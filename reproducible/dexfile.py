@@ -0,0 +1,615 @@
+"""
+Minimal DEX reader for the reproducible tooling.
+
+Parses the DEX header and walks the string_ids/string_data tables so callers
+can locate the R8 marker (pg-map-id) and r8-map-id-* strings by offset instead
+of regex-scanning the whole file. scan_pg_map_id() covers the other case,
+where the dex is still being inflated and only a sliding window is kept.
+
+The id tables, class_defs, class_data, code items, debug info, encoded values
+and annotations can be read as well; references to the id tables are left as
+indices and resolved by callers (see dexdiff.py).
+"""
+
+from __future__ import annotations
+
+import bisect
+import mmap
+import re
+import struct
+import sys
+from array import array
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+CLASSES_DEX_RE = re.compile(r"classes\d*\.dex")
+# Dex files of an App Bundle's base module; the group is the name the APKs built from it use.
+BUNDLE_DEX_RE = re.compile(r"base/dex/(classes\d*\.dex)")
+DEX_MAGIC = b"dex\n"
+DEX_MAGIC_RE = re.compile(rb"dex\n(\d{3})\x00")
+HEADER_SIZE = 0x70
+ENDIAN_CONSTANT = 0x12345678
+# Marker strings R8/D8/L8 embed in every dex they produce, e.g. ~~R8{"backend":"dex",...,"pg-map-id":"<hex>",...}
+MARKER_PREFIXES = (b"~~R8{", b"~~D8{", b"~~L8{")
+MARKER_MAP_ID_RE = re.compile(rb'"pg-map-id":"([0-9a-f]+)"')
+# Markers are a few hundred bytes; bounding the match lets a stream be scanned with a fixed overlap.
+MARKER_MAX_LEN = 4096
+MARKER_STREAM_RE = re.compile(rb'~~[DLR]8\{[^\x00]{0,%d}?"pg-map-id":"([0-9a-f]{1,64})"' % MARKER_MAX_LEN)
+MARKER_OVERLAP = MARKER_MAX_LEN + 128
+# R8 encodes map-id in source file names like r8-map-id-<hex>
+R8_MAP_STRING_RE = re.compile(rb"r8-map-id-([0-9a-f]{32,64})")
+
+NO_INDEX = 0xFFFFFFFF
+
+PG_MAP_ID = "pg-map-id"
+R8_MAP_ID = "r8-map-id"
+
+DexBuffer = Union[bytes, bytearray, mmap.mmap]
+
+
+class Error(RuntimeError):
+    pass
+
+
+class DexHeader(NamedTuple):
+    version: int
+    checksum: int
+    signature: bytes
+    file_size: int
+    header_size: int
+    endian_tag: int
+    link_size: int
+    link_off: int
+    map_off: int
+    string_ids_size: int
+    string_ids_off: int
+    type_ids_size: int
+    type_ids_off: int
+    proto_ids_size: int
+    proto_ids_off: int
+    field_ids_size: int
+    field_ids_off: int
+    method_ids_size: int
+    method_ids_off: int
+    class_defs_size: int
+    class_defs_off: int
+    data_size: int
+    data_off: int
+
+
+class MapIdString(NamedTuple):
+    """A map-id occurrence: which string kind it came from and the absolute offset of its hex digits."""
+
+    kind: str
+    offset: int
+    value: bytes
+
+
+class ProtoId(NamedTuple):
+    shorty_idx: int
+    return_type_idx: int
+    parameters_off: int
+
+
+class FieldId(NamedTuple):
+    class_idx: int
+    type_idx: int
+    name_idx: int
+
+
+class MethodId(NamedTuple):
+    class_idx: int
+    proto_idx: int
+    name_idx: int
+
+
+class ClassDef(NamedTuple):
+    class_idx: int
+    access_flags: int
+    superclass_idx: int
+    interfaces_off: int
+    source_file_idx: int
+    annotations_off: int
+    class_data_off: int
+    static_values_off: int
+
+
+class EncodedMember(NamedTuple):
+    """A class_data field or method: absolute field/method index, access flags and (methods only) code offset."""
+
+    index: int
+    access_flags: int
+    code_off: int
+
+
+class ClassData(NamedTuple):
+    static_fields: List[EncodedMember]
+    instance_fields: List[EncodedMember]
+    direct_methods: List[EncodedMember]
+    virtual_methods: List[EncodedMember]
+
+
+class CodeItem(NamedTuple):
+    registers_size: int
+    ins_size: int
+    outs_size: int
+    tries_size: int
+    debug_info_off: int
+    insns: bytes
+    # try_items followed by the encoded_catch_handler_list, as stored.
+    tries: bytes
+
+
+class AnnotationsDirectory(NamedTuple):
+    class_annotations_off: int
+    fields: List[Tuple[int, int]]
+    methods: List[Tuple[int, int]]
+    parameters: List[Tuple[int, int]]
+
+
+# Reference kinds, as passed to the resolver callbacks.
+STRING, TYPE, FIELD, METHOD, PROTO, CALL_SITE, METHOD_HANDLE = "string", "type", "field", "method", "proto", "call_site", "method_handle"
+Resolver = Callable[[str, int], Any]
+
+
+def read_header(data: DexBuffer) -> DexHeader:
+    if len(data) < HEADER_SIZE:
+        raise Error(f"Truncated dex header ({len(data)} bytes)")
+    magic = bytes(data[:8])
+    if magic[:4] != DEX_MAGIC or not DEX_MAGIC_RE.fullmatch(magic):
+        raise Error(f"Unsupported magic {magic!r}")
+    checksum, signature = struct.unpack_from("<I20s", data, 8)
+    fields = struct.unpack_from("<20I", data, 32)
+    header = DexHeader(int(magic[4:7]), checksum, signature, *fields)
+    if header.endian_tag != ENDIAN_CONSTANT:
+        raise Error(f"Unsupported endian tag 0x{header.endian_tag:x}")
+    if header.string_ids_off + 4 * header.string_ids_size > len(data):
+        raise Error("string_ids table out of bounds")
+    return header
+
+
+def read_uleb128(data: DexBuffer, offset: int) -> Tuple[int, int]:
+    """Decode a ULEB128 value at offset; returns (value, offset past the value)."""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+        if shift > 28:
+            raise Error(f"Malformed uleb128 at 0x{offset:x}")
+
+
+def read_sleb128(data: DexBuffer, offset: int) -> Tuple[int, int]:
+    value, end = read_uleb128(data, offset)
+    bits = 7 * (end - offset)
+    if value & (1 << (bits - 1)):
+        value -= 1 << bits
+    return value, end
+
+
+def decode_mutf8(raw: bytes) -> str:
+    """Decode DEX MUTF-8 (NUL as C0 80, supplementary characters as surrogate pairs)."""
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        try:
+            return raw.replace(b"\xc0\x80", b"\x00").decode("utf-8", "surrogatepass")
+        except UnicodeDecodeError:
+            return raw.decode("utf-8", "backslashreplace")
+
+
+def iter_strings(data: DexBuffer, header: DexHeader | None = None) -> Iterator[Tuple[int, bytes]]:
+    """Yield (offset, MUTF-8 bytes) for each entry of string_ids, in index order."""
+    header = header or read_header(data)
+    for string_data_off in read_string_offsets(data, header):
+        _, start = read_uleb128(data, string_data_off)
+        end = data.find(b"\x00", start)
+        if end < 0:
+            raise Error(f"Unterminated string at 0x{string_data_off:x}")
+        yield start, bytes(data[start:end])
+
+
+def find_map_ids(data: DexBuffer, header: DexHeader | None = None) -> List[MapIdString]:
+    """Locate pg-map-id values in R8 markers and r8-map-id-* strings via the string table.
+
+    Candidate hits are found with a plain substring search and then resolved to
+    their string_data_item by bisecting the string_ids offsets, so only the few
+    strings that mention a map-id are decoded.
+    """
+    header = header or read_header(data)
+    if not header.string_ids_size:
+        return []
+    string_offsets = read_string_offsets(data, header)
+    # dx/d8/R8 lay out string_data in string_ids order; only sort when a lookup proves otherwise.
+    is_sorted = False
+    found: List[MapIdString] = []
+    pos = data.find(b"map-id", min(string_offsets))
+    while pos >= 0:
+        span = _string_containing(data, string_offsets, pos)
+        if span is None:
+            if not is_sorted:
+                string_offsets = array("I", sorted(string_offsets))
+                is_sorted = True
+                continue
+            pos = data.find(b"map-id", pos + 1)
+            continue
+        start, end = span
+        found.extend(_map_ids_in_string(start, bytes(data[start:end])))
+        pos = data.find(b"map-id", end)
+    return found
+
+
+def read_string_offsets(data: DexBuffer, header: DexHeader) -> array:
+    """string_ids as a compact array of string_data_item offsets, in index order."""
+    offsets = array("I")
+    offsets.frombytes(data[header.string_ids_off : header.string_ids_off + 4 * header.string_ids_size])
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    return offsets
+
+
+def _string_containing(data: DexBuffer, string_offsets: array, pos: int) -> Tuple[int, int] | None:
+    index = bisect.bisect_right(string_offsets, pos) - 1
+    if index < 0:
+        return None
+    string_data_off = string_offsets[index]
+    _, start = read_uleb128(data, string_data_off)
+    end = data.find(b"\x00", start)
+    if end < 0:
+        raise Error(f"Unterminated string at 0x{string_data_off:x}")
+    return (start, end) if start <= pos < end else None
+
+
+def _map_ids_in_string(start: int, value: bytes) -> Iterator[MapIdString]:
+    if value.startswith(MARKER_PREFIXES):
+        for m in MARKER_MAP_ID_RE.finditer(value):
+            yield MapIdString(PG_MAP_ID, start + m.start(1), m.group(1))
+    for m in R8_MAP_STRING_RE.finditer(value):
+        yield MapIdString(R8_MAP_ID, start + m.start(1), m.group(1))
+
+
+def get_pg_map_id(data: DexBuffer) -> str | None:
+    for entry in find_map_ids(data):
+        if entry.kind == PG_MAP_ID:
+            return entry.value.decode()
+    return None
+
+
+def scan_pg_map_id(chunks: Iterable[bytes]) -> str | None:
+    """Streaming get_pg_map_id() for a dex that is read in chunks, e.g. straight out of a zip.
+
+    Only the current chunk plus a MARKER_OVERLAP tail of the previous one is
+    kept, so a marker split across chunks is still found. Stops consuming
+    chunks at the first marker.
+    """
+    window = b""
+    checked = False
+    for chunk in chunks:
+        window = window[-MARKER_OVERLAP:] + bytes(chunk)
+        if not checked:
+            if len(window) < len(DEX_MAGIC) + 4:
+                continue
+            if not DEX_MAGIC_RE.match(window):
+                raise Error(f"Unsupported magic {window[:8]!r}")
+            checked = True
+        m = MARKER_STREAM_RE.search(window)
+        if m:
+            return m.group(1).decode()
+    if not checked:
+        raise Error(f"Truncated dex header ({len(window)} bytes)")
+    return None
+
+
+def read_strings(data: DexBuffer, header: DexHeader) -> List[str]:
+    """Every string_ids entry, decoded, in index order."""
+    return [decode_mutf8(value) for _, value in iter_strings(data, header)]
+
+
+def read_type_ids(data: DexBuffer, header: DexHeader) -> List[int]:
+    return [idx for (idx,) in struct.iter_unpack("<I", _table(data, header.type_ids_off, header.type_ids_size, 4))]
+
+
+def read_proto_ids(data: DexBuffer, header: DexHeader) -> List[ProtoId]:
+    return [ProtoId(*item) for item in struct.iter_unpack("<III", _table(data, header.proto_ids_off, header.proto_ids_size, 12))]
+
+
+def read_field_ids(data: DexBuffer, header: DexHeader) -> List[FieldId]:
+    return [FieldId(*item) for item in struct.iter_unpack("<HHI", _table(data, header.field_ids_off, header.field_ids_size, 8))]
+
+
+def read_method_ids(data: DexBuffer, header: DexHeader) -> List[MethodId]:
+    return [MethodId(*item) for item in struct.iter_unpack("<HHI", _table(data, header.method_ids_off, header.method_ids_size, 8))]
+
+
+def read_class_defs(data: DexBuffer, header: DexHeader) -> List[ClassDef]:
+    return [ClassDef(*item) for item in struct.iter_unpack("<8I", _table(data, header.class_defs_off, header.class_defs_size, 32))]
+
+
+def read_type_list(data: DexBuffer, offset: int) -> List[int]:
+    if not offset:
+        return []
+    (size,) = struct.unpack_from("<I", data, offset)
+    return list(struct.unpack_from(f"<{size}H", data, offset + 4))
+
+
+def read_class_data(data: DexBuffer, offset: int) -> ClassData:
+    if not offset:
+        return ClassData([], [], [], [])
+    sizes = []
+    for _ in range(4):
+        size, offset = read_uleb128(data, offset)
+        sizes.append(size)
+    lists: List[List[EncodedMember]] = []
+    for kind, size in enumerate(sizes):
+        members = []
+        index = 0
+        for _ in range(size):
+            diff, offset = read_uleb128(data, offset)
+            access_flags, offset = read_uleb128(data, offset)
+            code_off = 0
+            if kind >= 2:
+                code_off, offset = read_uleb128(data, offset)
+            index += diff
+            members.append(EncodedMember(index, access_flags, code_off))
+        lists.append(members)
+    return ClassData(*lists)
+
+
+def read_code_item(data: DexBuffer, offset: int) -> CodeItem:
+    registers_size, ins_size, outs_size, tries_size, debug_info_off, insns_size = struct.unpack_from("<4H2I", data, offset)
+    insns_start = offset + 16
+    insns_end = insns_start + 2 * insns_size
+    tries = b""
+    if tries_size:
+        tries_start = insns_end + (insns_size & 1) * 2
+        handlers_start = tries_start + 8 * tries_size
+        handlers_size, pos = read_uleb128(data, handlers_start)
+        for _ in range(handlers_size):
+            size, pos = read_sleb128(data, pos)
+            for _ in range(abs(size)):
+                _, pos = read_uleb128(data, pos)
+                _, pos = read_uleb128(data, pos)
+            if size <= 0:
+                _, pos = read_uleb128(data, pos)
+        tries = bytes(data[tries_start:pos])
+    return CodeItem(registers_size, ins_size, outs_size, tries_size, debug_info_off, bytes(data[insns_start:insns_end]), tries)
+
+
+def read_tries(code: CodeItem) -> List[Tuple[int, int, List[Tuple[int, int]], int | None]]:
+    """(start_addr, insn_count, [(type_idx, addr)], catch_all_addr) per try_item."""
+    handlers: Dict[int, Tuple[List[Tuple[int, int]], int | None]] = {}
+    handlers_start = 8 * code.tries_size
+    handlers_size, pos = read_uleb128(code.tries, handlers_start)
+    for _ in range(handlers_size):
+        handler_off = pos - handlers_start
+        size, pos = read_sleb128(code.tries, pos)
+        pairs = []
+        for _ in range(abs(size)):
+            type_idx, pos = read_uleb128(code.tries, pos)
+            addr, pos = read_uleb128(code.tries, pos)
+            pairs.append((type_idx, addr))
+        catch_all = None
+        if size <= 0:
+            catch_all, pos = read_uleb128(code.tries, pos)
+        handlers[handler_off] = (pairs, catch_all)
+    tries = []
+    for start_addr, insn_count, handler_off in struct.iter_unpack("<IHH", code.tries[:handlers_start]):
+        pairs, catch_all = handlers.get(handler_off, ([], None))
+        tries.append((start_addr, insn_count, pairs, catch_all))
+    return tries
+
+
+def _instruction_formats() -> Tuple[List[int], Dict[int, Tuple[str, ...]]]:
+    """Code units per opcode and the reference kinds of opcodes that carry pool indices."""
+    formats = ["10x"] * 256
+    refs: Dict[int, Tuple[str, ...]] = {}
+
+    def put(first: int, last: int, fmt: str, *kinds: str) -> None:
+        for op in range(first, last + 1):
+            formats[op] = fmt
+            if kinds:
+                refs[op] = kinds
+
+    for op, fmt in enumerate(["10x", "12x", "22x", "32x", "12x", "22x", "32x", "12x", "22x", "32x"]):
+        put(op, op, fmt)
+    put(0x0A, 0x0D, "11x")
+    put(0x0F, 0x11, "11x")
+    put(0x12, 0x12, "11n")
+    for op, fmt in zip(range(0x13, 0x1A), ["21s", "31i", "21h", "21s", "31i", "51l", "21h"]):
+        put(op, op, fmt)
+    put(0x1A, 0x1A, "21c", STRING)
+    put(0x1B, 0x1B, "31c", STRING)
+    put(0x1C, 0x1C, "21c", TYPE)
+    put(0x1D, 0x1E, "11x")
+    put(0x1F, 0x1F, "21c", TYPE)
+    put(0x20, 0x20, "22c", TYPE)
+    put(0x21, 0x21, "12x")
+    put(0x22, 0x22, "21c", TYPE)
+    put(0x23, 0x23, "22c", TYPE)
+    put(0x24, 0x24, "35c", TYPE)
+    put(0x25, 0x25, "3rc", TYPE)
+    put(0x26, 0x26, "31t")
+    put(0x27, 0x27, "11x")
+    put(0x28, 0x28, "10t")
+    put(0x29, 0x29, "20t")
+    put(0x2A, 0x2A, "30t")
+    put(0x2B, 0x2C, "31t")
+    put(0x2D, 0x31, "23x")
+    put(0x32, 0x37, "22t")
+    put(0x38, 0x3D, "21t")
+    put(0x44, 0x51, "23x")
+    put(0x52, 0x5F, "22c", FIELD)
+    put(0x60, 0x6D, "21c", FIELD)
+    put(0x6E, 0x72, "35c", METHOD)
+    put(0x74, 0x78, "3rc", METHOD)
+    put(0x7B, 0x8F, "12x")
+    put(0x90, 0xAF, "23x")
+    put(0xB0, 0xCF, "12x")
+    put(0xD0, 0xD7, "22s")
+    put(0xD8, 0xE2, "22b")
+    put(0xFA, 0xFA, "45cc", METHOD, PROTO)
+    put(0xFB, 0xFB, "4rcc", METHOD, PROTO)
+    put(0xFC, 0xFC, "35c", CALL_SITE)
+    put(0xFD, 0xFD, "3rc", CALL_SITE)
+    put(0xFE, 0xFE, "21c", METHOD_HANDLE)
+    put(0xFF, 0xFF, "21c", PROTO)
+    return [int(fmt[0]) for fmt in formats], {op: (formats[op], *kinds) for op, kinds in refs.items()}
+
+
+INSTRUCTION_UNITS, INSTRUCTION_REFS = _instruction_formats()
+PACKED_SWITCH_PAYLOAD, SPARSE_SWITCH_PAYLOAD, FILL_ARRAY_DATA_PAYLOAD = 0x0100, 0x0200, 0x0300
+
+
+def iter_instructions(insns: bytes) -> Iterator[Tuple[int, array, List[Tuple[str, int]]]]:
+    """Yield (pc, code units, [(kind, index)]) per instruction or payload; index operands are zeroed in the units."""
+    units = array("H")
+    units.frombytes(insns)
+    if sys.byteorder != "little":
+        units.byteswap()
+    pc = 0
+    while pc < len(units):
+        unit = units[pc]
+        op = unit & 0xFF
+        if unit == PACKED_SWITCH_PAYLOAD:
+            size = units[pc + 1] * 2 + 4
+        elif unit == SPARSE_SWITCH_PAYLOAD:
+            size = units[pc + 1] * 4 + 2
+        elif unit == FILL_ARRAY_DATA_PAYLOAD:
+            width, count = units[pc + 1], units[pc + 2] | units[pc + 3] << 16
+            size = (width * count + 1) // 2 + 4
+        else:
+            size = INSTRUCTION_UNITS[op]
+        if pc + size > len(units):
+            raise Error(f"Truncated instruction 0x{op:02x} at pc {pc}")
+        insn = units[pc : pc + size]
+        refs: List[Tuple[str, int]] = []
+        if op in INSTRUCTION_REFS:
+            fmt, *kinds = INSTRUCTION_REFS[op]
+            if fmt == "31c":
+                refs.append((kinds[0], insn[1] | insn[2] << 16))
+                insn[1] = insn[2] = 0
+            else:
+                refs.append((kinds[0], insn[1]))
+                insn[1] = 0
+                if len(kinds) > 1:
+                    refs.append((kinds[1], insn[3]))
+                    insn[3] = 0
+        yield pc, insn, refs
+        pc += size
+
+
+def read_debug_info(data: DexBuffer, offset: int, resolve: Resolver) -> Tuple[Any, ...]:
+    """Decode a debug_info_item into a tuple of events with string/type references resolved."""
+
+    def optional(kind: str, pos: int) -> Tuple[Any, int]:
+        value, pos = read_uleb128(data, pos)
+        return (resolve(kind, value - 1) if value else None), pos
+
+    line_start, pos = read_uleb128(data, offset)
+    parameters_size, pos = read_uleb128(data, pos)
+    events: List[Any] = [line_start]
+    for _ in range(parameters_size):
+        name, pos = optional(STRING, pos)
+        events.append(name)
+    while True:
+        op = data[pos]
+        pos += 1
+        if op == 0x00:
+            return tuple(events)
+        if op in (0x01, 0x05, 0x06):
+            value, pos = read_uleb128(data, pos)
+            events.append((op, value))
+        elif op == 0x02:
+            value, pos = read_sleb128(data, pos)
+            events.append((op, value))
+        elif op in (0x03, 0x04):
+            register, pos = read_uleb128(data, pos)
+            name, pos = optional(STRING, pos)
+            type_, pos = optional(TYPE, pos)
+            signature = None
+            if op == 0x04:
+                signature, pos = optional(STRING, pos)
+            events.append((op, register, name, type_, signature))
+        elif op == 0x09:
+            name, pos = optional(STRING, pos)
+            events.append((op, name))
+        else:
+            events.append(op)
+
+
+def read_encoded_value(data: DexBuffer, offset: int, resolve: Resolver) -> Tuple[Any, int]:
+    """Decode an encoded_value; returns ((type, value), offset past it) with pool references resolved."""
+    header = data[offset]
+    value_type, arg = header & 0x1F, header >> 5
+    pos = offset + 1
+    if value_type == 0x1C:
+        return read_encoded_array(data, pos, resolve)
+    if value_type == 0x1D:
+        return read_encoded_annotation(data, pos, resolve)
+    if value_type in (0x1E, 0x1F):
+        return (value_type, arg if value_type == 0x1F else None), pos
+    raw = bytes(data[pos : pos + arg + 1])
+    pos += arg + 1
+    kind = {0x15: PROTO, 0x16: METHOD_HANDLE, 0x17: STRING, 0x18: TYPE, 0x19: FIELD, 0x1A: METHOD, 0x1B: FIELD}.get(value_type)
+    if kind:
+        return (value_type, resolve(kind, int.from_bytes(raw, "little"))), pos
+    return (value_type, raw), pos
+
+
+def read_encoded_array(data: DexBuffer, offset: int, resolve: Resolver) -> Tuple[Any, int]:
+    size, pos = read_uleb128(data, offset)
+    values = []
+    for _ in range(size):
+        value, pos = read_encoded_value(data, pos, resolve)
+        values.append(value)
+    return (0x1C, tuple(values)), pos
+
+
+def read_encoded_annotation(data: DexBuffer, offset: int, resolve: Resolver) -> Tuple[Any, int]:
+    type_idx, pos = read_uleb128(data, offset)
+    size, pos = read_uleb128(data, pos)
+    elements = []
+    for _ in range(size):
+        name_idx, pos = read_uleb128(data, pos)
+        value, pos = read_encoded_value(data, pos, resolve)
+        elements.append((resolve(STRING, name_idx), value))
+    return (0x1D, resolve(TYPE, type_idx), tuple(elements)), pos
+
+
+def read_annotations_directory(data: DexBuffer, offset: int) -> AnnotationsDirectory:
+    if not offset:
+        return AnnotationsDirectory(0, [], [], [])
+    class_off, fields_size, methods_size, parameters_size = struct.unpack_from("<4I", data, offset)
+    pos = offset + 16
+    lists = []
+    for size in (fields_size, methods_size, parameters_size):
+        lists.append([tuple(item) for item in struct.iter_unpack("<II", data[pos : pos + 8 * size])])
+        pos += 8 * size
+    return AnnotationsDirectory(class_off, *lists)
+
+
+def read_annotation_set(data: DexBuffer, offset: int, resolve: Resolver) -> Tuple[Any, ...]:
+    """An annotation_set_item as a sorted tuple of (visibility, annotation)."""
+    if not offset:
+        return ()
+    (size,) = struct.unpack_from("<I", data, offset)
+    annotations = []
+    for (annotation_off,) in struct.iter_unpack("<I", data[offset + 4 : offset + 4 + 4 * size]):
+        annotation, _ = read_encoded_annotation(data, annotation_off + 1, resolve)
+        annotations.append((data[annotation_off], annotation))
+    return tuple(sorted(annotations, key=repr))
+
+
+def read_annotation_set_ref_list(data: DexBuffer, offset: int, resolve: Resolver) -> Tuple[Any, ...]:
+    (size,) = struct.unpack_from("<I", data, offset)
+    return tuple(read_annotation_set(data, set_off, resolve) for (set_off,) in struct.iter_unpack("<I", data[offset + 4 : offset + 4 + 4 * size]))
+
+
+def _table(data: DexBuffer, offset: int, count: int, item_size: int) -> bytes:
+    end = offset + count * item_size
+    if count and (offset <= 0 or end > len(data)):
+        raise Error(f"Table at 0x{offset:x} ({count} items) out of bounds")
+    return bytes(data[offset:end])
@@ -3,37 +3,55 @@
 Generate dexdump diffs for all classes*.dex between two APKs.
 
 Usage:
-    ./diff_dexdump.py <official-apk> <rebuilt-apk> [--out-dir DIR] [--dexdump PATH] [--tag TAG]
+    ./diff_dexdump.py <official-apk> <rebuilt-apk> [--out-dir DIR] [--dexdump PATH] [--tag TAG] [--jobs N] [--stream]
 
 Outputs (per dex):
     - official_<name>.dump
     - rebuilt_<name>.dump
     - dexdump_<name>.diff (unified diff)
 
+Dex pairs whose central directory CRC32 and size already match are reported
+as identical without being extracted or dumped. The remaining pairs are
+dumped and diffed in a pool of --jobs workers. With --stream both dexdump
+outputs are piped straight into diff, so only the .diff is written.
+
 Note: This script does NOT patch map-id; it simply compares the two APKs as-is.
 """
 
 from __future__ import annotations
 
 import argparse
+import os
 import shutil
 import subprocess
 import sys
 import tempfile
+import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+from dexfile import CLASSES_DEX_RE
+
 
+class DexTiming(NamedTuple):
+    name: str
+    status: str
+    extract: float = 0.0
+    dexdump: float = 0.0
+    diff: float = 0.0
+    diff_path: Path | None = None
 
-def extract_dex_files(apk_path: Path, dest_dir: Path) -> set[str]:
-    dex_names: set[str] = set()
+
+def dex_entries(apk_path: Path) -> Dict[str, zipfile.ZipInfo]:
     with zipfile.ZipFile(apk_path) as zf:
-        for member in zf.infolist():
-            if member.filename.startswith("classes") and member.filename.endswith(".dex"):
-                dest = dest_dir / Path(member.filename).name
-                dest.parent.mkdir(parents=True, exist_ok=True)
-                dest.write_bytes(zf.read(member))
-                dex_names.add(dest.name)
-    return dex_names
+        return {info.filename: info for info in zf.infolist() if CLASSES_DEX_RE.fullmatch(info.filename)}
+
+
+def extract_dex(apk_path: Path, name: str, dest: Path) -> None:
+    with zipfile.ZipFile(apk_path) as zf, zf.open(name) as src, dest.open("wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
 
 
 def run_dexdump(dexdump: Path, src: Path, dst: Path) -> None:
@@ -41,13 +59,77 @@ def run_dexdump(dexdump: Path, src: Path, dst: Path) -> None:
         subprocess.run([str(dexdump), str(src)], check=True, stdout=fh)
 
 
+def run_diff(official: str, rebuilt: str, name: str, diff_path: Path, **kwargs) -> bool:
+    """Unified diff into diff_path; True if the inputs differ."""
+    labels = ["--label", f"official/{name}", "--label", f"rebuilt/{name}"]
+    with diff_path.open("w") as fh:
+        result = subprocess.run(["diff", "-u", *labels, official, rebuilt], stdout=fh, check=False, **kwargs)
+    if result.returncode > 1:
+        raise subprocess.CalledProcessError(result.returncode, "diff")
+    return result.returncode == 1
+
+
+def stream_diff(dexdump: Path, official_dex: Path, rebuilt_dex: Path, name: str, diff_path: Path) -> bool:
+    """Pipe both dexdump outputs into diff through /dev/fd, without writing the dumps."""
+    official = subprocess.Popen([str(dexdump), str(official_dex)], stdout=subprocess.PIPE)
+    rebuilt = subprocess.Popen([str(dexdump), str(rebuilt_dex)], stdout=subprocess.PIPE)
+    try:
+        fds = (official.stdout.fileno(), rebuilt.stdout.fileno())
+        differs = run_diff(f"/dev/fd/{fds[0]}", f"/dev/fd/{fds[1]}", name, diff_path, pass_fds=fds)
+    finally:
+        for proc in (official, rebuilt):
+            proc.stdout.close()
+    for proc in (official, rebuilt):
+        if proc.wait():
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    return differs
+
+
+def diff_dex(dexdump: Path, official_apk: Path, rebuilt_apk: Path, name: str, out_dir: Path, tmp_dir: Path, stream: bool) -> DexTiming:
+    stem = Path(name).name
+    work = tmp_dir / stem
+    work.mkdir()
+    official_dex, rebuilt_dex = work / f"official_{stem}", work / f"rebuilt_{stem}"
+    diff_path = out_dir / f"dexdump_{stem}.diff"
+
+    start = time.perf_counter()
+    extract_dex(official_apk, name, official_dex)
+    extract_dex(rebuilt_apk, name, rebuilt_dex)
+    extracted = time.perf_counter()
+    if stream:
+        # dexdump and diff run as one pipeline, so their combined time is reported under dexdump.
+        differs = stream_diff(dexdump, official_dex, rebuilt_dex, stem, diff_path)
+        dumped = diffed = time.perf_counter()
+    else:
+        official_dump = out_dir / f"official_{stem}.dump"
+        rebuilt_dump = out_dir / f"rebuilt_{stem}.dump"
+        run_dexdump(dexdump, official_dex, official_dump)
+        run_dexdump(dexdump, rebuilt_dex, rebuilt_dump)
+        dumped = time.perf_counter()
+        differs = run_diff(str(official_dump), str(rebuilt_dump), stem, diff_path)
+        diffed = time.perf_counter()
+    shutil.rmtree(work)
+    status = "differs" if differs else "same dump"
+    return DexTiming(stem, status, extracted - start, dumped - extracted, diffed - dumped, diff_path)
+
+
+def print_timings(timings: List[DexTiming], total: float) -> None:
+    width = max([len(timing.name) for timing in timings] + [3])
+    print(f"{'dex':<{width}}  {'status':<10} {'extract':>8} {'dexdump':>8} {'diff':>8}")
+    for timing in timings:
+        print(f"{timing.name:<{width}}  {timing.status:<10} {timing.extract:>7.2f}s {timing.dexdump:>7.2f}s {timing.diff:>7.2f}s")
+    print(f"Total: {total:.2f}s")
+
+
 def main() -> None:
-    parser = argparse.ArgumentParser(description=__doc__)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument("official_apk")
     parser.add_argument("rebuilt_apk")
     parser.add_argument("--out-dir", default=None, help="Output directory (default artifacts/reproducible/<tag>/dexdump if --tag is set, otherwise artifacts/reproducible/dexdump)")
     parser.add_argument("--dexdump", default=None, help="Path to dexdump (otherwise uses PATH)")
     parser.add_argument("--tag", default=None, help="Tag name to place outputs under artifacts/reproducible/<tag>/dexdump")
+    parser.add_argument("--jobs", type=int, default=0, help="Dex pairs dumped and diffed concurrently (0 = one per CPU; default: 0)")
+    parser.add_argument("--stream", action="store_true", help="Pipe dexdump output into diff instead of writing .dump files")
     args = parser.parse_args()
 
     official_apk = Path(args.official_apk).resolve()
@@ -69,46 +151,45 @@ def main() -> None:
         print("dexdump not found; set --dexdump or add it to PATH.", file=sys.stderr)
         sys.exit(1)
 
-    with tempfile.TemporaryDirectory() as tmp:
-        tmp_dir = Path(tmp)
-        official_dir = tmp_dir / "official"
-        rebuilt_dir = tmp_dir / "rebuilt"
-        official_dir.mkdir()
-        rebuilt_dir.mkdir()
-        official_dex = extract_dex_files(official_apk, official_dir)
-        rebuilt_dex = extract_dex_files(rebuilt_apk, rebuilt_dir)
-
-        all_dex = sorted(official_dex | rebuilt_dex)
-        if official_dex != rebuilt_dex:
-            missing_official = rebuilt_dex - official_dex
-            missing_rebuilt = official_dex - rebuilt_dex
-            if missing_official:
-                print(f"Warning: missing in official: {', '.join(sorted(missing_official))}", file=sys.stderr)
-            if missing_rebuilt:
-                print(f"Warning: missing in rebuilt: {', '.join(sorted(missing_rebuilt))}", file=sys.stderr)
-
-        diff_paths: list[Path] = []
-        for name in all_dex:
-            off_path = official_dir / name
-            reb_path = rebuilt_dir / name
-            if not off_path.exists() or not reb_path.exists():
-                continue
-            official_dump = out_dir / f"official_{name}.dump"
-            rebuilt_dump = out_dir / f"rebuilt_{name}.dump"
-            run_dexdump(dexdump_path, off_path, official_dump)
-            run_dexdump(dexdump_path, reb_path, rebuilt_dump)
-
-            diff_path = out_dir / f"dexdump_{name}.diff"
-            with diff_path.open("w") as fh:
-                subprocess.run(["diff", str(official_dump), str(rebuilt_dump)], stdout=fh, check=False)
-            diff_paths.append(diff_path)
-
+    start = time.perf_counter()
+    official_dex = dex_entries(official_apk)
+    rebuilt_dex = dex_entries(rebuilt_apk)
+    if official_dex.keys() != rebuilt_dex.keys():
+        missing_official = rebuilt_dex.keys() - official_dex.keys()
+        missing_rebuilt = official_dex.keys() - rebuilt_dex.keys()
+        if missing_official:
+            print(f"Warning: missing in official: {', '.join(sorted(missing_official))}", file=sys.stderr)
+        if missing_rebuilt:
+            print(f"Warning: missing in rebuilt: {', '.join(sorted(missing_rebuilt))}", file=sys.stderr)
+
+    timings: List[DexTiming] = []
+    pending: List[str] = []
+    for name in sorted(official_dex.keys() & rebuilt_dex.keys()):
+        official, rebuilt = official_dex[name], rebuilt_dex[name]
+        if (official.CRC, official.file_size) == (rebuilt.CRC, rebuilt.file_size):
+            timings.append(DexTiming(name, "same CRC"))
+        else:
+            pending.append(name)
+
+    with tempfile.TemporaryDirectory() as tmp, ThreadPoolExecutor(max_workers=args.jobs or os.cpu_count() or 1) as pool:
+        futures = [
+            pool.submit(diff_dex, dexdump_path, official_apk, rebuilt_apk, name, out_dir, Path(tmp), args.stream)
+            for name in pending
+        ]
+        timings += [future.result() for future in futures]
+    timings.sort(key=lambda timing: timing.name)
+
+    diff_paths = [timing.diff_path for timing in timings if timing.diff_path]
     if diff_paths:
         print("dexdump diffs written:")
         for p in diff_paths:
             print(f"  {p}")
+    elif timings:
+        print("All matching classes*.dex files have the same CRC32; nothing to diff.")
     else:
         print("No matching classes*.dex files found to diff.")
+    if timings:
+        print_timings(timings, time.perf_counter() - start)
 
 
 if __name__ == "__main__":
@@ -2,37 +2,54 @@
 """
 Patch pg-map-id in classes*.dex and baseline.prof to a supplied value.
 
+Works on APKs and on App Bundles: in an .aab the patched entries are
+base/dex/classes*.dex and BUNDLE-METADATA/.../baseline.prof.
+
 This supports modern, long R8 map IDs (32–64 hex chars) and rewrites the
 DEX signature/checksum plus the baseline profile header checksums.
+Entries other than classes*.dex and baseline.prof are copied verbatim
+(compressed bytes included) unless --recompress-all is given.
 
 Usage:
-    ./fix_pg_map_id.py input.apk output.apk <map-id-hex>
+    ./fix_pg_map_id.py input.apk|input.aab output.apk|output.aab <map-id-hex> [--recompress-all] [--jobs N | --streaming [--max-memory SIZE]]
 """
 
 from __future__ import annotations
 
 import argparse
+import contextlib
 import hashlib
+import io
+import mmap
 import os
 import re
+import shutil
 import struct
+import tempfile
 import zipfile
 import zlib
 from binascii import hexlify
-from typing import Any, Dict, Match, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, BinaryIO, Dict, Iterator, List, Match, Tuple
+
+import apkzip
+import dexfile
+from apkzip import COPY_BUFSIZE
+from dexfile import BUNDLE_DEX_RE, CLASSES_DEX_RE, DexBuffer, Error
 
 INFO_EMOJI = "ℹ️"
 STEP_EMOJI = "➡️"
 OK_EMOJI = "✅"
 WARN_EMOJI = "⚠️"
 
-DEX_MAGIC = b"dex\n"
-DEX_MAGIC_RE = re.compile(rb"dex\n(\d{3})\x00")
 PROF_MAGIC = b"pro\x00"
 PROF_010_P = b"010\x00"
-CLASSES_DEX_RE = re.compile(r"classes\d*\.dex")
 ASSET_PROF = "assets/dexopt/baseline.prof"
+BUNDLE_PROF = "BUNDLE-METADATA/com.android.tools.build.profiles/baseline.prof"
 # Accept long map ids; newer R8 emits 52+ hex chars.
+MAP_ID_MIN_LEN = 32
+MAP_ID_MAX_LEN = 64
+# Regexes are only used when the new map-id changes length; see _fix_dex_id_checksum_resized.
 PG_MAP_ID_RE = re.compile(rb'(pg-map-id":")(?!.*pg-map-id).*?([0-9a-f]{32,64})(")')
 # R8 encodes map-id in source file names like r8-map-id-<hex>
 R8_MAP_STRING_RE = re.compile(rb'(r8-map-id-)([0-9a-f]{32,64})')
@@ -46,17 +63,12 @@ ATTRS = (
     "extract_version",
     "flag_bits",
 )
-LEVELS = (9, 6, 4, 1)
-
-
-class Error(RuntimeError):
-    pass
+HASH_CHUNK_SIZE = 1024 * 1024
+ADLER_BASE = 65521
 
 
 class ReproducibleZipInfo(zipfile.ZipInfo):
-    """ZipInfo wrapper that preserves key attributes and compression level."""
-
-    _compresslevel: int
+    """ZipInfo wrapper that preserves key attributes of the source entry."""
 
     def __init__(self, zinfo: zipfile.ZipInfo, **override: Any) -> None:
         self._override: Dict[str, Any] = override
@@ -78,84 +90,382 @@ def main() -> None:
     parser.add_argument("input_apk", help="Source APK to patch")
     parser.add_argument("output_apk", help="Patched APK output path")
     parser.add_argument("map_id", help="Target pg-map-id (hex)")
+    parser.add_argument(
+        "--recompress-all",
+        action="store_true",
+        help="Recompress every deflated entry instead of copying untouched entries verbatim (slow; for cross-checking)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Patch classes*.dex in a pool of N processes (0 = one per CPU; default: 1, serial)",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Patch and write one dex at a time instead of holding every dex in memory",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=parse_size,
+        default=None,
+        help="Largest dex kept in RAM (e.g. 256M); bigger ones are patched through a temp file. Implies --streaming",
+    )
     args = parser.parse_args()
-    fix_pg_map_id_apk(args.input_apk, args.output_apk, args.map_id)
-
-
-def fix_pg_map_id_apk(input_apk: str, output_apk: str, map_id: str) -> None:
-    with open(input_apk, "rb") as fh_raw:
-        with zipfile.ZipFile(input_apk) as zf_in:
-            with zipfile.ZipFile(output_apk, "w") as zf_out:
-                file_data: Dict[str, bytes] = {}
-                for info in zf_in.infolist():
-                    if re.fullmatch(CLASSES_DEX_RE, info.filename) or info.filename == ASSET_PROF:
-                        print(f"{STEP_EMOJI} reading {info.filename!r}...")
-                        file_data[info.filename] = zf_in.read(info)
-                _fix_pg_map_id(file_data, map_id)
-                for info in zf_in.infolist():
-                    attrs = {attr: getattr(info, attr) for attr in ATTRS}
-                    zinfo = ReproducibleZipInfo(info, **attrs)
-                    if info.compress_type == 8:
-                        fh_raw.seek(info.header_offset)
-                        n, m = struct.unpack("<HH", fh_raw.read(30)[26:30])
-                        fh_raw.seek(info.header_offset + 30 + m + n)
-                        ccrc = 0
-                        size = info.compress_size
-                        while size > 0:
-                            ccrc = zlib.crc32(fh_raw.read(min(size, 4096)), ccrc)
-                            size -= 4096
-                        with zf_in.open(info) as fh_in:
-                            comps = {lvl: zlib.compressobj(lvl, 8, -15) for lvl in LEVELS}
-                            ccrcs = {lvl: 0 for lvl in LEVELS}
-                            while True:
-                                data = fh_in.read(4096)
-                                if not data:
-                                    break
-                                for lvl in LEVELS:
-                                    ccrcs[lvl] = zlib.crc32(comps[lvl].compress(data), ccrcs[lvl])
-                            for lvl in LEVELS:
-                                if ccrc == zlib.crc32(comps[lvl].flush(), ccrcs[lvl]):
-                                    zinfo._compresslevel = lvl
-                                    break
-                            else:
-                                raise Error(f"Unable to determine compresslevel for {info.filename!r}")
-                    elif info.compress_type != 0:
-                        raise Error(f"Unsupported compress_type {info.compress_type}")
-                    if re.fullmatch(CLASSES_DEX_RE, info.filename) or info.filename == ASSET_PROF:
-                        print(f"{STEP_EMOJI} writing {info.filename!r}...")
-                        zf_out.writestr(zinfo, file_data[info.filename])
-                    else:
-                        with zf_in.open(info) as fh_in:
-                            with zf_out.open(zinfo, "w") as fh_out:
-                                while True:
-                                    data = fh_in.read(4096)
-                                    if not data:
-                                        break
-                                    fh_out.write(data)
-
-
-def _fix_pg_map_id(file_data: Dict[str, bytes], map_id: str) -> None:
+    streaming = args.streaming or args.max_memory is not None
+    if streaming and args.jobs != 1:
+        parser.error("--jobs cannot be combined with --streaming/--max-memory")
+    fix_pg_map_id_apk(
+        args.input_apk,
+        args.output_apk,
+        args.map_id,
+        raw_copy=not args.recompress_all,
+        jobs=args.jobs,
+        streaming=streaming,
+        max_memory=args.max_memory,
+    )
+
+
+def fix_pg_map_id_apk(
+    input_apk: str | os.PathLike | zipfile.ZipFile,
+    output_apk: str | os.PathLike,
+    map_id: str,
+    raw_copy: bool = True,
+    jobs: int = 1,
+    streaming: bool = False,
+    max_memory: int | None = None,
+) -> None:
+    """Write input_apk (a path, or a ZipFile opened for reading, which is left open) to output_apk with map_id patched in."""
+    if streaming or max_memory is not None:
+        _fix_pg_map_id_apk_streaming(input_apk, output_apk, map_id, raw_copy, max_memory)
+        return
+    with _open_input(input_apk) as (fh_raw, zf_in):
+        with zipfile.ZipFile(output_apk, "w") as zf_out:
+            file_data: Dict[str, DexBuffer] = {}
+            for info in zf_in.infolist():
+                if _is_patched_entry(info.filename):
+                    print(f"{STEP_EMOJI} reading {info.filename!r}...")
+                    file_data[info.filename] = _read_entry(zf_in, info)
+            _fix_pg_map_id(file_data, map_id, jobs)
+            for info in zf_in.infolist():
+                zinfo = _output_zinfo(info)
+                if _is_patched_entry(info.filename):
+                    _write_patched_entry(fh_raw, zf_in, zf_out, info, zinfo, file_data[info.filename])
+                else:
+                    _copy_entry(fh_raw, zf_in, zf_out, info, zinfo, raw_copy)
+
+
+def _fix_pg_map_id_apk_streaming(
+    input_apk: str | os.PathLike | zipfile.ZipFile, output_apk: str | os.PathLike, map_id: str, raw_copy: bool, max_memory: int | None
+) -> None:
+    """Rewrite the APK entry by entry, keeping at most one dex buffer alive.
+
+    baseline.prof needs the CRC32 of every patched dex. Dex entries stored after
+    the profile are therefore patched up front and spilled to temp files; every
+    other dex is patched and written when its turn comes.
+    """
+    with _open_input(input_apk) as (fh_raw, zf_in):
+        with zipfile.ZipFile(output_apk, "w") as zf_out, tempfile.TemporaryDirectory() as tmp_dir:
+            infos = zf_in.infolist()
+            prof_index = next((i for i, info in enumerate(infos) if _is_prof(info.filename)), len(infos))
+            crcs: Dict[str, int] = {}
+            spilled: Dict[str, str] = {}
+            for index, info in enumerate(infos[prof_index + 1 :], prof_index + 1):
+                if _dex_key(info.filename):
+                    path = os.path.join(tmp_dir, f"{index}.dex")
+                    with _dex_buffer(zf_in, info, max_memory, tmp_dir) as data:
+                        print(f"{STEP_EMOJI} fixing {info.filename!r}...")
+                        fixed, crcs[_dex_key(info.filename)] = _fix_dex_id_checksum(data, map_id.encode())
+                        with open(path, "wb") as fh_dex:
+                            fh_dex.write(fixed)
+                    spilled[info.filename] = path
+            for info in infos:
+                zinfo = _output_zinfo(info)
+                if info.filename in spilled:
+                    with open(spilled.pop(info.filename), "rb") as fh_dex:
+                        with mmap.mmap(fh_dex.fileno(), 0, access=mmap.ACCESS_READ) as fixed:
+                            _write_patched_entry(fh_raw, zf_in, zf_out, info, zinfo, fixed)
+                elif _dex_key(info.filename):
+                    with _dex_buffer(zf_in, info, max_memory, tmp_dir) as data:
+                        print(f"{STEP_EMOJI} fixing {info.filename!r}...")
+                        fixed, crcs[_dex_key(info.filename)] = _fix_dex_id_checksum(data, map_id.encode())
+                        _write_patched_entry(fh_raw, zf_in, zf_out, info, zinfo, fixed)
+                elif _is_prof(info.filename):
+                    print(f"{STEP_EMOJI} fixing {info.filename!r}...")
+                    prof = _fix_prof_checksum(zf_in.read(info), crcs)
+                    _write_patched_entry(fh_raw, zf_in, zf_out, info, zinfo, prof)
+                else:
+                    _copy_entry(fh_raw, zf_in, zf_out, info, zinfo, raw_copy)
+
+
+@contextlib.contextmanager
+def _open_input(input_apk: str | os.PathLike | zipfile.ZipFile) -> Iterator[Tuple[BinaryIO, zipfile.ZipFile]]:
+    """(raw file for the verbatim copies, ZipFile) for a path, or for a ZipFile the caller opened and keeps open."""
+    if not isinstance(input_apk, zipfile.ZipFile):
+        with open(input_apk, "rb") as fh_raw, zipfile.ZipFile(input_apk) as zf_in:
+            yield fh_raw, zf_in
+        return
+    if input_apk.fp is None or input_apk.mode != "r":
+        raise Error("Input ZipFile must be open for reading")
+    if input_apk.filename is None or not os.path.isfile(input_apk.filename):
+        # In-memory archive: zipfile seeks before every read, so its file object can be shared.
+        yield input_apk.fp, input_apk
+        return
+    with open(input_apk.filename, "rb") as fh_raw:
+        yield fh_raw, input_apk
+
+
+def _is_patched_entry(filename: str) -> bool:
+    return bool(_dex_key(filename)) or _is_prof(filename)
+
+
+def _dex_key(filename: str) -> str | None:
+    """Name the baseline profile knows a patched dex entry by (classes2.dex for base/dex/classes2.dex), or None."""
+    if CLASSES_DEX_RE.fullmatch(filename):
+        return filename
+    m = BUNDLE_DEX_RE.fullmatch(filename)
+    return m.group(1) if m else None
+
+
+def _is_prof(filename: str) -> bool:
+    return filename in (ASSET_PROF, BUNDLE_PROF)
+
+
+def _output_zinfo(info: zipfile.ZipInfo) -> ReproducibleZipInfo:
+    if info.compress_type not in (0, 8):
+        raise Error(f"Unsupported compress_type {info.compress_type}")
+    attrs = {attr: getattr(info, attr) for attr in ATTRS}
+    return ReproducibleZipInfo(info, **attrs)
+
+
+def _write_patched_entry(
+    fh_raw: BinaryIO,
+    zf_in: zipfile.ZipFile,
+    zf_out: zipfile.ZipFile,
+    info: zipfile.ZipInfo,
+    zinfo: ReproducibleZipInfo,
+    data: DexBuffer,
+) -> None:
+    params = apkzip.detect_deflate_params(fh_raw, zf_in, info) if info.compress_type == 8 else None
+    print(f"{STEP_EMOJI} writing {info.filename!r}...")
+    apkzip.write_entry(zf_out, zinfo, len(data), apkzip.iter_buffer(data), params)
+
+
+def _copy_entry(
+    fh_raw: BinaryIO,
+    zf_in: zipfile.ZipFile,
+    zf_out: zipfile.ZipFile,
+    info: zipfile.ZipInfo,
+    zinfo: ReproducibleZipInfo,
+    raw_copy: bool,
+) -> None:
+    if raw_copy:
+        apkzip.copy_raw_entry(fh_raw, info, zf_out, zinfo)
+        return
+    params = apkzip.detect_deflate_params(fh_raw, zf_in, info) if info.compress_type == 8 else None
+    apkzip.write_entry(zf_out, zinfo, info.file_size, apkzip.iter_entry(zf_in, info), params)
+
+
+@contextlib.contextmanager
+def _dex_buffer(zf_in: zipfile.ZipFile, info: zipfile.ZipInfo, max_memory: int | None, tmp_dir: str) -> Iterator[DexBuffer]:
+    """Patchable buffer for one entry: a bytearray, or a temp-file mmap when it exceeds max_memory."""
+    print(f"{STEP_EMOJI} reading {info.filename!r}...")
+    if max_memory is None or info.file_size <= max_memory:
+        yield _read_entry(zf_in, info)
+        return
+    print(f"{INFO_EMOJI} {info.filename!r} is {info.file_size} bytes (> --max-memory {max_memory}); patching via temp file")
+    with tempfile.TemporaryFile(dir=tmp_dir) as fh_tmp:
+        with zf_in.open(info) as fh_in:
+            shutil.copyfileobj(fh_in, fh_tmp, COPY_BUFSIZE)
+        if fh_tmp.tell() != info.file_size:
+            raise Error(f"Truncated data for {info.filename!r}")
+        with mmap.mmap(fh_tmp.fileno(), 0) as data:
+            yield data
+
+
+def parse_size(value: str) -> int:
+    units = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+    m = re.fullmatch(r"(\d+)([KMG]?)i?B?", value.strip().upper())
+    if not m:
+        raise argparse.ArgumentTypeError(f"invalid size {value!r} (expected e.g. 512M or 2G)")
+    return int(m.group(1)) * units[m.group(2)]
+
+
+def _read_entry(zf_in: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytearray:
+    """Inflate an entry straight into a preallocated, patchable buffer."""
+    data = bytearray(info.file_size)
+    pos = 0
+    with zf_in.open(info) as fh_in:
+        while pos < info.file_size:
+            chunk = fh_in.read(min(info.file_size - pos, COPY_BUFSIZE))
+            if not chunk:
+                raise Error(f"Truncated data for {info.filename!r}")
+            data[pos : pos + len(chunk)] = chunk
+            pos += len(chunk)
+    return data
+
+
+def _fix_pg_map_id(file_data: Dict[str, DexBuffer], map_id: str, jobs: int = 1) -> None:
     crcs: Dict[str, int] = {}
-    for filename in file_data:
-        if re.fullmatch(CLASSES_DEX_RE, filename):
+    dex_names = [filename for filename in file_data if _dex_key(filename)]
+    workers = min(jobs or os.cpu_count() or 1, len(dex_names))
+    if workers > 1:
+        # Each dex is independent; logs are captured per dex and replayed in entry order
+        # so the output matches a serial run.
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_fix_dex_job, file_data[filename], map_id.encode()) for filename in dex_names]
+            for filename, future in zip(dex_names, futures):
+                log, data, crc = future.result()
+                print(f"{STEP_EMOJI} fixing {filename!r}...")
+                print(log, end="")
+                file_data[filename] = data
+                crcs[_dex_key(filename)] = crc
+    else:
+        for filename in dex_names:
             print(f"{STEP_EMOJI} fixing {filename!r}...")
             data, crc = _fix_dex_id_checksum(file_data[filename], map_id.encode())
             file_data[filename] = data
-            crcs[filename] = crc
-    if ASSET_PROF in file_data:
-        print(f"{STEP_EMOJI} fixing {ASSET_PROF!r}...")
-        file_data[ASSET_PROF] = _fix_prof_checksum(file_data[ASSET_PROF], crcs)
+            crcs[_dex_key(filename)] = crc
+    for filename in [filename for filename in file_data if _is_prof(filename)]:
+        print(f"{STEP_EMOJI} fixing {filename!r}...")
+        file_data[filename] = _fix_prof_checksum(file_data[filename], crcs)
+
+
+def _fix_dex_job(data: DexBuffer, map_id: bytes) -> Tuple[str, DexBuffer, int]:
+    """Process-pool entry point: patch one dex and hand back its log along with the result."""
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        data, crc = _fix_dex_id_checksum(data, map_id)
+    return log.getvalue(), data, crc
+
+
+def _fix_dex_id_checksum(data: bytearray, map_id: bytes) -> Tuple[DexBuffer, int]:
+    """Patch map-ids in place and refresh the header; returns the (same) buffer and its CRC32.
+
+    Falls back to a copying rewrite only when the map-id changes length.
+    """
+    header = dexfile.read_header(data)
+    print(f"{INFO_EMOJI} dex version={header.version:03d}")
+    found = dexfile.find_map_ids(data, header)
+    pg_ids = [m for m in found if m.kind == dexfile.PG_MAP_ID and MAP_ID_MIN_LEN <= len(m.value) <= MAP_ID_MAX_LEN]
+    if any(len(m.value) != len(map_id) for m in pg_ids):
+        return _fix_dex_id_checksum_resized(bytes(data), map_id)
+
+    modified = False
+    for m in pg_ids:
+        print(f"{STEP_EMOJI} fixing pg-map-id: {m.value!r} -> {map_id!r}")
+        modified |= _patch_in_place(data, m.offset, map_id)
+    for m in found:
+        # Only rewrite r8-map-id-* strings in place; a length change would corrupt the string data.
+        if m.kind == dexfile.R8_MAP_ID and len(m.value) == len(map_id):
+            print(f"{STEP_EMOJI} fixing r8-map-id string: {m.value!r} -> {map_id!r}")
+            modified |= _patch_in_place(data, m.offset, map_id)
+    if not modified:
+        print(f"{WARN_EMOJI} (not modified)")
+        return data, zlib.crc32(data)
 
+    fixed_sig, fixed_checksum, crc = _rehash_dex(data)
+    print(f"{STEP_EMOJI} fixing signature: {hexlify(header.signature).decode()} -> {hexlify(fixed_sig).decode()}")
+    print(f"{STEP_EMOJI} fixing checksum: 0x{header.checksum:x} -> 0x{fixed_checksum:x}")
+    return data, crc
+
+
+def _patch_in_place(data: bytearray, offset: int, value: bytes) -> bool:
+    end = offset + len(value)
+    if data[offset:end] == value:
+        return False
+    data[offset:end] = value
+    return True
+
+
+def _rehash_dex(data: bytearray) -> Tuple[bytes, int, int]:
+    """Rewrite the DEX signature and checksum from one streaming pass over the body.
+
+    SHA-1, Adler-32 and CRC32 of data[32:] are accumulated chunk by chunk; the
+    Adler-32 (which also covers the new signature) and the whole-file CRC32 are
+    then derived with the zlib combine formulas instead of hashing again.
+    """
+    body_len = len(data) - 32
+    sha1 = hashlib.sha1()
+    adler = 1
+    crc = 0
+    with memoryview(data) as view:
+        for pos in range(32, len(data), HASH_CHUNK_SIZE):
+            chunk = view[pos : pos + HASH_CHUNK_SIZE]
+            sha1.update(chunk)
+            adler = zlib.adler32(chunk, adler)
+            crc = zlib.crc32(chunk, crc)
+        fixed_sig = sha1.digest()
+        fixed_checksum = _adler32_combine(zlib.adler32(fixed_sig), adler, body_len)
+        view[12:32] = fixed_sig
+        view[8:12] = int.to_bytes(fixed_checksum, 4, "little")
+        return fixed_sig, fixed_checksum, _crc32_combine(zlib.crc32(view[:32]), crc, body_len)
+
+
+def _adler32_combine(adler1: int, adler2: int, len2: int) -> int:
+    # Port of zlib's adler32_combine().
+    rem = len2 % ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % ADLER_BASE
+    sum1 += (adler2 & 0xFFFF) + ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xFFFF) + ((adler2 >> 16) & 0xFFFF) + ADLER_BASE - rem
+    if sum1 >= ADLER_BASE:
+        sum1 -= ADLER_BASE
+    if sum1 >= ADLER_BASE:
+        sum1 -= ADLER_BASE
+    if sum2 >= ADLER_BASE << 1:
+        sum2 -= ADLER_BASE << 1
+    if sum2 >= ADLER_BASE:
+        sum2 -= ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def _crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    # Port of zlib's crc32_combine(): apply len2 zero bytes to crc1 via GF(2) matrix squaring.
+    if len2 <= 0:
+        return crc1
+    odd = [0xEDB88320] + [1 << n for n in range(31)]
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+    while True:
+        even = _gf2_matrix_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+        odd = _gf2_matrix_square(even)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+    return crc1 ^ crc2
+
+
+def _gf2_matrix_times(mat: List[int], vec: int) -> int:
+    result = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            result ^= mat[i]
+        vec >>= 1
+        i += 1
+    return result
+
+
+def _gf2_matrix_square(mat: List[int]) -> List[int]:
+    return [_gf2_matrix_times(mat, mat[n]) for n in range(32)]
+
+
+def _fix_dex_id_checksum_resized(data: bytes, map_id: bytes) -> Tuple[bytes, int]:
+    """Regex rewrite used when the new pg-map-id differs in length from the embedded one."""
 
-def _fix_dex_id_checksum(data: bytes, map_id: bytes) -> Tuple[bytes, int]:
     def repl(m: Match[bytes]) -> bytes:
         print(f"{STEP_EMOJI} fixing pg-map-id: {m.group(2)!r} -> {map_id!r}")
         return m.group(1) + map_id + m.group(3)
 
-    magic = data[:8]
-    if magic[:4] != DEX_MAGIC or not DEX_MAGIC_RE.fullmatch(magic):
-        raise Error(f"Unsupported magic {magic!r}")
-    print(f"{INFO_EMOJI} dex version={int(magic[4:7]):03d}")
     checksum, signature = struct.unpack("<I20s", data[8:32])
     body = data[32:]
     fixed_body = re.sub(PG_MAP_ID_RE, repl, body)
@@ -174,6 +484,10 @@ def _fix_dex_id_checksum(data: bytes, map_id: bytes) -> Tuple[bytes, int]:
     if fixed_body == data[32:]:
         print(f"{WARN_EMOJI} (not modified)")
         return data, zlib.crc32(data)
+    return _fix_dex_header(data[:8], checksum, signature, fixed_body)
+
+
+def _fix_dex_header(magic: bytes, checksum: int, signature: bytes, fixed_body: bytes) -> Tuple[bytes, int]:
     fixed_sig = hashlib.sha1(fixed_body).digest()
     print(f"{STEP_EMOJI} fixing signature: {hexlify(signature).decode()} -> {hexlify(fixed_sig).decode()}")
     fixed_data = fixed_sig + fixed_body
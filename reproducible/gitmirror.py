@@ -0,0 +1,142 @@
+"""
+Local bare mirrors of the app repository and its submodules for verify_apk.py.
+
+Each repository URL gets one `git clone --mirror` under the mirror root,
+named after the URL, and is fetched incrementally (`git fetch --prune`)
+instead of being cloned again. A ref is resolved from the mirror with a single
+`git for-each-ref`, and the commit is checked out at depth 1 into the work
+dir, submodules included, from the mirrors alone. The Docker build copies
+that checkout (`--build-context source=<dir>`) instead of cloning from the
+network.
+
+When a fetch fails, the mirror is used as it is, so a retry works offline
+for any ref fetched before.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import NamedTuple
+
+
+class Submodule(NamedTuple):
+    name: str
+    path: str
+    url: str
+    commit: str
+
+
+def mirror_path(mirror_root: Path, url: str) -> Path:
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", url.rstrip("/").rsplit("/", 1)[-1].removesuffix(".git")) or "repo"
+    return mirror_root / f"{name}-{hashlib.sha256(url.encode()).hexdigest()[:12]}.git"
+
+
+def update_mirror(mirror_root: Path, url: str, fetch: bool = True) -> Path:
+    """Create the mirror of url, or fetch it when fetch is set; a failed fetch leaves the existing mirror in use."""
+    mirror = mirror_path(mirror_root, url)
+    if not (mirror / "HEAD").exists():
+        print(f"Creating git mirror of {url} in {mirror}")
+        staging = mirror.with_name(f"{mirror.name}.{os.getpid()}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        mirror_root.mkdir(parents=True, exist_ok=True)
+        _git(["clone", "--mirror", "--quiet", url, str(staging)])
+        try:
+            staging.rename(mirror)
+        except OSError:
+            # A concurrent run created it first.
+            shutil.rmtree(staging, ignore_errors=True)
+    elif fetch:
+        result = _git(["-C", str(mirror), "fetch", "--prune", "--quiet", "origin"], check=False)
+        if result.returncode:
+            print(f"Fetching {url} failed ({result.returncode}); using the mirror as it is.")
+    return mirror
+
+
+def resolve_ref(mirror: Path, ref: str) -> tuple[str, str | None] | None:
+    """(commit, annotated tag object or None) for a tag or branch named ref; tags win over branches of the same name."""
+    result = _git(
+        ["-C", str(mirror), "for-each-ref", "--format=%(refname) %(objectname) %(*objectname)", f"refs/tags/{ref}", f"refs/heads/{ref}"],
+        capture_output=True,
+    )
+    found: dict[str, list[str]] = {}
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) >= 2:
+            found[parts[0]] = parts[1:]
+    for name in (f"refs/tags/{ref}", f"refs/heads/{ref}"):
+        if name in found:
+            objects = found[name]
+            return (objects[1], objects[0]) if len(objects) == 2 else (objects[0], None)
+    return None
+
+
+def submodules(repo: Path, commit: str, url: str) -> list[Submodule]:
+    """Submodules of commit in repo (bare or not), with relative URLs resolved against url."""
+    config = _git(
+        ["-C", str(repo), "config", "--blob", f"{commit}:.gitmodules", "--get-regexp", r"^submodule\..*\.(path|url)$"],
+        check=False,
+        capture_output=True,
+    )
+    entries: dict[str, dict[str, str]] = {}
+    for line in config.stdout.splitlines():
+        key, _, value = line.partition(" ")
+        name, _, field = key[len("submodule.") :].rpartition(".")
+        entries.setdefault(name, {})[field] = value
+    modules = []
+    for name, entry in entries.items():
+        if "path" not in entry or "url" not in entry:
+            continue
+        tree = _git(["-C", str(repo), "ls-tree", commit, "--", entry["path"]], capture_output=True).stdout.split()
+        if len(tree) >= 3 and tree[1] == "commit":
+            modules.append(Submodule(name, entry["path"], _submodule_url(url, entry["url"]), tree[2]))
+    return modules
+
+
+def sync_submodules(mirror_root: Path, mirror: Path, commit: str, url: str, fetch: bool = True) -> None:
+    """Create or fetch the mirrors of every submodule of commit, recursively."""
+    for module in submodules(mirror, commit, url):
+        sub_mirror = update_mirror(mirror_root, module.url, fetch)
+        sync_submodules(mirror_root, sub_mirror, module.commit, module.url, fetch)
+
+
+def checkout(mirror_root: Path, url: str, commit: str, dest: Path) -> None:
+    """Check out commit of url at depth 1 into dest from the mirrors, submodules included; origin keeps pointing at url."""
+    shutil.rmtree(dest, ignore_errors=True)
+    dest.mkdir(parents=True)
+    _git(["-c", "init.defaultBranch=main", "init", "--quiet", str(dest)])
+    _git(["-C", str(dest), "fetch", "--quiet", "--depth", "1", str(mirror_path(mirror_root, url)), commit])
+    _git(["-C", str(dest), "checkout", "--quiet", "--detach", commit])
+    _git(["-C", str(dest), "remote", "add", "origin", url])
+    _checkout_submodules(mirror_root, dest, commit, url)
+
+
+def _checkout_submodules(mirror_root: Path, repo: Path, commit: str, url: str) -> None:
+    for module in submodules(repo, commit, url):
+        _git(["-C", str(repo), "submodule", "init", "--quiet", "--", module.path])
+        _git(["-C", str(repo), "config", f"submodule.{module.name}.url", mirror_path(mirror_root, module.url).as_uri()])
+        _git(["-C", str(repo), "-c", "protocol.file.allow=always", "submodule", "update", "--quiet", "--depth", "1", "--", module.path])
+        _git(["-C", str(repo), "config", f"submodule.{module.name}.url", module.url])
+        _git(["-C", str(repo / module.path), "remote", "set-url", "origin", module.url])
+        _checkout_submodules(mirror_root, repo / module.path, module.commit, module.url)
+
+
+def _submodule_url(parent: str, url: str) -> str:
+    """Resolve a `./` or `../` submodule URL against the superproject URL, as git does."""
+    if not url.startswith(("./", "../")):
+        return url
+    base = parent.rstrip("/")
+    for part in url.split("/"):
+        if part == "..":
+            base = base.rsplit("/", 1)[0]
+        elif part not in ("", "."):
+            base = f"{base}/{part}"
+    return base
+
+
+def _git(args: list[str], check: bool = True, capture_output: bool = False) -> subprocess.CompletedProcess:
+    return subprocess.run(["git", *args], check=check, capture_output=capture_output, text=True)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Per-task timing from a Gradle build log.
+
+verify_apk.py runs Gradle with `--console=plain` and task_timing.init.gradle,
+which prints a `##verify-task <path> <start-ms> <end-ms> <outcome>` line per
+finished task. Those lines give exact start/end times. The plain console's
+`> Task :path [OUTCOME]` headers are parsed as well, so outcomes (executed,
+from cache, up to date, no source) are known even without the init script.
+
+The summary counts outcomes and the build cache hit rate, lists the slowest
+tasks, and adds up task time per category (R8, dexing, native, lint, ...)
+and per variant (googleRelease, universalRelease, ...).
+
+BuildKit cuts a step's output off at its step log limit (2 MiB unless the
+daemon sets BUILDKIT_STEP_LOG_MAX_SIZE) and prints a marker line instead.
+A log with that marker is missing its tail, so the summary says
+`"timed": "partial"` and `"clipped": true`. BUILDKIT_STEP_LOG_MAX_SIZE=-1 in
+the daemon's environment (a systemd override for docker.service, or
+`docker buildx create --driver-opt env.BUILDKIT_STEP_LOG_MAX_SIZE=-1`) keeps
+the whole log.
+
+Usage:
+    ./gradlelog.py <gradle-build-log> [--top N] [--json REPORT]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple
+
+TIMING_PREFIX = "##verify-task "
+CLIPPED_MARKER = "[output clipped, log limit"
+HEADER_RE = re.compile(r"> Task (\S+)(?: (UP-TO-DATE|FROM-CACHE|NO-SOURCE|SKIPPED|FAILED))?\s*$")
+TOP_DEFAULT = 15
+# Category -> pattern on the task name (the last path segment); first match wins.
+CATEGORIES = {
+    "r8": re.compile(r"minify\w*WithR8|\w*R8\w*"),
+    "dexing": re.compile(r"dexBuilder\w*|mergeDex\w*|mergeExtDex\w*|mergeLibDex\w*|mergeProjectDex\w*|\w*Desugar\w*"),
+    "native": re.compile(r"\w*(?:NativeLibs|NativeDebugMetadata|DebugSymbols|ExternalNative|Cargo|Rust|Uniffi|Jni)\w*", re.I),
+    "lint": re.compile(r"lint\w*"),
+    "kotlin": re.compile(r"compile\w*Kotlin\w*"),
+    "ksp": re.compile(r"ksp\w*"),
+    "java": re.compile(r"compile\w*Java\w*"),
+    "resources": re.compile(r"\w*Resources\w*|\w*Res\b|\w*Manifest\w*"),
+    "packaging": re.compile(r"package\w*|bundle\w*|sign\w*|zipalign\w*|\w*Bundle\w*"),
+}
+VARIANT_RE = re.compile(r"((?!Release|Debug)[A-Z][a-z0-9]+)?(Release|Debug)")
+
+
+class TaskEvent(NamedTuple):
+    path: str
+    start_ms: int
+    end_ms: int
+    outcome: str
+
+    @property
+    def seconds(self) -> float:
+        return (self.end_ms - self.start_ms) / 1000
+
+
+class GradleLog:
+    """Collects task events and console headers from log lines as they stream by."""
+
+    def __init__(self) -> None:
+        self.events: Dict[str, TaskEvent] = {}
+        self.outcomes: Dict[str, str] = {}
+        self.clipped = False
+
+    def feed(self, line: str) -> bool:
+        """Record line; True if it is a timing line (kept out of the terminal, still logged)."""
+        if CLIPPED_MARKER in line:
+            self.clipped = True
+            return False
+        if line.startswith(TIMING_PREFIX):
+            parts = line[len(TIMING_PREFIX) :].split()
+            if len(parts) == 4 and parts[1].isdigit() and parts[2].isdigit():
+                event = TaskEvent(parts[0], int(parts[1]), int(parts[2]), parts[3])
+                self.events[event.path] = event
+                self.outcomes[event.path] = event.outcome
+            return True
+        match = HEADER_RE.match(line)
+        if match and match.group(1) not in self.events:
+            self.outcomes[match.group(1)] = match.group(2) or "EXECUTED"
+        return False
+
+    def feed_all(self, lines: Iterable[str]) -> "GradleLog":
+        for line in lines:
+            self.feed(line)
+        return self
+
+
+def category(path: str) -> str:
+    name = path.rsplit(":", 1)[-1]
+    for label, pattern in CATEGORIES.items():
+        if pattern.fullmatch(name):
+            return label
+    return "other"
+
+
+def variant(path: str) -> str:
+    match = VARIANT_RE.search(path.rsplit(":", 1)[-1])
+    if not match:
+        return "other"
+    flavor, build_type = match.groups()
+    return f"{flavor.lower()}{build_type}" if flavor else build_type.lower()
+
+
+def summarize(log: GradleLog, top: int = TOP_DEFAULT) -> Dict[str, Any]:
+    counts: Dict[str, int] = {}
+    for outcome in log.outcomes.values():
+        counts[outcome] = counts.get(outcome, 0) + 1
+    cacheable = counts.get("EXECUTED", 0) + counts.get("FROM-CACHE", 0)
+    summary: Dict[str, Any] = {
+        "tasks": len(log.outcomes),
+        "outcomes": dict(sorted(counts.items())),
+        "cache_hit_rate": round(counts.get("FROM-CACHE", 0) / cacheable, 3) if cacheable else None,
+        "timed": "partial" if log.clipped and log.events else bool(log.events),
+    }
+    if log.clipped:
+        summary["clipped"] = True
+    if not log.events:
+        return summary
+    events = sorted(log.events.values(), key=lambda event: event.seconds, reverse=True)
+    summary["wall_seconds"] = round((max(e.end_ms for e in events) - min(e.start_ms for e in events)) / 1000, 3)
+    summary["task_seconds"] = round(sum(event.seconds for event in events), 3)
+    summary["slowest"] = [
+        {"task": event.path, "seconds": round(event.seconds, 3), "outcome": event.outcome, "category": category(event.path)}
+        for event in events[:top]
+    ]
+    summary["by_category"] = _rollup(events, category)
+    summary["by_variant"] = _rollup(events, variant)
+    return summary
+
+
+def task_list(log: GradleLog) -> List[Dict[str, Any]]:
+    """Every task in completion order, with times when the init script reported them."""
+    tasks = []
+    for path, outcome in log.outcomes.items():
+        event = log.events.get(path)
+        entry: Dict[str, Any] = {"task": path, "outcome": outcome, "category": category(path), "variant": variant(path)}
+        if event:
+            entry.update(start_ms=event.start_ms, end_ms=event.end_ms, seconds=round(event.seconds, 3))
+        tasks.append(entry)
+    return tasks
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    outcomes = ", ".join(f"{name.lower()}={count}" for name, count in summary["outcomes"].items())
+    hit_rate = summary["cache_hit_rate"]
+    print(f"Gradle tasks: {summary['tasks']} ({outcomes}); cache hit rate: {'n/a' if hit_rate is None else f'{hit_rate:.0%}'}")
+    if summary.get("clipped"):
+        print("The log was clipped by BuildKit's step log limit; tasks after the cut are missing.")
+    if not summary["timed"]:
+        print("No task timing lines found (task_timing.init.gradle not applied).")
+        return
+    print(f"Task time {summary['task_seconds']:.1f}s over {summary['wall_seconds']:.1f}s wall")
+    print("By category: " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in summary["by_category"].items()))
+    print("By variant: " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in summary["by_variant"].items()))
+    for entry in summary["slowest"]:
+        print(f"  {entry['seconds']:>8.1f}s  {entry['outcome']:<10} {entry['task']}")
+
+
+def _rollup(events: List[TaskEvent], key) -> Dict[str, float]:
+    totals: Dict[str, float] = {}
+    for event in events:
+        label = key(event.path)
+        totals[label] = totals.get(label, 0.0) + event.seconds
+    return {label: round(seconds, 3) for label, seconds in sorted(totals.items(), key=lambda item: item[1], reverse=True)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", help="Gradle build log (e.g. artifacts/reproducible/<tag>/gradle_build.log)")
+    parser.add_argument("--top", type=int, default=TOP_DEFAULT, help=f"Slowest tasks to list (default: {TOP_DEFAULT})")
+    parser.add_argument("--json", default=None, help="Write the summary and task list here")
+    args = parser.parse_args()
+
+    with open(args.log, errors="replace") as fh:
+        log = GradleLog().feed_all(fh)
+    if not log.outcomes:
+        print(f"No Gradle tasks found in {args.log}", file=sys.stderr)
+        sys.exit(1)
+    summary = summarize(log, args.top)
+    print_summary(summary)
+    if args.json:
+        Path(args.json).write_text(json.dumps({"summary": summary, "tasks": task_list(log)}, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
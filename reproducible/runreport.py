@@ -0,0 +1,205 @@
+"""
+Per-stage timing and resource accounting for verify_apk.py, written as run_report.json.
+
+Each stage records wall time, CPU time of this process, CPU time of the
+child processes reaped during the stage (docker, diffoscope, fix_pg_map_id),
+and bytes read/written by this process and its reaped children (Linux
+/proc/self/io; left out where it is unavailable). The peak RSS of the
+children is only known for the whole process so far, so it is recorded once
+for the run ("children_peak_rss_bytes"), not per stage.
+Work done inside Docker containers is not visible here: for those stages
+the child is the docker CLI, so only wall time is meaningful.
+
+Stages may run concurrently (verify_apk.py overlaps ref resolution, the base
+image pull and the official APK scan with the build, and diffs flavors side by
+side). Each stage records when it started, and the report's "overlap" block
+compares the sum of the stage wall times with the time during which at least
+one stage was running. The difference is the wall-clock time the overlap saved
+over running the same stages one after another. A stage opened inside another
+on the same thread records its "parent" and is left out of that comparison,
+since its time is already part of the parent's.
+
+The CPU and I/O counters above are process-wide, so they are only
+recorded for a stage that ran alone. A stage that overlapped another is marked
+"overlapped" and loses them, since they would include the other stage's work.
+An in-process stage keeps its CPU time and I/O bytes under overlap when the
+platform has per-thread counters (Linux RUSAGE_THREAD and
+/proc/thread-self/io). Those counters cover the thread that ran the stage and
+not the worker threads or processes it started. Such a stage is marked
+"counters": "thread".
+
+With profiling enabled, in-process stages are also run under cProfile and
+dumped to <profile-dir>/<stage>.prof (view with `python -m pstats`).
+"""
+
+from __future__ import annotations
+
+import cProfile
+import json
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterator
+
+RUN_REPORT = "run_report.json"
+PROC_IO = Path("/proc/self/io")
+PROC_THREAD_IO = Path("/proc/thread-self/io")
+# Per-thread rusage exists on Linux only.
+RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD", None)
+# Bytes passed through read()/write()-like calls, page cache hits included.
+PROC_IO_FIELDS = {"rchar": "read_bytes", "wchar": "write_bytes"}
+# ru_maxrss is in KiB on Linux and in bytes on macOS.
+MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+class RunReport:
+    def __init__(self, profile_dir: Path | None = None) -> None:
+        self.path: Path | None = None
+        self.profile_dir = profile_dir
+        self.started = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.start = time.perf_counter()
+        self.info: dict[str, Any] = {}
+        self.stages: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._profiling = False
+        # One {"name": str, "thread": ident, "overlapped": bool} per stage still running.
+        self._running: list[dict[str, Any]] = []
+
+    @contextmanager
+    def stage(self, name: str, in_process: bool = False, **info: Any) -> Iterator[dict[str, Any]]:
+        """Measure the enclosed block; the yielded dict takes extra fields for the report."""
+        entry: dict[str, Any] = {"name": name, **info}
+        with self._lock:
+            # A stage nested in another on the same thread is part of that stage's work, not an overlap.
+            running = {"name": name, "thread": threading.get_ident(), "overlapped": False}
+            for other in self._running:
+                if other["thread"] != running["thread"]:
+                    other["overlapped"] = running["overlapped"] = True
+                else:
+                    entry["parent"] = other["name"]
+            self._running.append(running)
+        before = _sample(thread=in_process)
+        profiler = self._start_profiler() if in_process else None
+        try:
+            yield entry
+            entry["status"] = "ok"
+        except SystemExit as exc:
+            entry["status"] = f"exit {exc.code}"
+            raise
+        except BaseException as exc:
+            entry["status"] = f"error: {type(exc).__name__}"
+            raise
+        finally:
+            if profiler:
+                self._stop_profiler(profiler, name)
+            after = _sample(thread=in_process)
+            with self._lock:
+                self._running.remove(running)
+            entry.update(
+                start_seconds=round(before["wall"] - self.start, 3),
+                wall_seconds=round(after["wall"] - before["wall"], 3),
+            )
+            if not running["overlapped"]:
+                entry.update(
+                    cpu_seconds=round(after["cpu"] - before["cpu"], 3),
+                    children_cpu_seconds=round(after["children_cpu"] - before["children_cpu"], 3),
+                )
+                _add_io(entry, before, after, "")
+            else:
+                entry["overlapped"] = True
+                if "thread_cpu" in after:
+                    entry.update(cpu_seconds=round(after["thread_cpu"] - before["thread_cpu"], 3), counters="thread")
+                    _add_io(entry, before, after, "thread_")
+            with self._lock:
+                self.stages.append(entry)
+
+    def write(self, exit_status: int | str | None = 0) -> None:
+        """Write the report to self.path, keeping stages of an earlier run (e.g. --stage build) that were not re-run."""
+        if not self.path:
+            return
+        names = {entry["name"] for entry in self.stages}
+        try:
+            previous = json.loads(self.path.read_text()).get("stages", [])
+        except (OSError, ValueError):
+            previous = []
+        report = {
+            **self.info,
+            "started": self.started,
+            "wall_seconds": round(time.perf_counter() - self.start, 3),
+            "exit_status": exit_status,
+            # Largest RSS of any child waited for during the run (in practice the docker CLI or fix_pg_map_id workers).
+            "children_peak_rss_bytes": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * MAXRSS_UNIT,
+            "profile_dir": str(self.profile_dir) if self.profile_dir else None,
+            "overlap": overlap(self.stages),
+            "stages": [entry for entry in previous if entry["name"] not in names] + self.stages,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(report, indent=2) + "\n")
+
+    def _start_profiler(self) -> cProfile.Profile | None:
+        # cProfile covers the calling thread only, and only one profiler can be active at a time.
+        with self._lock:
+            if not self.profile_dir or self._profiling:
+                return None
+            self._profiling = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, profiler: cProfile.Profile, name: str) -> None:
+        profiler.disable()
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(self.profile_dir / f"{name}.prof"))
+        with self._lock:
+            self._profiling = False
+
+
+def overlap(stages: list[dict[str, Any]]) -> dict[str, float]:
+    """Sum of the stage wall times, time covered by at least one stage, and the difference saved by running stages concurrently.
+
+    Nested stages are left out: their time is already counted in their parent's.
+    """
+    total = busy = 0.0
+    covered_until = 0.0
+    for start, wall in sorted((entry["start_seconds"], entry["wall_seconds"]) for entry in stages if "parent" not in entry):
+        total += wall
+        busy += max(0.0, start + wall - max(start, covered_until))
+        covered_until = max(covered_until, start + wall)
+    return {"stage_seconds": round(total, 3), "busy_seconds": round(busy, 3), "saved_seconds": round(total - busy, 3)}
+
+
+def _sample(thread: bool = False) -> dict[str, float]:
+    """Process-wide counters, plus the calling thread's ("thread_" keys) if thread is set and the platform has them."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    sample = {
+        "wall": time.perf_counter(),
+        "cpu": own.ru_utime + own.ru_stime,
+        "children_cpu": children.ru_utime + children.ru_stime,
+    }
+    _read_io(PROC_IO, sample, "")
+    if thread and RUSAGE_THREAD is not None:
+        usage = resource.getrusage(RUSAGE_THREAD)
+        sample["thread_cpu"] = usage.ru_utime + usage.ru_stime
+        _read_io(PROC_THREAD_IO, sample, "thread_")
+    return sample
+
+
+def _read_io(path: Path, sample: dict[str, float], prefix: str) -> None:
+    try:
+        for line in path.read_text().splitlines():
+            key, _, value = line.partition(":")
+            if key in PROC_IO_FIELDS:
+                sample[prefix + PROC_IO_FIELDS[key]] = int(value)
+    except OSError:
+        pass
+
+
+def _add_io(entry: dict[str, Any], before: dict[str, float], after: dict[str, float], prefix: str) -> None:
+    if prefix + "read_bytes" in after and prefix + "read_bytes" in before:
+        entry["read_bytes"] = after[prefix + "read_bytes"] - before[prefix + "read_bytes"]
+        entry["write_bytes"] = after[prefix + "write_bytes"] - before[prefix + "write_bytes"]
@@ -0,0 +1,31 @@
+"""apksig on files too short or cut off to be an APK."""
+
+from __future__ import annotations
+
+import zipfile
+
+import pytest
+
+import apksig
+import verify_apk
+
+
+@pytest.mark.parametrize("keep", [0, 10, -5, -30])
+def test_short_or_truncated_file_raises_error(tmp_path, keep):
+    apk = tmp_path / "app.apk"
+    with zipfile.ZipFile(apk, "w") as zf:
+        zf.writestr("AndroidManifest.xml", b"manifest")
+    apk.write_bytes(apk.read_bytes()[:keep])
+    with pytest.raises(apksig.Error):
+        apksig.payload_digest(apk)
+    with pytest.raises(apksig.Error):
+        apksig.signed_digests(apk)
+
+
+def test_compare_payload_reports_empty_apk_as_failure(tmp_path, capsys):
+    official, rebuilt = tmp_path / "official.apk", tmp_path / "rebuilt.apk"
+    with zipfile.ZipFile(official, "w") as zf:
+        zf.writestr("AndroidManifest.xml", b"manifest")
+    rebuilt.touch()
+    assert not verify_apk.compare_payload(official, rebuilt, tmp_path)
+    assert "rebuilt.apk is 0 bytes" in capsys.readouterr().out
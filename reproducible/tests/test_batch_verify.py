@@ -0,0 +1,111 @@
+"""batch_verify.py end to end against stub docker/java/unzip/curl, in a throwaway copy of the tree."""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import zipfile
+from pathlib import Path
+
+TOOLS_DIR = Path(__file__).resolve().parent.parent
+STUB_DOCKER = """#!/bin/sh
+case "$1" in
+  info) echo "8 34359738368" ;;
+  image) echo "sha256:stub-base" ;;
+  cp)
+    # docker cp gem-android-app-build-<tag>:/root/gem-android/<subdir>/. <dest>
+    name="${2%%:*}"
+    mkdir -p "$3"
+    cp "$STUB_APK_DIR/${name#gem-android-app-build-}.apk" "$3/app-universal-release.apk" ;;
+esac
+"""
+
+
+def _git(*args: str) -> None:
+    subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args], check=True, capture_output=True)
+
+
+def _apk(path: Path, payload: bytes) -> Path:
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("AndroidManifest.xml", b"manifest")
+        zf.writestr("assets/payload.bin", payload)
+    return path
+
+
+def _setup(tmp_path: Path) -> tuple[Path, dict]:
+    root = tmp_path / "tree"
+    shutil.copytree(TOOLS_DIR, root / "reproducible", ignore=shutil.ignore_patterns("tests", "__pycache__"))
+    (root / "local.properties").write_text("gpr.username=test\n")
+
+    work = tmp_path / "repo"
+    _git("init", "--quiet", str(work))
+    (work / "README").write_text("app\n")
+    _git("-C", str(work), "add", "README")
+    _git("-C", str(work), "commit", "--quiet", "-m", "release")
+    for tag in ("v1", "v2", "v3"):
+        _git("-C", str(work), "tag", tag)
+    _git("clone", "--quiet", "--bare", str(work), str(tmp_path / "repo.git"))
+
+    stubs = tmp_path / "bin"
+    stubs.mkdir()
+    (stubs / "docker").write_text(STUB_DOCKER)
+    for name in ("java", "unzip", "curl"):
+        (stubs / name).write_text("#!/bin/sh\nexit 0\n")
+    for stub in stubs.iterdir():
+        stub.chmod(0o755)
+
+    # v1 rebuilds identically, v2 differs, v3 has no build output (docker cp fails).
+    rebuilt, official = tmp_path / "rebuilt", tmp_path / "official"
+    rebuilt.mkdir()
+    official.mkdir()
+    for tag, payload in (("v1", b"same"), ("v2", b"rebuilt")):
+        _apk(rebuilt / f"{tag}.apk", payload)
+    for tag, payload in (("v1", b"same"), ("v2", b"official"), ("v3", b"official")):
+        _apk(official / f"{tag}.apk", payload)
+
+    env = {name: value for name, value in os.environ.items() if not name.startswith(("VERIFY_", "GRADLE_", "DOCKER_"))}
+    env.update(
+        PATH=f"{stubs}{os.pathsep}{env.get('PATH', '')}",
+        STUB_APK_DIR=str(rebuilt),
+        VERIFY_REPO_URL=str(tmp_path / "repo.git"),
+        VERIFY_SKIP_DIFFOSCOPE="true",
+    )
+    return root, env
+
+
+def _batch(root: Path, env: dict, manifest: str) -> tuple[int, dict]:
+    manifest_path = root.parent / "manifest.txt"
+    manifest_path.write_text(manifest)
+    out_dir = root.parent / "batch"
+    shutil.rmtree(out_dir, ignore_errors=True)
+    result = subprocess.run(
+        [sys.executable, str(root / "reproducible" / "batch_verify.py"), str(manifest_path), "--out-dir", str(out_dir), "--diff-jobs", "2"],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    summary = json.loads((out_dir / "summary.json").read_text())
+    return result.returncode, {release["tag"]: release for release in summary["releases"]}
+
+
+def test_batch_outcomes_and_exit_status(tmp_path: Path) -> None:
+    root, env = _setup(tmp_path)
+
+    status, releases = _batch(root, env, "v1 official/v1.apk\n")
+    assert status == 0
+    assert releases["v1"]["outcome"] == "match"
+    assert (releases["v1"]["build"], releases["v1"]["diff"]) == (0, 0)
+
+    status, releases = _batch(root, env, "v1 official/v1.apk\nv2 official/v2.apk\n")
+    assert status == 2
+    assert releases["v2"]["outcome"] == "mismatch"
+    assert releases["v2"]["diff"] == 2
+
+    status, releases = _batch(root, env, "# backlog\nv1 official/v1.apk\nv2 official/v2.apk\nv3 official/v3.apk\n")
+    assert status == 1
+    assert [releases[tag]["outcome"] for tag in ("v1", "v2", "v3")] == ["match", "mismatch", "build failed"]
+    assert releases["v3"]["build"] != 0 and "diff" not in releases["v3"]
+    assert Path(releases["v3"]["build_log"]).exists()
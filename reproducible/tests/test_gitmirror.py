@@ -0,0 +1,72 @@
+"""gitmirror against local bare repositories: ref resolution, offline fallback and checkout with a submodule."""
+
+from __future__ import annotations
+
+import shutil
+import subprocess
+from pathlib import Path
+
+import gitmirror
+
+
+def _git(*args: str) -> str:
+    cmd = ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", "-c", "protocol.file.allow=always", "-c", "init.defaultBranch=main", *args]
+    return subprocess.run(cmd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def _bare_repo(tmp_path: Path, name: str, files: dict[str, str], submodule: Path | None = None) -> tuple[Path, str]:
+    """Bare repo with one commit holding files (and submodule at lib/, if given); return it and the commit."""
+    work = tmp_path / f"{name}-work"
+    _git("init", "--quiet", str(work))
+    for path, text in files.items():
+        (work / path).write_text(text)
+    _git("-C", str(work), "add", ".")
+    if submodule:
+        _git("-C", str(work), "submodule", "add", "--quiet", str(submodule), "lib")
+    _git("-C", str(work), "commit", "--quiet", "-m", name)
+    bare = tmp_path / f"{name}.git"
+    _git("clone", "--quiet", "--bare", str(work), str(bare))
+    return bare, _git("-C", str(bare), "rev-parse", "HEAD")
+
+
+def test_mirror_resolve_offline_and_checkout(tmp_path: Path) -> None:
+    lib, lib_commit = _bare_repo(tmp_path, "lib", {"lib.txt": "lib v1\n"})
+    app, app_commit = _bare_repo(tmp_path, "app", {"app.txt": "app v1\n"}, submodule=lib)
+    _git("-C", str(app), "tag", "v1", app_commit)
+    _git("-C", str(app), "tag", "-a", "-m", "release", "v1-annotated", app_commit)
+    mirror_root = tmp_path / "mirrors"
+    url = str(app)
+
+    mirror = gitmirror.update_mirror(mirror_root, url)
+    assert mirror == gitmirror.mirror_path(mirror_root, url)
+    assert gitmirror.resolve_ref(mirror, "v1") == (app_commit, None)
+    commit, tag_object = gitmirror.resolve_ref(mirror, "v1-annotated")
+    assert commit == app_commit and tag_object and tag_object != app_commit
+    assert gitmirror.resolve_ref(mirror, "main") == (app_commit, None)
+    assert gitmirror.resolve_ref(mirror, "missing") is None
+
+    # A tag pushed later arrives with an incremental fetch.
+    _git("-C", str(app), "tag", "v2", app_commit)
+    assert gitmirror.resolve_ref(mirror, "v2") is None
+    gitmirror.update_mirror(mirror_root, url)
+    assert gitmirror.resolve_ref(mirror, "v2") == (app_commit, None)
+
+    assert [module.commit for module in gitmirror.submodules(mirror, app_commit, url)] == [lib_commit]
+    gitmirror.sync_submodules(mirror_root, mirror, app_commit, url)
+    assert (gitmirror.mirror_path(mirror_root, str(lib)) / "HEAD").exists()
+
+    # With the upstream gone, a failed fetch leaves the mirrors in use and checkout still works.
+    shutil.move(str(app), str(tmp_path / "app-offline.git"))
+    shutil.move(str(lib), str(tmp_path / "lib-offline.git"))
+    assert gitmirror.update_mirror(mirror_root, url) == mirror
+    assert gitmirror.resolve_ref(mirror, "v1") == (app_commit, None)
+
+    dest = tmp_path / "checkout"
+    gitmirror.checkout(mirror_root, url, app_commit, dest)
+    assert (dest / "app.txt").read_text() == "app v1\n"
+    assert (dest / "lib" / "lib.txt").read_text() == "lib v1\n"
+    assert _git("-C", str(dest), "rev-parse", "HEAD") == app_commit
+    assert _git("-C", str(dest / "lib"), "rev-parse", "HEAD") == lib_commit
+    assert _git("-C", str(dest), "remote", "get-url", "origin") == url
+    assert _git("-C", str(dest / "lib"), "remote", "get-url", "origin") == str(lib)
+    assert _git("-C", str(dest), "rev-parse", "--is-shallow-repository") == "true"
@@ -0,0 +1,55 @@
+import json
+import threading
+
+import runreport
+
+
+def test_overlapping_stages_drop_process_wide_counters():
+    report = runreport.RunReport()
+    started, finish = threading.Event(), threading.Event()
+
+    def background():
+        with report.stage("background", in_process=True):
+            started.set()
+            finish.wait()
+
+    thread = threading.Thread(target=background)
+    thread.start()
+    started.wait()
+    with report.stage("docker"):
+        pass
+    with report.stage("scan", in_process=True):
+        pass
+    finish.set()
+    thread.join()
+    with report.stage("alone"):
+        with report.stage("nested"):
+            pass
+
+    stages = {entry["name"]: entry for entry in report.stages}
+    for name in ("background", "docker", "scan"):
+        assert stages[name]["overlapped"]
+        assert "children_cpu_seconds" not in stages[name]
+    assert "cpu_seconds" not in stages["docker"]
+    if runreport.RUSAGE_THREAD is not None:
+        assert stages["scan"]["counters"] == "thread"
+        assert "cpu_seconds" in stages["scan"]
+    for name in ("alone", "nested"):
+        assert "overlapped" not in stages[name]
+        assert "children_cpu_seconds" in stages[name]
+        assert "children_peak_rss_bytes" not in stages[name]
+    assert stages["nested"]["parent"] == "alone"
+
+
+def test_overlap_counts_sibling_stages_only(tmp_path):
+    stages = [
+        {"name": "build", "start_seconds": 0.0, "wall_seconds": 10.0},
+        {"name": "build_step", "start_seconds": 1.0, "wall_seconds": 5.0, "parent": "build"},
+        {"name": "scan", "start_seconds": 2.0, "wall_seconds": 4.0},
+    ]
+    assert runreport.overlap(stages) == {"stage_seconds": 14.0, "busy_seconds": 10.0, "saved_seconds": 4.0}
+
+    report = runreport.RunReport()
+    report.path = tmp_path / runreport.RUN_REPORT
+    report.write()
+    assert "children_peak_rss_bytes" in json.loads(report.path.read_text())
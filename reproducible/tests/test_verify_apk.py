@@ -0,0 +1,74 @@
+"""verify_apk.diff_target on a mismatching pair, with and without a map-id patch."""
+
+from __future__ import annotations
+
+import json
+import zipfile
+from pathlib import Path
+
+import checkpoint
+import runreport
+import verify_apk
+
+TOOLS_DIR = Path(__file__).resolve().parent.parent
+
+
+def _apk(path: Path, payload: bytes) -> Path:
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("AndroidManifest.xml", b"manifest")
+        zf.writestr("assets/payload.bin", payload)
+    return path
+
+
+def _diff(tmp_path: Path, monkeypatch, patch: bool) -> Path:
+    monkeypatch.setenv("VERIFY_SKIP_DIFFOSCOPE", "true")
+    monkeypatch.delenv("VERIFY_APKSIGCOPIER", raising=False)
+    if patch:
+        # Stands in for the map-id patch, which needs dex files: the patched copy differs from both sides.
+        def fake_patch(rebuilt, patched, *args, **kwargs):
+            _apk(patched, b"patched")
+
+        monkeypatch.setattr(verify_apk, "patch_map_id", fake_patch)
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    target = verify_apk.FlavorTarget("", tmp_path / "official.apk", work_dir)
+    _apk(target.official_copy, b"official")
+    _apk(target.rebuilt, b"rebuilt")
+    verdict = verify_apk.diff_target(
+        target, tmp_path / "blobs", tmp_path / "reports", checkpoint.Checkpoints(work_dir), runreport.RunReport(), TOOLS_DIR, {}
+    )
+    assert verdict == "mismatch"
+    return work_dir
+
+
+def test_reports_cover_rebuilt_and_patched_apk(tmp_path, monkeypatch, capsys):
+    work_dir = _diff(tmp_path, monkeypatch, patch=True)
+    # Built side by side, but reported plain pair first, each summary right after its own header.
+    out = capsys.readouterr().out
+    plain_at, patched_at = out.index("(rebuilt.apk vs official.apk)"), out.index("(r8_patched.apk vs official.apk)")
+    assert plain_at < out.index("Entries differ", plain_at) < patched_at
+    plain = json.loads((work_dir / "apkdiff.json").read_text())
+    patched = json.loads((work_dir / "apkdiff_patched.json").read_text())
+    assert Path(plain["rebuilt"]).name == "rebuilt.apk"
+    assert Path(patched["rebuilt"]).name == "r8_patched.apk"
+    assert Path(plain["official"]).name == Path(patched["official"]).name == "official.apk"
+
+
+def test_unpatched_mismatch_has_one_report(tmp_path, monkeypatch):
+    work_dir = _diff(tmp_path, monkeypatch, patch=False)
+    assert Path(json.loads((work_dir / "apkdiff.json").read_text())["rebuilt"]).name == "rebuilt.apk"
+    assert not (work_dir / "apkdiff_patched.json").exists()
+
+
+def test_identical_verdict_drops_last_payload_report(tmp_path):
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    target = verify_apk.FlavorTarget("", tmp_path / "official.apk", work_dir)
+    _apk(target.official_copy, b"same")
+    _apk(target.rebuilt, b"same")
+    (work_dir / verify_apk.PAYLOAD_REPORT).write_text("{}\n")
+    verdict = verify_apk.diff_target(
+        target, tmp_path / "blobs", tmp_path / "reports", checkpoint.Checkpoints(work_dir), runreport.RunReport(), TOOLS_DIR, {}
+    )
+    assert verdict == "identical"
+    assert not (work_dir / verify_apk.PAYLOAD_REPORT).exists()
@@ -0,0 +1,60 @@
+"""verifylib.verify() reaches the same verdicts as verify_apk.py's diff stage."""
+
+from __future__ import annotations
+
+import shutil
+import zipfile
+from pathlib import Path
+
+import verify_apk
+import verifylib
+
+
+def _apk(path: Path, payload: bytes, jar_signed: bool = False) -> Path:
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("AndroidManifest.xml", b"manifest")
+        zf.writestr("assets/payload.bin", payload)
+        if jar_signed:
+            zf.writestr("META-INF/MANIFEST.MF", b"Manifest-Version: 1.0\n")
+            zf.writestr("META-INF/CERT.SF", b"Signature-Version: 1.0\n")
+    return path
+
+
+def _copy_official(official: Path):
+    # What apksigcopier achieves on a faithful rebuild: the official APK, byte for byte.
+    def copy(official_apk: Path, rebuilt_apk: Path, output_apk: Path) -> str:
+        shutil.copyfile(official, output_apk)
+        return verify_apk.sha256_files([output_apk])[0]
+
+    return copy
+
+
+def test_identical_and_mismatch(tmp_path, monkeypatch):
+    monkeypatch.delenv("VERIFY_APKSIGCOPIER", raising=False)
+    official = _apk(tmp_path / "official.apk", b"same")
+    assert verifylib.verify(official, _apk(tmp_path / "same.apk", b"same"), tmp_path / "a").verdict == "identical"
+
+    result = verifylib.verify(official, _apk(tmp_path / "other.apk", b"other"), tmp_path / "b")
+    assert result.verdict == "mismatch"
+    assert result.signed is None
+    assert result.apk_diff is not None
+
+
+def test_jar_signed_official_gets_signature_copy_match(tmp_path, monkeypatch):
+    monkeypatch.delenv("VERIFY_APKSIGCOPIER", raising=False)
+    official = _apk(tmp_path / "official.apk", b"same", jar_signed=True)
+    rebuilt = _apk(tmp_path / "rebuilt.apk", b"same")
+    monkeypatch.setattr(verify_apk, "copy_signing_block", _copy_official(official))
+
+    result = verifylib.verify(official, rebuilt, tmp_path / "work")
+    assert result.verdict == "signature copy match"
+    assert result.signed == tmp_path / "work" / "rebuilt_signed.apk"
+    assert result.apk_diff is None
+
+
+def test_unsigned_official_skips_signature_copy(tmp_path, monkeypatch):
+    monkeypatch.delenv("VERIFY_APKSIGCOPIER", raising=False)
+    official = _apk(tmp_path / "official.apk", b"same")
+    monkeypatch.setattr(verify_apk, "copy_signing_block", _copy_official(official))
+
+    assert verifylib.verify(official, _apk(tmp_path / "rebuilt.apk", b"other"), tmp_path / "work").verdict == "mismatch"
@@ -2,30 +2,118 @@
 """
 Rebuild a tagged release in Docker, patch map-id if needed, and compare against an official APK.
 
-Usage: ./verify_apk.py <git-tag-or-branch> <path-to-official-apk> [--stage all|build|diff]
+Given an official .aab, or a directory of the split APKs Play delivered, the
+rebuilt App Bundle is compared instead (see bundlediff.py).
+
+Usage: ./verify_apk.py <git-tag-or-branch> <path-to-official-apk|.aab|split-apk-dir> [--stage all|build|diff] [--profile] [--force-stage STAGE]
+       ./verify_apk.py <git-tag-or-branch> --flavor universal=<apk> --flavor huawei=<apk> ... [options]
+
+Exit status: 0 on a match, 1 on an error, 2 on a mismatch, 3 if a warm- and a
+cold-cache build of one commit differ, 4 on a partial match (split APKs whose
+converted entries could not be compared).
+
+Settings (environment):
+  VERIFY_BASE_IMAGE, VERIFY_BASE_TAG       base image (tag defaults to base_image_tag.txt)
+  VERIFY_PULL_BASE=false                   use a local base image instead of pulling it
+  VERIFY_DOCKER_PLATFORM                   build platform (default linux/amd64)
+  VERIFY_REPO_URL                          repository to build
+  VERIFY_GRADLE_TASK, GRADLE_WORKERS_MAX   Gradle task and workers
+  VERIFY_APK_SUBDIR, VERIFY_BUNDLE_SUBDIR  where the APK or bundle is taken from
+  VERIFY_BUILD_MODE=container|buildkit     buildkit runs Gradle as a Dockerfile step and exports only the APKs
+  VERIFY_CACHE_MODE=clean|warm             opt-in verified dependency cache (see buildcache.py)
+  VERIFY_CACHE_COLD_EVERY                  warm builds between cold control builds (default 10, 0 = never)
+  VERIFY_GIT_MIRROR=true                   build from local bare mirrors (see gitmirror.py)
+  VERIFY_GRADLE_TASK_TIMING=false          no per-task timing (see gradlelog.py)
+  VERIFY_PATCH_JOBS, VERIFY_PATCH_MAX_MEMORY  map-id patch workers and memory limit
+  VERIFY_APKSIGCOPIER=true                 try the signature copy even without a v1 signature
+  VERIFY_SKIP_DIFFOSCOPE=true              no diffoscope reports
+  VERIFY_DIFFOSCOPE_SCOPE=full|entries     entries diffs only what apkdiff.py found changed
+  VERIFY_BLOB_DIR                          content-addressed store for APKs and reports (see blobstore.py)
+  VERIFY_ALLOW_MISMATCH, VERIFY_ALLOW_PARTIAL_MATCH  exit 0 on a mismatch or a partial match
 """
 
 from __future__ import annotations
 
 import argparse
-import hashlib
+import html
+import importlib.metadata
+import json
 import os
 import re
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from fnmatch import fnmatch
 from pathlib import Path
+from typing import Any, Callable, Iterator, List, NamedTuple, TextIO, Tuple
+
+import apkdiff
+import apksig
+import blobstore
+import bundlediff
+import buildcache
+import checkpoint
+import dexfile
+import fix_pg_map_id
+import gitmirror
+import gradlelog
+import runreport
+from blobstore import HASH_MANIFEST, load_hash_manifest, sha256_file
 
 REPO_URL_DEFAULT = "https://github.com/gemwalletcom/gem-android.git"
 BUNDLE_TASK_DEFAULT = "clean :app:bundleGoogleRelease assembleUniversalRelease"
 APK_SUBDIR_DEFAULT = "app/build/outputs/apk/universal/release"
+BUNDLE_SUBDIR_DEFAULT = "app/build/outputs/bundle/googleRelease"
 BASE_IMAGE_DEFAULT = "ghcr.io/gemwalletcom/gem-android-base"
 APP_IMAGE_DEFAULT = "gem-android-app-verify"
 DOCKER_PLATFORM_DEFAULT = "linux/amd64"
 GRADLE_WORKERS_MAX_DEFAULT = "4"
-
+PATCH_JOBS_DEFAULT = "1"
+# Ref resolution, base image pull and official APK copy/scan run side by side with the main thread.
+BACKGROUND_JOBS = 3
+MAP_ID_SCAN_CHUNK = 256 * 1024
+PAYLOAD_REPORT = "payload_digest.json"
+BUNDLE_REPORT = "bundlediff.json"
+GRADLE_LOG = "gradle_build.log"
+GRADLE_TASKS_REPORT = "gradle_tasks.json"
+TASK_TIMING_INIT_SCRIPT = "task_timing.init.gradle"
+DIFFOSCOPE_SCOPE_DEFAULT = "full"
+DIFFOSCOPE_JOBS_DEFAULT = "4"
+DIFFOSCOPE_DEX_ONLY_EXCLUDES = ["res/*", "META-INF/*", "assets/*"]
+# Environment settings that change what the diff reports contain (part of their checkpoint key).
+DIFF_SETTINGS = ("DIFFOSCOPE_ARGS", "DIFFOSCOPE_DEX_ONLY", "VERIFY_DIFFOSCOPE_SCOPE", "VERIFY_SKIP_DIFFOSCOPE")
+# Parent of every <flavor>/<build-type> APK output dir, exported whole when verifying several flavors.
+APK_OUTPUTS_DIR = "app/build/outputs/apk"
+CACHE_MODE_DEFAULT = "clean"
+BUILD_MODE_DEFAULT = "container"
+# `docker build --progress=plain` prefixes each line of a step's output with `#<step> <seconds> `.
+BUILDKIT_PREFIX_RE = re.compile(r"^#\d+ \d+\.\d+ ")
+CACHE_COLD_EVERY_DEFAULT = "10"
+# Exit status when warm- and cold-cache builds of one commit hash differently: the result depends on cache contents.
+CACHE_MISMATCH_EXIT = 3
+GRADLE_COLD_LOG = "gradle_build_cold.log"
+CACHE_INPUTS_CMD = (
+    "cd /root/gem-android && git rev-parse HEAD && "
+    "find . -path ./.git -prune -o -type f \\( -name '*.lockfile' -o -path ./gradle/libs.versions.toml "
+    "-o -path ./gradle/verification-metadata.xml -o -path ./gradle/wrapper/gradle-wrapper.properties \\) -print0 "
+    "| sort -z | xargs -0 -r sha256sum"
+)
+
+VERDICT_EMOJI = {
+    "identical": "✅",
+    "payload match": "✅",
+    "signature copy match": "✅",
+    "entries match": "✅",
+    "partial match": "⚠️",
+    "mismatch": "❌",
+}
+# Entries named in the "partial match" verdict line; the full list is in bundlediff.json.
+NOT_COMPARED_SHOWN = 20
 INFO_EMOJI = "ℹ️"
 STEP_EMOJI = "➡️"
 WARN_EMOJI = "⚠️"
@@ -33,6 +121,81 @@ OK_EMOJI = "✅"
 FAIL_EMOJI = "❌"
 
 
+class FlavorTarget(NamedTuple):
+    flavor: str  # "" for the single-APK mode
+    official_apk: Path
+    work_dir: Path
+    bundle: bool = False  # official_apk is an .aab or a directory of split APKs
+
+    @property
+    def official_copy(self) -> Path:
+        if not self.bundle:
+            return self.work_dir / "official.apk"
+        return self.work_dir / ("official_splits" if self.official_apk.is_dir() else "official.aab")
+
+    @property
+    def rebuilt(self) -> Path:
+        return self.work_dir / ("rebuilt.aab" if self.bundle else "rebuilt.apk")
+
+
+# Output a thread holds back while inside holding_output(): (stream, text) pairs in the order they were written.
+HeldOutput = List[Tuple[TextIO, str]]
+_held = threading.local()
+_output_lock = threading.Lock()
+
+
+class HoldingStream:
+    """Stand-in for sys.stdout/sys.stderr that keeps the writes of a thread inside holding_output() instead of passing them on."""
+
+    def __init__(self, stream: TextIO) -> None:
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        held = getattr(_held, "output", None)
+        if held is None:
+            return self.stream.write(text)
+        held.append((self.stream, text))
+        return len(text)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.stream, name)
+
+
+@contextmanager
+def holding_output() -> Iterator[HeldOutput]:
+    """Keep what this thread prints inside the block in the yielded list; other threads print as usual."""
+    with _output_lock:
+        if not isinstance(sys.stdout, HoldingStream):
+            sys.stdout = HoldingStream(sys.stdout)
+        if not isinstance(sys.stderr, HoldingStream):
+            sys.stderr = HoldingStream(sys.stderr)
+    outer = getattr(_held, "output", None)
+    held: HeldOutput = []
+    _held.output = held
+    try:
+        yield held
+    finally:
+        _held.output = outer
+
+
+def print_held(held: HeldOutput) -> None:
+    """Write held output in one piece, or add it to this thread's own held output if it is holding too."""
+    outer = getattr(_held, "output", None)
+    if outer is not None:
+        outer.extend(held)
+        return
+    with _output_lock:
+        for stream, text in held:
+            stream.write(text)
+            stream.flush()
+
+
+def call_holding_output(fn: Callable[..., Any], *args: Any) -> tuple[Any, HeldOutput]:
+    """fn(*args) and what it printed, for pool workers whose output is printed after the join in a fixed order."""
+    with holding_output() as held:
+        return fn(*args), held
+
+
 def run(cmd: list[str], check: bool = True, capture_output: bool = False, env: dict | None = None) -> subprocess.CompletedProcess:
     return subprocess.run(cmd, check=check, text=True, capture_output=capture_output, env=env)
 
@@ -47,12 +210,49 @@ def sanitize(value: str) -> str:
     return re.sub(r"[^a-zA-Z0-9_.-]", "-", value)
 
 
-def sha256_file(path: Path) -> str:
-    h = hashlib.sha256()
-    with path.open("rb") as fh:
-        for chunk in iter(lambda: fh.read(8192), b""):
-            h.update(chunk)
-    return h.hexdigest()
+def place_file(store: Path, src: Path, dst: Path, digest: str | None = None) -> str:
+    """Put src's bytes at dst through the blob store (reflink, hardlink or copy) and record the digest in dst's sidecar."""
+    digest = digest or sha256_file(src)
+    blobstore.add(store, src, digest)
+    blobstore.link(store, digest, dst)
+    manifest = load_hash_manifest(dst.parent)
+    record_hash(manifest, dst, digest)
+    save_hash_manifest(dst.parent, manifest)
+    return digest
+
+
+def sha256_files(paths: list[Path]) -> list[str]:
+    """SHA-256 of each path, reusing sidecar digests whose size and mtime still match and hashing the rest on threads."""
+    manifests = {path.parent: load_hash_manifest(path.parent) for path in paths}
+    digests = {path: cached_hash(manifests[path.parent], path) for path in paths}
+    pending = [path for path in paths if digests[path] is None]
+    if pending:
+        with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+            for path, digest in zip(pending, pool.map(sha256_file, pending)):
+                digests[path] = record_hash(manifests[path.parent], path, digest)
+        for directory in {path.parent for path in pending}:
+            save_hash_manifest(directory, manifests[directory])
+    return [digests[path] or "" for path in paths]
+
+
+def save_hash_manifest(directory: Path, manifest: dict) -> None:
+    (directory / HASH_MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+
+
+def cached_hash(manifest: dict, path: Path) -> str | None:
+    entry = manifest.get(path.name)
+    if not entry or not path.exists():
+        return None
+    st = path.stat()
+    if entry.get("size") != st.st_size or entry.get("mtime_ns") != st.st_mtime_ns:
+        return None
+    return entry.get("sha256")
+
+
+def record_hash(manifest: dict, path: Path, digest: str) -> str:
+    st = path.stat()
+    manifest[path.name] = {"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    return digest
 
 
 def strip_signing_artifacts(directory: Path) -> None:
@@ -105,21 +305,50 @@ def copy_signing_block(official_apk: Path, rebuilt_apk: Path, output_apk: Path)
         print(f"{WARN_EMOJI} apksigcopier failed: {exc}")
         output_apk.unlink(missing_ok=True)
         return None
-    return sha256_file(output_apk)
+    return sha256_files([output_apk])[0]
 
 
-def copy_reports(root_dir: Path, work_dir: Path, tag_safe: str, names: list[str]) -> None:
-    reports_dir = root_dir / "artifacts" / "reproducible" / "reports" / tag_safe
+def compare_payload(official_apk: Path, rebuilt_apk: Path, work_dir: Path) -> bool:
+    """Compare APK Signature Scheme v2/v3 payload digests; the digests go to PAYLOAD_REPORT."""
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            official, rebuilt = pool.map(apksig.payload_digest, [official_apk, rebuilt_apk])
+        signers = apksig.signed_digests(official_apk)
+    except apksig.Error as exc:
+        print(f"{WARN_EMOJI} Unable to compute payload digests: {exc}")
+        return False
+    print(f"{INFO_EMOJI} Official payload chunked SHA-256: {official.chunked_sha256}")
+    print(f"{INFO_EMOJI} Rebuilt payload chunked SHA-256 : {rebuilt.chunked_sha256}")
+    for scheme, algorithm, digest in signers:
+        if algorithm == "chunked-sha256" and digest != official.chunked_sha256:
+            print(f"{WARN_EMOJI} Official {scheme} signer digest {digest} does not match its payload; the official APK looks modified.")
+    report = {
+        "official": official._asdict(),
+        "rebuilt": rebuilt._asdict(),
+        "signers": [{"scheme": scheme, "algorithm": algorithm, "digest": digest} for scheme, algorithm, digest in signers],
+        "match": official[:2] == rebuilt[:2],
+    }
+    (work_dir / PAYLOAD_REPORT).write_text(json.dumps(report, indent=2) + "\n")
+    return report["match"]
+
+
+def has_jar_signature(apk: Path) -> bool:
+    with zipfile.ZipFile(apk) as zf:
+        return any(fnmatch(name, "META-INF/*.SF") for name in zf.namelist())
+
+
+def copy_reports(store: Path, work_dir: Path, reports_dir: Path, names: list[str]) -> None:
     reports_dir.mkdir(parents=True, exist_ok=True)
-    for name in names:
-        src = work_dir / name
-        if src.exists():
-            shutil.copy2(src, reports_dir / name)
+    sources = [work_dir / name for name in names if (work_dir / name).exists()]
+    for src, digest in zip(sources, sha256_files(sources)):
+        place_file(store, src, reports_dir / src.name, digest)
 
 
-def resolve_ref(ref: str, repo_url: str) -> str:
-    heads = run(["git", "ls-remote", "--exit-code", "--heads", repo_url, ref], check=False, capture_output=True)
-    tags = run(["git", "ls-remote", "--exit-code", "--tags", repo_url, ref], check=False, capture_output=True)
+def resolve_ref(ref: str, repo_url: str) -> tuple[str, str]:
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        heads, tags = pool.map(
+            lambda kind: run(["git", "ls-remote", "--exit-code", kind, repo_url, ref], check=False, capture_output=True), ["--heads", "--tags"]
+        )
     lines = (heads.stdout + tags.stdout).splitlines()
     peeled_sha: str | None = None
     direct_sha: str | None = None
@@ -146,15 +375,60 @@ def resolve_ref(ref: str, repo_url: str) -> str:
 
     if peeled_sha:
         print(f"{INFO_EMOJI} Resolving ref {ref} -> {peeled_sha} (peeled from tag object {direct_sha or 'unknown'})")
-        return ref
+        return ref, peeled_sha
     if direct_sha:
         print(f"{INFO_EMOJI} Resolving ref {ref} -> {direct_sha}")
-        return ref
+        return ref, direct_sha
 
     sys.stderr.write(f"Failed to find branch/tag '{ref}' in {repo_url}\n")
     sys.exit(1)
 
 
+def resolve_ref_in_mirror(ref: str, repo_url: str, mirror_root: Path, fetch: bool) -> str:
+    """Fetch the local mirror of repo_url and its submodules (unless fetch is off) and resolve ref to a commit from it."""
+    mirror = gitmirror.update_mirror(mirror_root, repo_url, fetch)
+    resolved = gitmirror.resolve_ref(mirror, ref)
+    if not resolved:
+        sys.stderr.write(f"Failed to find branch/tag '{ref}' in {repo_url} (mirror {mirror})\n")
+        sys.exit(1)
+    commit, tag_object = resolved
+    if tag_object:
+        print(f"{INFO_EMOJI} Resolving ref {ref} -> {commit} (peeled from tag object {tag_object}, local mirror)")
+    else:
+        print(f"{INFO_EMOJI} Resolving ref {ref} -> {commit} (local mirror)")
+    gitmirror.sync_submodules(mirror_root, mirror, commit, repo_url, fetch)
+    return commit
+
+
+def resolve_commit(ref: str, repo_url: str, mirror_root: Path | None, fetch: bool, report: runreport.RunReport) -> tuple[str, str]:
+    """(ref to build, commit): from the local mirror when mirror_root is set, otherwise through git ls-remote."""
+    if mirror_root:
+        with report.stage("git_mirror", in_process=True, fetch=fetch) as entry:
+            entry["commit"] = resolve_ref_in_mirror(ref, repo_url, mirror_root, fetch)
+        return ref, entry["commit"]
+    with report.stage("resolve_ref"):
+        return resolve_ref(ref, repo_url)
+
+
+def prepare_base_image(base_image: str, base_tag: str, pull: bool, platform: str, report: runreport.RunReport) -> str:
+    """Pull or build the base image and return its ID, which keys the build checkpoint."""
+    with report.stage("base_image", image=f"{base_image}:{base_tag}"):
+        ensure_base_image(base_image, base_tag, pull, platform)
+        return image_id(f"{base_image}:{base_tag}")
+
+
+def image_id(image_ref: str) -> str:
+    """Local image ID (config digest) of image_ref, or image_ref itself if it cannot be inspected."""
+    result = run(["docker", "image", "inspect", "--format", "{{.Id}}", image_ref], check=False, capture_output=True)
+    return result.stdout.strip() if result.returncode == 0 and result.stdout.strip() else image_ref
+
+
+def read_base_tag() -> str | None:
+    """VERIFY_BASE_TAG, falling back to reproducible/base_image_tag.txt."""
+    base_tag_file = Path(__file__).with_name("base_image_tag.txt")
+    return os.environ.get("VERIFY_BASE_TAG") or (base_tag_file.read_text().strip() if base_tag_file.exists() else None)
+
+
 def ensure_base_image(base_image: str, base_tag: str, pull: bool, platform: str) -> None:
     image_ref = f"{base_image}:{base_tag}"
     env = os.environ.copy()
@@ -181,18 +455,12 @@ def ensure_base_image(base_image: str, base_tag: str, pull: bool, platform: str)
     run(["docker", "build", "--platform", platform, "-t", image_ref, "."], check=True, env=env)
 
 
-def build_app_image(tag: str, base_image: str, base_tag: str, gradle_task: str, map_id_seed: str, app_image: str, platform: str) -> None:
-    env = os.environ.copy()
-    env["DOCKER_BUILDKIT"] = "1"
-    env["DOCKER_DEFAULT_PLATFORM"] = env.get("DOCKER_DEFAULT_PLATFORM", platform)
+def app_build_args(tag: str, base_image: str, base_tag: str, gradle_task: str, map_id_seed: str, source_dir: Path | None = None) -> list[str]:
     seed_arg = map_id_seed or ""
-    cmd = [
-        "docker",
-        "build",
-        "--platform",
-        platform,
-        "-t",
-        app_image,
+    # A local checkout replaces the Dockerfile's `source` stage (which clones TAG from GitHub).
+    source_args = ["--build-context", f"source={source_dir}"] if source_dir else []
+    return [
+        *source_args,
         "--build-arg",
         f"TAG={tag}",
         "--build-arg",
@@ -205,6 +473,25 @@ def build_app_image(tag: str, base_image: str, base_tag: str, gradle_task: str,
         f"BUNDLE_TASK={gradle_task}",
         "--build-arg",
         f"R8_MAP_ID_SEED={seed_arg}",
+    ]
+
+
+def build_app_image(
+    tag: str, base_image: str, base_tag: str, gradle_task: str, map_id_seed: str, app_image: str, platform: str, source_dir: Path | None = None
+) -> None:
+    env = os.environ.copy()
+    env["DOCKER_BUILDKIT"] = "1"
+    env["DOCKER_DEFAULT_PLATFORM"] = env.get("DOCKER_DEFAULT_PLATFORM", platform)
+    cmd = [
+        "docker",
+        "build",
+        "--platform",
+        platform,
+        "--target",
+        "app",
+        "-t",
+        app_image,
+        *app_build_args(tag, base_image, base_tag, gradle_task, map_id_seed, source_dir),
         "-f",
         "reproducible/Dockerfile",
         ".",
@@ -213,9 +500,26 @@ def build_app_image(tag: str, base_image: str, base_tag: str, gradle_task: str,
     run(cmd, env=env)
 
 
-def build_outputs_in_container(app_image: str, container_name: str, gradle_task: str, map_id_seed: str, gradle_cache: Path, maven_cache: Path, platform: str, workers_max: str) -> None:
+def build_outputs_in_container(
+    app_image: str,
+    container_name: str,
+    gradle_task: str,
+    map_id_seed: str,
+    gradle_cache: Path,
+    maven_cache: Path,
+    platform: str,
+    workers_max: str,
+    log_path: Path,
+    ro_dep_cache: Path | None = None,
+    task_timing: bool = True,
+) -> gradlelog.GradleLog:
+    """Run Gradle in a container, teeing its output to log_path and collecting per-task events on the way."""
     run(["docker", "rm", "-f", container_name], check=False)
     seed_env = map_id_seed or ""
+    ro_args = ["-v", f"{ro_dep_cache}:/root/.gradle-ro:ro", "-e", "GRADLE_RO_DEP_CACHE=/root/.gradle-ro"] if ro_dep_cache else []
+    init_script = Path(__file__).with_name(TASK_TIMING_INIT_SCRIPT)
+    timing_args = ["-v", f"{init_script}:/root/{TASK_TIMING_INIT_SCRIPT}:ro"] if task_timing else []
+    init_arg = f" --init-script /root/{TASK_TIMING_INIT_SCRIPT}" if task_timing else ""
     cmd = [
         "docker",
         "run",
@@ -235,12 +539,162 @@ def build_outputs_in_container(app_image: str, container_name: str, gradle_task:
         f"{gradle_cache}:/root/.gradle",
         "-v",
         f"{maven_cache}:/root/.m2",
+        *ro_args,
+        *timing_args,
         app_image,
         "bash",
         "-lc",
-        "cd /root/gem-android && ./gradlew ${BUNDLE_TASK} --no-daemon --build-cache -Dorg.gradle.workers.max=${GRADLE_WORKERS_MAX}",
+        f"cd /root/gem-android && ./gradlew ${{BUNDLE_TASK}} --no-daemon --build-cache --console=plain{init_arg} -Dorg.gradle.workers.max=${{GRADLE_WORKERS_MAX}}",
+    ]
+    return stream_gradle_output(cmd, log_path)
+
+
+def build_outputs_with_buildkit(
+    tag: str,
+    base_image: str,
+    base_tag: str,
+    gradle_task: str,
+    map_id_seed: str,
+    platform: str,
+    workers_max: str,
+    apk_subdir: str,
+    cache_id: str,
+    dest: Path,
+    log_path: Path,
+    task_timing: bool = True,
+    source_dir: Path | None = None,
+) -> gradlelog.GradleLog:
+    """Run Gradle as a BuildKit build step and export only the APK directory to dest; no app image or container is left behind."""
+    shutil.rmtree(dest, ignore_errors=True)
+    dest.mkdir(parents=True, exist_ok=True)
+    env = os.environ.copy()
+    env["DOCKER_BUILDKIT"] = "1"
+    init_args = f"--init-script /root/{TASK_TIMING_INIT_SCRIPT}" if task_timing else ""
+    cmd = [
+        "docker",
+        "build",
+        "--platform",
+        platform,
+        "--progress=plain",
+        "--target",
+        "apk",
+        # Always rerun Gradle: a cached layer would hand back the APK of an earlier build.
+        "--no-cache-filter",
+        "outputs",
+        *app_build_args(tag, base_image, base_tag, gradle_task, map_id_seed, source_dir),
+        "--build-arg",
+        f"GRADLE_WORKERS_MAX={workers_max}",
+        "--build-arg",
+        f"GRADLE_INIT_ARGS={init_args}",
+        "--build-arg",
+        f"APK_SUBDIR={apk_subdir}",
+        "--build-arg",
+        f"CACHE_ID={cache_id}",
+        "--output",
+        f"type=local,dest={dest}",
+        "-f",
+        "reproducible/Dockerfile",
+        ".",
     ]
-    run(cmd)
+    print(f"Building APK for tag {tag} with BuildKit using task {gradle_task}...")
+    log = stream_gradle_output(cmd, log_path, env=env, prefix=BUILDKIT_PREFIX_RE)
+    if log.clipped:
+        print(
+            f"{WARN_EMOJI} BuildKit clipped the Gradle output at its step log limit; {log_path.name} and the task summary are incomplete. "
+            "Raise BUILDKIT_STEP_LOG_MAX_SIZE on the BuildKit daemon (-1 disables the limit)."
+        )
+    return log
+
+
+def stream_gradle_output(cmd: list[str], log_path: Path, env: dict | None = None, prefix: re.Pattern | None = None) -> gradlelog.GradleLog:
+    """Run cmd, teeing its output to log_path; prefix strips a per-line prefix (BuildKit's `#N 1.23 `) before parsing."""
+    log = gradlelog.GradleLog()
+    with log_path.open("w") as fh, subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace", env=env) as proc:
+        for line in proc.stdout:
+            fh.write(line)
+            if not log.feed(prefix.sub("", line, count=1) if prefix else line):
+                sys.stdout.write(line)
+                sys.stdout.flush()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return log
+
+
+def write_gradle_report(work_dir: Path, summary: dict, log: gradlelog.GradleLog) -> None:
+    gradlelog.print_summary(summary)
+    (work_dir / GRADLE_TASKS_REPORT).write_text(json.dumps(gradlelog.task_list(log), indent=2) + "\n")
+
+
+def read_cache_inputs(app_image: str, platform: str) -> tuple[str, dict[str, str]]:
+    """Commit checked out in the app image and SHA-256 of its dependency input files (lockfiles, catalog, wrapper)."""
+    result = run(["docker", "run", "--rm", "--platform", platform, app_image, "bash", "-lc", CACHE_INPUTS_CMD], capture_output=True)
+    lines = result.stdout.splitlines()
+    inputs = {}
+    for line in lines[1:]:
+        digest, _, name = line.strip().partition("  ")
+        inputs[name.removeprefix("./")] = digest
+    return lines[0].strip() if lines else "", inputs
+
+
+def prepare_dependency_cache(cache_root: Path, key: str, gradle_cache: Path, maven_cache: Path) -> Path | None:
+    """Seed the per-run homes from a verified snapshot and return its read-only Gradle cache, or None for a cold build."""
+    snapshot = buildcache.open_snapshot(cache_root, key)
+    if not snapshot:
+        print(f"{INFO_EMOJI} No verified dependency cache for these lockfiles; running a cold build to create one.")
+        return None
+    print(f"{OK_EMOJI} Using verified dependency cache {snapshot} (read-only)")
+    return buildcache.seed_homes(snapshot, gradle_cache, maven_cache)
+
+
+def finish_dependency_cache(
+    cache_root: Path, key: str, inputs: dict[str, str], commit: str, warm: bool, apk_sha256: str, gradle_cache: Path, maven_cache: Path
+) -> None:
+    """Snapshot the caches of a cold build and cross-check warm and cold builds of the same commit."""
+    if not warm:
+        snapshot = buildcache.save_snapshot(cache_root, key, inputs, gradle_cache, maven_cache)
+        print(f"{INFO_EMOJI} Saved dependency cache snapshot {snapshot}")
+    check_cache_builds(cache_root, key, commit, warm, apk_sha256)
+
+
+def check_cache_builds(cache_root: Path, key: str, commit: str, warm: bool, apk_sha256: str) -> None:
+    """Record the digest of a warm or cold build of commit; if the other mode built it differently, discard the cache and fail the run."""
+    other = buildcache.record_build(cache_root, key, commit, "warm" if warm else "cold", apk_sha256)
+    if not other:
+        return
+    print(
+        f"{FAIL_EMOJI} {'Warm' if warm else 'Cold'}-cache build of {commit} hashed {apk_sha256}, "
+        f"but the {'cold' if warm else 'warm'}-cache build hashed {other}; discarding the dependency cache. "
+        "The rebuilt APK depends on cache contents and is not trusted.",
+        file=sys.stderr,
+    )
+    buildcache.discard_snapshot(cache_root, key)
+    sys.exit(CACHE_MISMATCH_EXIT)
+
+
+def cold_control_build(
+    app_image: str,
+    container_name: str,
+    gradle_task: str,
+    map_id_seed: str,
+    platform: str,
+    workers_max: str,
+    work_dir: Path,
+    apk_subdir: str,
+    targets: list[FlavorTarget],
+    task_timing: bool,
+) -> str:
+    """Rebuild the commit of app_image with empty dependency caches; return its output digests, comma-separated like place_rebuilt."""
+    gradle_cache, maven_cache = Path(tempfile.mkdtemp()), Path(tempfile.mkdtemp())
+    try:
+        build_outputs_in_container(
+            app_image, container_name, gradle_task, map_id_seed, gradle_cache, maven_cache, platform, workers_max, work_dir / GRADLE_COLD_LOG, None, task_timing
+        )
+        apk_dir = extract_apk_outputs(container_name, work_dir, apk_subdir)
+        return ",".join(sha256_file(path) for path in rebuilt_outputs(apk_dir, apk_subdir, targets))
+    finally:
+        run(["docker", "rm", "-f", container_name], check=False)
+        remove_cache_dir(gradle_cache, "Gradle")
+        remove_cache_dir(maven_cache, "Maven")
 
 
 def extract_apk_outputs(container_name: str, work_dir: Path, apk_subdir: str) -> Path:
@@ -248,14 +702,65 @@ def extract_apk_outputs(container_name: str, work_dir: Path, apk_subdir: str) ->
     shutil.rmtree(dest, ignore_errors=True)
     dest.mkdir(parents=True, exist_ok=True)
     run(["docker", "cp", f"{container_name}:/root/gem-android/{apk_subdir}/.", str(dest)])
-    apk = next(dest.rglob("*.apk"), None)
+    return dest
+
+
+def place_official(store: Path, target: FlavorTarget) -> None:
+    if not target.official_apk.is_dir():
+        place_file(store, target.official_apk, target.official_copy)
+        return
+    shutil.rmtree(target.official_copy, ignore_errors=True)
+    for split in bundlediff.split_apks(target.official_apk):
+        place_file(store, split, target.official_copy / split.name)
+
+
+def prepare_official(store: Path, targets: list[FlavorTarget], report: runreport.RunReport) -> dict[str, dict[str, str | None]]:
+    """Place the official APKs in the work dirs and scan their map-ids, while the image is built; return the map-ids per flavor."""
+    with report.stage("copy_official", in_process=True):
+        for target in targets:
+            target.work_dir.mkdir(parents=True, exist_ok=True)
+            place_official(store, target)
+    with report.stage("official_map_id_scan", in_process=True):
+        return {target.flavor: official_map_ids(target) for target in targets}
+
+
+def rebuilt_outputs(apk_dir: Path, apk_subdir: str, targets: list[FlavorTarget]) -> list[Path]:
+    """Each target's rebuilt APK or bundle among the exported outputs (apk_dir/<flavor>/... for flavors)."""
+    outputs = []
+    for target in targets:
+        source = apk_dir / target.flavor if target.flavor else apk_dir
+        outputs.append(find_apk(source, f"{apk_subdir}/{target.flavor}" if target.flavor else apk_subdir, "*.aab" if target.bundle else "*.apk"))
+    return outputs
+
+
+def place_rebuilt(store: Path, apk_dir: Path, apk_subdir: str, targets: list[FlavorTarget]) -> str:
+    """Put each target's rebuilt APK or bundle into its work dir; return the digests, comma-separated."""
+    return ",".join(place_file(store, built, target.rebuilt) for built, target in zip(rebuilt_outputs(apk_dir, apk_subdir, targets), targets))
+
+
+def find_apk(dest: Path, apk_subdir: str, pattern: str = "*.apk") -> Path:
+    apk = next(dest.rglob(pattern), None)
     if not apk:
-        sys.stderr.write(f"Failed to locate APK inside {apk_subdir}\n")
+        sys.stderr.write(f"Failed to locate {pattern} inside {apk_subdir}\n")
         sys.exit(1)
     return apk
 
 
-def run_diffoscope_report(rebuilt_apk: Path, official_apk: Path, work_dir: Path, suffix: str = "") -> None:
+def run_apk_diff_report(rebuilt_apk: Path, official_apk: Path, work_dir: Path, suffix: str = "") -> dict:
+    """Central-directory diff of the two APKs, written to apkdiff<suffix>.json before the slow diffoscope pass."""
+    report_path = work_dir / f"apkdiff{suffix}.json"
+    try:
+        report = apkdiff.diff_apks(official_apk, rebuilt_apk)
+    except zipfile.BadZipFile as exc:
+        print(f"{WARN_EMOJI} Unable to compare zip entries of {rebuilt_apk.name}: {exc}", file=sys.stderr)
+        return {}
+    apkdiff.write_report(report, report_path)
+    print(f"{INFO_EMOJI} Entry-level diff ({rebuilt_apk.name} vs {official_apk.name}) written to {report_path}")
+    apkdiff.print_summary(report)
+    return report
+
+
+def run_diffoscope_report(rebuilt_apk: Path, official_apk: Path, work_dir: Path, suffix: str = "", apk_diff: dict | None = None) -> None:
     if os.environ.get("VERIFY_SKIP_DIFFOSCOPE", "false").lower() == "true":
         sys.stderr.write("Skipping diffoscope because VERIFY_SKIP_DIFFOSCOPE=true.\n")
         return
@@ -270,14 +775,6 @@ def run_diffoscope_report(rebuilt_apk: Path, official_apk: Path, work_dir: Path,
     rebuilt_dir.mkdir(parents=True, exist_ok=True)
     official_dir.mkdir(parents=True, exist_ok=True)
 
-    with zipfile.ZipFile(rebuilt_apk) as zf:
-        zf.extractall(rebuilt_dir)
-    with zipfile.ZipFile(official_apk) as zf:
-        zf.extractall(official_dir)
-
-    strip_signing_artifacts(rebuilt_dir)
-    strip_signing_artifacts(official_dir)
-
     report = work_dir / f"diffoscope{suffix}.html"
     diffoscope_args = ["--exclude-directory-metadata=yes", "--output-empty"]
     extra = os.environ.get("DIFFOSCOPE_ARGS", "")
@@ -285,7 +782,20 @@ def run_diffoscope_report(rebuilt_apk: Path, official_apk: Path, work_dir: Path,
     if extra:
         diffoscope_args.extend(extra.split())
     elif dex_only:
-        diffoscope_args.extend(["--exclude-files=res/*", "--exclude-files=META-INF/*", "--exclude-files=assets/*"])
+        diffoscope_args.extend(f"--exclude-files={pattern}" for pattern in DIFFOSCOPE_DEX_ONLY_EXCLUDES)
+
+    scope = os.environ.get("VERIFY_DIFFOSCOPE_SCOPE", DIFFOSCOPE_SCOPE_DEFAULT).lower()
+    if scope == "entries" and apk_diff:
+        run_scoped_diffoscope(rebuilt_apk, official_apk, diff_dir, report, diffoscope_args, apk_diff, dex_only and not extra)
+        return
+
+    with zipfile.ZipFile(rebuilt_apk) as zf:
+        zf.extractall(rebuilt_dir)
+    with zipfile.ZipFile(official_apk) as zf:
+        zf.extractall(official_dir)
+
+    strip_signing_artifacts(rebuilt_dir)
+    strip_signing_artifacts(official_dir)
 
     cmd = ["diffoscope", *diffoscope_args, "--html", str(report), str(rebuilt_dir), str(official_dir)]
     result = run(cmd, check=False)
@@ -297,21 +807,209 @@ def run_diffoscope_report(rebuilt_apk: Path, official_apk: Path, work_dir: Path,
         print(f"diffoscope exited with status {result.returncode}. Report (if any): {report}", file=sys.stderr)
 
 
-def get_map_id(apk: Path) -> str | None:
-    with zipfile.ZipFile(apk) as zf:
-        data = zf.read("classes.dex")
-    m = re.search(rb'pg-map-id\":\"([0-9a-f]+)\"', data)
-    return m.group(1).decode() if m else None
+def run_scoped_diffoscope(
+    rebuilt_apk: Path, official_apk: Path, diff_dir: Path, report: Path, diffoscope_args: list[str], apk_diff: dict, dex_only: bool
+) -> None:
+    """Extract only the entries apkdiff found with different content and diffoscope each one in a worker pool.
+
+    Per-entry reports land in diff_dir/parts; report is a merged page with an
+    index on top, and report's .json sibling lists each entry's status.
+    """
+    members = [entry["name"] for entry in apk_diff["entries"] if entry["content"] and not entry["signing"]]
+    if dex_only:
+        members = [name for name in members if not any(fnmatch(name, pattern) for pattern in DIFFOSCOPE_DEX_ONLY_EXCLUDES)]
+    with zipfile.ZipFile(rebuilt_apk) as zf:
+        rebuilt_paths = [Path(zf.extract(name, diff_dir / "rebuilt")) for name in members]
+    with zipfile.ZipFile(official_apk) as zf:
+        official_paths = [Path(zf.extract(name, diff_dir / "official")) for name in members]
+    parts_dir = diff_dir / "parts"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    parts = [parts_dir / f"{i:04d}-{sanitize(name)}.html" for i, name in enumerate(members)]
+
+    def diff_member(i: int) -> int:
+        cmd = ["diffoscope", *diffoscope_args, "--html", str(parts[i]), str(rebuilt_paths[i]), str(official_paths[i])]
+        return subprocess.run(cmd, check=False, stdout=subprocess.DEVNULL).returncode
+
+    jobs = max(1, int(os.environ.get("VERIFY_DIFFOSCOPE_JOBS", DIFFOSCOPE_JOBS_DEFAULT)))
+    print(f"{INFO_EMOJI} Running diffoscope on {len(members)} differing entries with {jobs} workers -> {report}")
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        returncodes = list(pool.map(diff_member, range(len(members))))
+
+    index = [
+        {"name": name, "status": {0: "identical", 1: "differs"}.get(rc, f"error {rc}"), "report": str(part.relative_to(report.parent))}
+        for name, part, rc in zip(members, parts, returncodes)
+    ]
+    index += [{"name": name, "status": "only in official", "report": None} for name in apk_diff["only_in_official"] if not apkdiff.is_signing_entry(name)]
+    index += [{"name": name, "status": "only in rebuilt", "report": None} for name in apk_diff["only_in_rebuilt"] if not apkdiff.is_signing_entry(name)]
+    report.with_suffix(".json").write_text(json.dumps(index, indent=2) + "\n")
+    write_merged_diffoscope_html(report, f"{rebuilt_apk.name} vs {official_apk.name}", index)
+
+    failed = [entry["name"] for entry in index if entry["status"].startswith("error")]
+    if failed:
+        print(f"diffoscope failed for {', '.join(failed)}. Report (if any): {report}", file=sys.stderr)
+    elif any(entry["status"] != "identical" for entry in index):
+        print(f"diffoscope detected differences; see {report}", file=sys.stderr)
+    else:
+        print(f"diffoscope report (no differences) written to {report}")
+
+
+def write_merged_diffoscope_html(report: Path, title: str, index: list[dict]) -> None:
+    style = ""
+    sections = []
+    rows = []
+    for i, entry in enumerate(index):
+        name = html.escape(entry["name"])
+        rows.append(f'<tr><td><a href="#entry-{i}">{name}</a></td><td>{html.escape(entry["status"])}</td></tr>')
+        part = report.parent / entry["report"] if entry["report"] else None
+        if not part or not part.exists():
+            continue
+        text = part.read_text(errors="replace")
+        if not style:
+            found = re.search(r"<style[^>]*>.*?</style>", text, re.S)
+            style = found.group(0) if found else ""
+        body = re.search(r"<body[^>]*>(.*)</body>", text, re.S)
+        sections.append(f'<section id="entry-{i}"><h2>{name}</h2>{body.group(1) if body else text}</section>')
+    report.write_text(
+        f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>diffoscope: {html.escape(title)}</title>{style}</head>\n"
+        f'<body class="diffoscope"><h1>{html.escape(title)}</h1>\n<table><tr><th>entry</th><th>status</th></tr>{"".join(rows)}</table>\n'
+        + "\n".join(sections)
+        + "\n</body></html>\n"
+    )
+
+
+def diffoscope_version() -> str | None:
+    if os.environ.get("VERIFY_SKIP_DIFFOSCOPE", "false").lower() == "true" or shutil.which("diffoscope") is None:
+        return None
+    result = run(["diffoscope", "--version"], check=False, capture_output=True)
+    return result.stdout.strip() or None
+
+
+def package_version(name: str) -> str | None:
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def parse_flavor(value: str) -> tuple[str, Path]:
+    flavor, sep, apk = value.partition("=")
+    if not sep or not re.fullmatch(r"[A-Za-z][A-Za-z0-9]*", flavor) or not apk:
+        raise argparse.ArgumentTypeError(f"expected FLAVOR=APK (e.g. huawei=gem-huawei.apk), got {value!r}")
+    return flavor[0].lower() + flavor[1:], Path(apk)
+
+
+def flavor_gradle_task(flavors: list[str]) -> str:
+    """One Gradle invocation assembling the release APK of every flavor."""
+    return "clean " + " ".join(f":app:assemble{flavor[0].upper()}{flavor[1:]}Release" for flavor in flavors)
+
+
+def print_verdicts(targets: list[FlavorTarget], verdicts: dict[str, str]) -> None:
+    width = max(len(target.flavor) for target in targets + [FlavorTarget("flavor", Path(), Path())])
+    print(f"{'flavor':<{width}}  {'verdict':<21} rebuilt SHA-256")
+    for target in targets:
+        rebuilt_hash = sha256_files([target.rebuilt])[0]
+        verdict = verdicts[target.flavor]
+        print(f"{target.flavor:<{width}}  {VERDICT_EMOJI[verdict]} {verdict:<19} {rebuilt_hash[:16]}")
+
+
+def get_map_ids(apk: Path | zipfile.ZipFile) -> dict[str, str | None]:
+    """pg-map-id of every classes*.dex (base/dex/classes*.dex in a bundle), inflated in chunks and only up to the R8 marker."""
+    if not isinstance(apk, zipfile.ZipFile):
+        with zipfile.ZipFile(apk) as zf:
+            return get_map_ids(zf)
+    map_ids: dict[str, str | None] = {}
+    for info in apk.infolist():
+        if not (dexfile.CLASSES_DEX_RE.fullmatch(info.filename) or dexfile.BUNDLE_DEX_RE.fullmatch(info.filename)):
+            continue
+        with apk.open(info) as fh:
+            try:
+                map_ids[info.filename] = dexfile.scan_pg_map_id(iter(lambda: fh.read(MAP_ID_SCAN_CHUNK), b""))
+            except dexfile.Error as exc:
+                print(f"{WARN_EMOJI} Unable to parse {info.filename} in {Path(apk.filename or 'archive').name}: {exc}")
+                map_ids[info.filename] = None
+    return map_ids
+
+
+def official_map_ids(target: FlavorTarget) -> dict[str, str | None]:
+    """get_map_ids of the official APK or bundle; for split APKs, those of the base split under their bundle names."""
+    if target.official_copy.is_dir():
+        base = bundlediff.base_split(bundlediff.split_apks(target.official_copy))
+        return {f"base/dex/{name}": map_id for name, map_id in get_map_ids(base).items()}
+    return get_map_ids(target.official_copy)
+
+
+def scan_map_ids(target: FlavorTarget, official_maps: dict[str, str | None] | None) -> tuple[dict[str, str | None], dict[str, str | None]]:
+    """(official, rebuilt) map-ids; the official side is scanned next to the rebuilt one unless it is already known."""
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        official = pool.submit(call_holding_output, official_map_ids, target) if official_maps is None else None
+        rebuilt_maps = get_map_ids(target.rebuilt)
+        if official is None:
+            return official_maps, rebuilt_maps
+        official_maps, held = official.result()
+        print_held(held)
+        return official_maps, rebuilt_maps
+
+
+def report_map_ids(official: dict[str, str | None], rebuilt: dict[str, str | None]) -> list[str]:
+    """Print the map-id of each dex and return the dex names whose rebuilt map-id differs."""
+    mismatched = []
+    for name in sorted(official.keys() | rebuilt.keys(), key=lambda n: (len(n), n)):
+        official_id, rebuilt_id = official.get(name), rebuilt.get(name)
+        if official_id == rebuilt_id:
+            print(f"{INFO_EMOJI} {name} map-id: {official_id or 'not found'}")
+        else:
+            print(f"{WARN_EMOJI} {name} map-id: official={official_id or 'not found'} rebuilt={rebuilt_id or 'not found'}")
+            if official_id and rebuilt_id:
+                mismatched.append(name)
+    return mismatched
 
 
 def main() -> None:
-    parser = argparse.ArgumentParser(description=__doc__)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument("tag", help="Git tag or branch to build")
-    parser.add_argument("official_apk", help="Path to the official APK")
+    parser.add_argument(
+        "official_apk", nargs="?", help="Official APK, or an .aab / directory of split APKs to verify the bundle (omit when --flavor is used)"
+    )
+    parser.add_argument(
+        "--flavor",
+        action="append",
+        type=parse_flavor,
+        default=[],
+        metavar="FLAVOR=APK",
+        help="Verify this flavor against an official APK; repeatable, all flavors come from one Gradle run",
+    )
     parser.add_argument("--stage", choices=["all", "build", "diff"], default="all", help="Run build+diff, build only, or diff only (default: all)")
     parser.add_argument("--work-dir", default=None, help="Override output dir (default artifacts/reproducible/<tag>)")
+    parser.add_argument("--profile", action="store_true", help="Record cProfile data for in-process stages under <work-dir>/profile")
+    parser.add_argument(
+        "--force-stage",
+        action="append",
+        default=[],
+        choices=[*checkpoint.STAGES, "all"],
+        help="Rerun this checkpointed stage (and every stage after it) even if its inputs are unchanged; repeatable",
+    )
     args = parser.parse_args()
 
+    report = runreport.RunReport()
+    exit_status: int | str | None = 0
+    try:
+        with ThreadPoolExecutor(max_workers=BACKGROUND_JOBS) as background:
+            verify(args, report, background)
+    except SystemExit as exc:
+        exit_status = exc.code
+        raise
+    except BaseException as exc:
+        exit_status = f"error: {type(exc).__name__}"
+        raise
+    finally:
+        report.write(exit_status)
+
+
+def verify(args: argparse.Namespace, report: runreport.RunReport, background: ThreadPoolExecutor) -> None:
+    """Run the build and/or diff stages; every step is timed into report (written to <work-dir>/run_report.json).
+
+    Steps that do not depend on each other are started on background and joined where their result is needed.
+    """
     need_cmd("docker")
     need_cmd("java")
     need_cmd("unzip")
@@ -324,123 +1022,493 @@ def main() -> None:
         sys.stderr.write("local.properties is required to access GitHub packages.\n")
         sys.exit(1)
 
-    official_apk_path = Path(args.official_apk).resolve()
-    if not official_apk_path.exists():
-        sys.stderr.write(f"Official APK not found: {official_apk_path}\n")
+    if bool(args.official_apk) == bool(args.flavor):
+        sys.stderr.write("Pass either an official APK or one or more --flavor FLAVOR=APK mappings.\n")
+        sys.exit(1)
+    flavors = dict(args.flavor)
+    if len(flavors) != len(args.flavor):
+        sys.stderr.write("Each flavor can only be given once.\n")
+        sys.exit(1)
+    official_apks = {flavor: apk.resolve() for flavor, apk in flavors.items()} or {"": Path(args.official_apk).resolve()}
+    for official_apk_path in official_apks.values():
+        if not official_apk_path.exists():
+            sys.stderr.write(f"Official APK not found: {official_apk_path}\n")
+            sys.exit(1)
+    bundle = not flavors and (official_apk_path.suffix == ".aab" or official_apk_path.is_dir())
+    if official_apk_path.is_dir() and not bundlediff.split_apks(official_apk_path):
+        sys.stderr.write(f"No split APKs in {official_apk_path}\n")
         sys.exit(1)
 
     tag_safe = sanitize(args.tag) or "latest"
     map_id_seed = os.environ.get("R8_MAP_ID_SEED") or ""
     repo_url = os.environ.get("VERIFY_REPO_URL", REPO_URL_DEFAULT)
-    resolved_tag = resolve_ref(args.tag, repo_url)
-    base_tag_file = Path(__file__).with_name("base_image_tag.txt")
+    mirror_root: Path | None = None
+    fetch = os.environ.get("VERIFY_GIT_FETCH", "true").lower() == "true"
+    if os.environ.get("VERIFY_GIT_MIRROR", "false").lower() == "true":
+        mirror_root = Path(os.environ.get("VERIFY_GIT_MIRROR_DIR", root_dir / "artifacts" / "reproducible" / "git")).resolve()
     docker_platform = os.environ.get("VERIFY_DOCKER_PLATFORM", DOCKER_PLATFORM_DEFAULT)
     if docker_platform:
         os.environ.setdefault("DOCKER_DEFAULT_PLATFORM", docker_platform)
+    ref_future = background.submit(resolve_commit, args.tag, repo_url, mirror_root, fetch, report)
 
     work_dir = Path(args.work_dir) if args.work_dir else root_dir / "artifacts" / "reproducible" / tag_safe
-    if args.stage != "diff":
+    # A work dir with a stage manifest is resumed; anything else is started from scratch.
+    if args.stage != "diff" and not (work_dir / checkpoint.STAGE_MANIFEST).exists():
         shutil.rmtree(work_dir, ignore_errors=True)
-        work_dir.mkdir(parents=True, exist_ok=True)
-    else:
-        work_dir.mkdir(parents=True, exist_ok=True)
-
-    official_copy = work_dir / "official.apk"
-    rebuilt_apk = work_dir / "rebuilt.apk"
-    r8_patched_apk = work_dir / "r8_patched.apk"
+    work_dir.mkdir(parents=True, exist_ok=True)
+    checkpoints = checkpoint.Checkpoints(work_dir, checkpoint.STAGES if "all" in args.force_stage else args.force_stage)
+    report.path = work_dir / runreport.RUN_REPORT
+    report.profile_dir = work_dir / "profile" if args.profile else None
+    report.info.update(tag=args.tag, stage=args.stage, skipped_stages=checkpoints.skipped)
+    tools_dir = Path(__file__).resolve().parent
+    store = Path(os.environ.get("VERIFY_BLOB_DIR", root_dir / "artifacts" / "reproducible" / "blobs")).resolve()
+
+    # Without --flavor, the single pair lives in the work dir itself; otherwise each flavor gets flavors/<flavor>, away from apk/, source/ and profile/.
+    targets = [FlavorTarget(flavor, apk, work_dir / "flavors" / flavor if flavor else work_dir, bundle) for flavor, apk in official_apks.items()]
+    rebuilt_apks = [target.rebuilt for target in targets]
+    # A work dir reused across modes (single APK, bundle, flavors) keeps files of the other mode that no checkpoint tracks; drop them.
+    keep = {target.official_copy for target in targets} | {target.work_dir / PAYLOAD_REPORT for target in targets}
+    for leftover in (work_dir / name for name in ("official.apk", "official.aab", "official_splits", PAYLOAD_REPORT)):
+        if leftover in keep:
+            continue
+        if leftover.is_dir():
+            shutil.rmtree(leftover)
+        else:
+            leftover.unlink(missing_ok=True)
 
     # Stage: build
+    official_future = None
     if args.stage in ("all", "build"):
-        shutil.copy2(official_apk_path, official_copy)
+        official_future = background.submit(prepare_official, store, targets, report)
         base_image = os.environ.get("VERIFY_BASE_IMAGE", BASE_IMAGE_DEFAULT)
-        env_base_tag = os.environ.get("VERIFY_BASE_TAG")
-        file_base_tag = base_tag_file.read_text().strip() if base_tag_file.exists() else None
-        base_tag = env_base_tag or file_base_tag
+        base_tag = read_base_tag()
         if not base_tag:
             sys.stderr.write("Missing base image tag; set VERIFY_BASE_TAG or create reproducible/base_image_tag.txt\n")
             sys.exit(1)
         pull_base = os.environ.get("VERIFY_PULL_BASE", "true").lower() == "true"
-        gradle_task = os.environ.get("VERIFY_GRADLE_TASK", BUNDLE_TASK_DEFAULT)
-        apk_subdir = os.environ.get("VERIFY_APK_SUBDIR", APK_SUBDIR_DEFAULT)
+        if flavors:
+            gradle_task = os.environ.get("VERIFY_GRADLE_TASK") or flavor_gradle_task(list(flavors))
+            apk_subdir = APK_OUTPUTS_DIR
+        elif bundle:
+            gradle_task = os.environ.get("VERIFY_GRADLE_TASK", BUNDLE_TASK_DEFAULT)
+            apk_subdir = os.environ.get("VERIFY_BUNDLE_SUBDIR", BUNDLE_SUBDIR_DEFAULT)
+        else:
+            gradle_task = os.environ.get("VERIFY_GRADLE_TASK", BUNDLE_TASK_DEFAULT)
+            apk_subdir = os.environ.get("VERIFY_APK_SUBDIR", APK_SUBDIR_DEFAULT)
         workers_max = os.environ.get("GRADLE_WORKERS_MAX", GRADLE_WORKERS_MAX_DEFAULT)
 
         app_image_tag = sanitize(args.tag.lower()) or "latest"
         app_image = os.environ.get("VERIFY_APP_IMAGE", APP_IMAGE_DEFAULT) + f":{app_image_tag}"
         app_container = f"gem-android-app-build-{tag_safe}"
-
-        gradle_cache = reset_cache_dir(Path(os.environ.get("VERIFY_GRADLE_CACHE", tempfile.mkdtemp())), f"{STEP_EMOJI} Gradle")
-        maven_cache = reset_cache_dir(Path(os.environ.get("VERIFY_M2_CACHE", tempfile.mkdtemp())), f"{STEP_EMOJI} Maven")
-
-        try:
-            print(f"{STEP_EMOJI} Building base image (or reusing) and app image...")
-            ensure_base_image(base_image, base_tag, pull_base, docker_platform)
-            print(
-                f"{INFO_EMOJI} Build parameters: base_image={base_image}:{base_tag}, "
-                f"platform={docker_platform}, gradle_task='{gradle_task}', R8_MAP_ID_SEED='{map_id_seed}', workers_max={workers_max}"
-            )
-            build_app_image(resolved_tag, base_image, base_tag, gradle_task, map_id_seed, app_image, docker_platform)
-            build_outputs_in_container(app_image, app_container, gradle_task, map_id_seed, gradle_cache, maven_cache, docker_platform, workers_max)
-            built_apk = extract_apk_outputs(app_container, work_dir, apk_subdir)
-            shutil.copy2(built_apk, rebuilt_apk)
-        finally:
-            run(["docker", "rm", "-f", app_container], check=False)
-            remove_cache_dir(gradle_cache, "Gradle")
-            remove_cache_dir(maven_cache, "Maven")
+        cache_mode = os.environ.get("VERIFY_CACHE_MODE", CACHE_MODE_DEFAULT).lower()
+        cache_root = Path(os.environ.get("VERIFY_CACHE_DIR", root_dir / "artifacts" / "reproducible" / "cache")).resolve()
+        cold_every = int(os.environ.get("VERIFY_CACHE_COLD_EVERY", CACHE_COLD_EVERY_DEFAULT))
+        build_mode = os.environ.get("VERIFY_BUILD_MODE", BUILD_MODE_DEFAULT).lower()
+        task_timing = os.environ.get("VERIFY_GRADLE_TASK_TIMING", "true").lower() == "true"
+
+        print(f"{STEP_EMOJI} Building base image (or reusing) and app image...")
+        base_future = background.submit(prepare_base_image, base_image, base_tag, pull_base, docker_platform, report)
+        resolved_tag, commit = ref_future.result()
+        base_image_id = base_future.result()
+        print(
+            f"{INFO_EMOJI} Build parameters: base_image={base_image}:{base_tag}, "
+            f"platform={docker_platform}, gradle_task='{gradle_task}', R8_MAP_ID_SEED='{map_id_seed}', workers_max={workers_max}, build_mode={build_mode}"
+        )
+        build_inputs = {
+            "commit": commit,
+            "repo_url": repo_url,
+            "base_image": base_image_id,
+            "gradle_task": gradle_task,
+            "map_id_seed": map_id_seed,
+            "apk_subdir": apk_subdir,
+            "flavors": sorted(flavors),
+            "platform": docker_platform,
+            "build_mode": build_mode,
+            "tools": checkpoint.tool_digest([tools_dir / "Dockerfile", tools_dir / TASK_TIMING_INIT_SCRIPT]),
+        }
+        if checkpoints.skip("build", build_inputs):
+            print(f"{OK_EMOJI} Build inputs unchanged since the last run; reusing {', '.join(map(str, rebuilt_apks))} (--force-stage build rebuilds).")
+        else:
+            source_dir = None
+            if mirror_root:
+                source_dir = work_dir / "source"
+                print(f"{STEP_EMOJI} Checking out {commit} from the local mirror...")
+                with report.stage("source_checkout", in_process=True, commit=commit):
+                    gitmirror.checkout(mirror_root, repo_url, commit, source_dir)
+            if build_mode == "buildkit":
+                if cache_mode == "warm":
+                    print(f"{WARN_EMOJI} VERIFY_CACHE_MODE=warm needs the container build; using clean cache mounts with VERIFY_BUILD_MODE=buildkit.")
+                cache_id = os.environ.get("VERIFY_BUILDKIT_CACHE_ID") or f"gem-android-verify-{tag_safe}"
+                try:
+                    with report.stage("buildkit_build", task=gradle_task, workers_max=workers_max) as entry:
+                        gradle_log = build_outputs_with_buildkit(
+                            resolved_tag, base_image, base_tag, gradle_task, map_id_seed, docker_platform, workers_max, apk_subdir, cache_id,
+                            work_dir / "apk", work_dir / GRADLE_LOG, task_timing, source_dir,
+                        )
+                        entry["gradle"] = gradlelog.summarize(gradle_log)
+                finally:
+                    if source_dir:
+                        shutil.rmtree(source_dir, ignore_errors=True)
+                write_gradle_report(work_dir, entry["gradle"], gradle_log)
+                with report.stage("copy_rebuilt", in_process=True):
+                    place_rebuilt(store, work_dir / "apk", apk_subdir, targets)
+            else:
+                gradle_cache = reset_cache_dir(Path(os.environ.get("VERIFY_GRADLE_CACHE", tempfile.mkdtemp())), f"{STEP_EMOJI} Gradle")
+                maven_cache = reset_cache_dir(Path(os.environ.get("VERIFY_M2_CACHE", tempfile.mkdtemp())), f"{STEP_EMOJI} Maven")
+
+                try:
+                    with report.stage("app_image", image=app_image):
+                        build_app_image(resolved_tag, base_image, base_tag, gradle_task, map_id_seed, app_image, docker_platform, source_dir)
+                    ro_dep_cache = None
+                    if cache_mode == "warm":
+                        with report.stage("dependency_cache_prepare", in_process=True) as entry:
+                            commit, cache_inputs = read_cache_inputs(app_image, docker_platform)
+                            cache_key = buildcache.cache_key(cache_inputs, f"{base_image}:{base_tag}")
+                            ro_dep_cache = prepare_dependency_cache(cache_root, cache_key, gradle_cache, maven_cache)
+                            entry["warm"] = bool(ro_dep_cache)
+                    with report.stage("gradle_build", task=gradle_task, workers_max=workers_max) as entry:
+                        gradle_log = build_outputs_in_container(
+                            app_image, app_container, gradle_task, map_id_seed, gradle_cache, maven_cache, docker_platform, workers_max,
+                            work_dir / GRADLE_LOG, ro_dep_cache, task_timing,
+                        )
+                        entry["gradle"] = gradlelog.summarize(gradle_log)
+                    write_gradle_report(work_dir, entry["gradle"], gradle_log)
+                    with report.stage("extract_outputs"):
+                        apk_dir = extract_apk_outputs(app_container, work_dir, apk_subdir)
+                    with report.stage("copy_rebuilt", in_process=True):
+                        built_hash = place_rebuilt(store, apk_dir, apk_subdir, targets)
+                    if cache_mode == "warm":
+                        with report.stage("dependency_cache_finish", in_process=True):
+                            finish_dependency_cache(cache_root, cache_key, cache_inputs, commit, bool(ro_dep_cache), built_hash, gradle_cache, maven_cache)
+                        if ro_dep_cache and buildcache.cold_run_due(cache_root, cold_every):
+                            # The control rebuilds this commit, so it always has the warm digest just recorded to compare with.
+                            print(f"{INFO_EMOJI} Rebuilding {commit} with empty caches as a cold control ({cold_every} warm builds since the last one).")
+                            with report.stage("cold_control_build", task=gradle_task, workers_max=workers_max):
+                                control_hash = cold_control_build(
+                                    app_image, f"{app_container}-cold", gradle_task, map_id_seed, docker_platform, workers_max, work_dir, apk_subdir, targets,
+                                    task_timing,
+                                )
+                            check_cache_builds(cache_root, cache_key, commit, False, control_hash)
+                            print(f"{OK_EMOJI} Cold control build of {commit} matches the warm build.")
+                finally:
+                    with report.stage("cleanup"):
+                        run(["docker", "rm", "-f", app_container], check=False)
+                        remove_cache_dir(gradle_cache, "Gradle")
+                        remove_cache_dir(maven_cache, "Maven")
+                        if source_dir:
+                            shutil.rmtree(source_dir, ignore_errors=True)
+
+            checkpoints.record("build", [*rebuilt_apks, work_dir / GRADLE_LOG, work_dir / GRADLE_TASKS_REPORT])
 
         if args.stage == "build":
+            official_future.result()
             print(f"{OK_EMOJI} Build complete. Artifacts in {work_dir}")
             return
 
     # Stage: diff (can be run standalone if artifacts already exist)
-    if not official_copy.exists() and official_apk_path.exists():
-        shutil.copy2(official_apk_path, official_copy)
-    if not official_copy.exists() or not rebuilt_apk.exists():
-        sys.stderr.write("Missing official.apk or rebuilt.apk; run with --stage build first.\n")
-        sys.exit(1)
-
-    rebuilt_hash = sha256_file(rebuilt_apk)
-    official_hash = sha256_file(official_copy)
-    print(f"{INFO_EMOJI} Rebuilt APK SHA-256 : {rebuilt_hash}")
-    print(f"{INFO_EMOJI} Official APK SHA-256: {official_hash}")
-
-    if rebuilt_hash == official_hash:
-        print(f"{OK_EMOJI} Success: APKs match.")
-        return
+    ref_future.result()
+    official_maps = official_future.result() if official_future else {}
+    for target in targets:
+        if not target.official_copy.exists() and target.official_apk.exists():
+            target.work_dir.mkdir(parents=True, exist_ok=True)
+            place_official(store, target)
+        if not target.official_copy.exists() or not target.rebuilt.exists():
+            sys.stderr.write(f"Missing {target.official_copy.name} or {target.rebuilt.name} in {target.work_dir}; run with --stage build first.\n")
+            sys.exit(1)
 
-    official_map = get_map_id(official_copy)
-    rebuilt_map = get_map_id(rebuilt_apk)
-    if official_map and rebuilt_map and official_map != rebuilt_map:
-        print(f"{STEP_EMOJI} Patching map-id {rebuilt_map} -> {official_map} ...")
-        run([sys.executable, str(Path(__file__).with_name("fix_pg_map_id.py")), str(rebuilt_apk), str(r8_patched_apk), official_map], check=True)
-        print(f"{OK_EMOJI} Map-id patched to {official_map}")
-    elif official_map and rebuilt_map == official_map:
-        print(f"{OK_EMOJI} Map-id already matches official; skipping patch.")
+    reports_dir = root_dir / "artifacts" / "reproducible" / "reports" / tag_safe
+    if len(targets) == 1 and not targets[0].flavor:
+        verdicts = {"": (diff_bundle_target if bundle else diff_target)(targets[0], store, reports_dir, checkpoints, report, tools_dir, official_maps.get(""))}
     else:
-        print(f"{WARN_EMOJI} Map-id not found; skipping patch.")
-
-    # Reattach official signing block after map-id patch to confirm payload identity.
-    rebuilt_for_sig = r8_patched_apk if r8_patched_apk.exists() else rebuilt_apk
-    rebuilt_signed = work_dir / "rebuilt_signed.apk"
-    signed_hash = copy_signing_block(official_copy, rebuilt_for_sig, rebuilt_signed)
-    if signed_hash:
-        print(f"{INFO_EMOJI} Rebuilt (signature copied) SHA-256: {signed_hash}")
-        if signed_hash == official_hash:
-            print(f"{OK_EMOJI} APK matches official releases with the signing block is copied.")
-            copy_reports(root_dir, work_dir, tag_safe, ["official.apk", "rebuilt.apk", "r8_patched.apk", "rebuilt_signed.apk", "diffoscope.html", "diffoscope_patched.html"])
-            return
+        force = checkpoint.STAGES if "all" in args.force_stage else args.force_stage
+        with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+            futures = [
+                pool.submit(
+                    diff_flavor, target, store, reports_dir / target.flavor, checkpoint.Checkpoints(target.work_dir, force), report, tools_dir,
+                    official_maps.get(target.flavor),
+                )
+                for target in targets
+            ]
+            verdicts = {target.flavor: future.result() for target, future in zip(targets, futures)}
+        report.info["verdicts"] = verdicts
+        print_verdicts(targets, verdicts)
+
+    if "mismatch" in verdicts.values() and os.environ.get("VERIFY_ALLOW_MISMATCH", "false").lower() != "true":
+        sys.exit(2)
+    if "partial match" in verdicts.values() and os.environ.get("VERIFY_ALLOW_PARTIAL_MATCH", "false").lower() != "true":
+        # The manifest and resources were not verified; only an explicit opt-in turns that into success.
+        print(f"{INFO_EMOJI} Set VERIFY_ALLOW_PARTIAL_MATCH=true to accept a match that leaves converted entries unverified.", file=sys.stderr)
+        sys.exit(bundlediff.PARTIAL_MATCH_EXIT)
+
+
+def diff_flavor(target: FlavorTarget, *args: Any) -> str:
+    """diff_target for one of several flavors diffed side by side; its output is printed as one block when it finishes."""
+    try:
+        with holding_output() as held:
+            print(f"{STEP_EMOJI} Diff of flavor {target.flavor}:")
+            return diff_target(target, *args)
+    finally:
+        print_held(held)
+
+
+def signature_copy_needed(official_apk: Path) -> bool:
+    # v1 (JAR) signature entries are part of the payload; only re-signing can account for them.
+    return os.environ.get("VERIFY_APKSIGCOPIER", "false").lower() == "true" or has_jar_signature(official_apk)
+
+
+def apk_verdict(
+    official_apk: Path,
+    rebuilt_apk: Path,
+    official_hash: str,
+    rebuilt_hash: str,
+    work_dir: Path,
+    patch: Callable[[], Path | None],
+    sign: Callable[[Path, Path], str | None],
+    report: runreport.RunReport,
+    prefix: str = "",
+    label: str = "",
+) -> tuple[str, Path]:
+    """Decide the verdict for one official/rebuilt APK pair; return it with the rebuilt APK it was reached with.
+
+    patch() patches the official map-id into the rebuilt APK and returns the
+    patched copy, or None if none was needed. sign(apk, output) copies the
+    official signature onto apk and returns output's SHA-256, or None if that
+    failed. verify_apk.py and verifylib.verify() both decide through here.
+    """
+    if rebuilt_hash == official_hash:
+        print(f"{OK_EMOJI} {label}Success: APKs match.")
+        return "identical", rebuilt_apk
+
+    candidate = patch() or rebuilt_apk
+    # Compare the payload the v2/v3 signatures cover, leaving the signing block out.
+    with report.stage(f"{prefix}payload_digest", in_process=True) as entry:
+        entry["match"] = compare_payload(official_apk, candidate, work_dir)
+    if entry["match"]:
+        print(f"{OK_EMOJI} {label}APK matches official release apart from the signing block.")
+        return "payload match", candidate
+
+    if signature_copy_needed(official_apk):
+        rebuilt_signed = work_dir / "rebuilt_signed.apk"
+        signed_hash = sign(candidate, rebuilt_signed)
+        if signed_hash:
+            print(f"{INFO_EMOJI} {label}Rebuilt (signature copied) SHA-256: {signed_hash}")
+            if signed_hash == official_hash:
+                print(f"{OK_EMOJI} {label}APK matches official releases with the signing block is copied.")
+                return "signature copy match", rebuilt_signed
+        else:
+            print(f"{WARN_EMOJI} {label}Signature copy skipped or failed; proceeding with diffoscope.")
+
+    print(f"{FAIL_EMOJI} {label}Mismatch: APKs differ.", file=sys.stderr)
+    return "mismatch", candidate
+
+
+def diff_target(
+    target: FlavorTarget,
+    store: Path,
+    reports_dir: Path,
+    checkpoints: checkpoint.Checkpoints,
+    report: runreport.RunReport,
+    tools_dir: Path,
+    official_maps: dict[str, str | None] | None = None,
+) -> str:
+    """Hash, map-id patch, payload/signature check and diff reports for one official/rebuilt pair; return the verdict."""
+    work_dir = target.work_dir
+    official_copy = target.official_copy
+    rebuilt_apk = target.rebuilt
+    r8_patched_apk = work_dir / "r8_patched.apk"
+    # Flavors are diffed side by side; tell their stages and messages apart.
+    prefix = f"{target.flavor}:" if target.flavor else ""
+    label = f"[{target.flavor}] " if target.flavor else ""
+
+    with report.stage(f"{prefix}hash", in_process=True):
+        rebuilt_hash, official_hash = sha256_files([rebuilt_apk, official_copy])
+    # Every payload check rewrites it and no checkpoint keeps it, so the last run's must not outlive an identical verdict.
+    (work_dir / PAYLOAD_REPORT).unlink(missing_ok=True)
+    print(f"{INFO_EMOJI} {label}Rebuilt APK SHA-256 : {rebuilt_hash}")
+    print(f"{INFO_EMOJI} {label}Official APK SHA-256: {official_hash}")
+
+    def patch() -> Path | None:
+        with report.stage(f"{prefix}map_id_scan", in_process=True):
+            official, rebuilt = scan_map_ids(target, official_maps)
+        patch_inputs = {"official": official_hash, "rebuilt": rebuilt_hash}
+        patch_map_id(rebuilt_apk, r8_patched_apk, official, rebuilt, patch_inputs, checkpoints, report, tools_dir, prefix=prefix, label=label)
+        return r8_patched_apk if r8_patched_apk.exists() else None
+
+    def sign(apk: Path, rebuilt_signed: Path) -> str | None:
+        sig_inputs = {"official": official_hash, "rebuilt": sha256_files([apk])[0], "apksigcopier": package_version("apksigcopier")}
+        if checkpoints.skip("signature_copy", sig_inputs):
+            print(f"{OK_EMOJI} {label}Reusing the signature copy from the last run.")
+            return sha256_files([rebuilt_signed])[0] if rebuilt_signed.exists() else None
+        with report.stage(f"{prefix}signature_copy", in_process=True):
+            signed_hash = copy_signing_block(official_copy, apk, rebuilt_signed)
+        checkpoints.record("signature_copy", [rebuilt_signed])
+        return signed_hash
+
+    verdict, compared = apk_verdict(official_copy, rebuilt_apk, official_hash, rebuilt_hash, work_dir, patch, sign, report, prefix, label)
+    if verdict == "identical":
+        return verdict
+    if not signature_copy_needed(official_copy):
+        checkpoints.discard("signature_copy")
+    if verdict == "payload match":
+        copy_reports(store, work_dir, reports_dir, ["official.apk", "rebuilt.apk", "r8_patched.apk", PAYLOAD_REPORT])
+        return verdict
+    if verdict == "signature copy match":
+        copy_reports(store, work_dir, reports_dir, ["official.apk", "rebuilt.apk", "r8_patched.apk", "rebuilt_signed.apk", PAYLOAD_REPORT])
+        return verdict
+
+    # Report on the rebuilt APK as built and, when the map-id was patched, on the patched copy the verdict was reached with.
+    pairs = [(rebuilt_apk, "")]
+    if compared != rebuilt_apk:
+        pairs.append((compared, "_patched"))
+    diff_inputs = {
+        "official": official_hash,
+        "rebuilt": dict(zip([suffix for _, suffix in pairs], sha256_files([apk for apk, _ in pairs]))),
+        "settings": {name: os.environ.get(name) for name in DIFF_SETTINGS},
+        "diffoscope": diffoscope_version(),
+        "tools": checkpoint.tool_digest([tools_dir / name for name in ("apkdiff.py", "apkzip.py", "verify_apk.py")]),
+    }
+    if checkpoints.skip("diff_reports", diff_inputs):
+        print(f"{OK_EMOJI} {label}Diff inputs unchanged since the last run; reusing the apkdiff/diffoscope reports in {work_dir}.")
     else:
-        print(f"{WARN_EMOJI} Signature copy skipped or failed; proceeding with diffoscope.")
-
-    print(f"{FAIL_EMOJI} Mismatch: APKs differ.", file=sys.stderr)
-    run_diffoscope_report(rebuilt_for_sig, official_copy, work_dir)
-    if r8_patched_apk.exists():
-        run_diffoscope_report(r8_patched_apk, official_copy, work_dir, suffix="_patched")
+        # The reports of both pairs are built side by side; each one's messages are printed after the join, plain pair first.
+        with report.stage(f"{prefix}apkdiff", in_process=True), ThreadPoolExecutor(max_workers=len(pairs)) as pool:
+            futures = [pool.submit(call_holding_output, run_apk_diff_report, apk, official_copy, work_dir, suffix) for apk, suffix in pairs]
+            apk_diffs = {}
+            for (_, suffix), future in zip(pairs, futures):
+                apk_diffs[suffix], held = future.result()
+                print_held(held)
+        with report.stage(f"{prefix}diffoscope"), ThreadPoolExecutor(max_workers=len(pairs)) as pool:
+            futures = [pool.submit(call_holding_output, run_diffoscope_report, apk, official_copy, work_dir, suffix, apk_diffs[suffix]) for apk, suffix in pairs]
+            for future in futures:
+                print_held(future.result()[1])
+        checkpoints.record(
+            "diff_reports", [work_dir / f"{name}{suffix}.{ext}" for _, suffix in pairs for name, ext in (("apkdiff", "json"), ("diffoscope", "html"), ("diffoscope", "json"))]
+        )
     # Copy a subset into reports folder for convenience
-    copy_reports(root_dir, work_dir, tag_safe, ["official.apk", "rebuilt.apk", "rebuilt_signed.apk", "r8_patched.apk", "diffoscope.html", "diffoscope_patched.html"])
-
-    if os.environ.get("VERIFY_ALLOW_MISMATCH", "false").lower() == "true":
-        return
-    sys.exit(2)
+    copy_reports(store, work_dir, reports_dir, ["official.apk", "rebuilt.apk", "rebuilt_signed.apk", "r8_patched.apk", PAYLOAD_REPORT, "apkdiff.json", "apkdiff_patched.json", "diffoscope.html", "diffoscope_patched.html", "diffoscope.json", "diffoscope_patched.json"])
+
+    return "mismatch"
+
+
+def diff_bundle_target(
+    target: FlavorTarget,
+    store: Path,
+    reports_dir: Path,
+    checkpoints: checkpoint.Checkpoints,
+    report: runreport.RunReport,
+    tools_dir: Path,
+    official_maps: dict[str, str | None] | None = None,
+) -> str:
+    """Map-id patch and entry-by-entry comparison of the rebuilt .aab with the official bundle or split APKs; return the verdict."""
+    work_dir = target.work_dir
+    splits = target.official_copy.is_dir()
+    official_files = bundlediff.split_apks(target.official_copy) if splits else [target.official_copy]
+    rebuilt_aab = target.rebuilt
+    r8_patched_aab = work_dir / "r8_patched.aab"
+
+    with report.stage("hash", in_process=True):
+        rebuilt_hash, *official_hashes = sha256_files([rebuilt_aab, *official_files])
+    print(f"{INFO_EMOJI} Rebuilt bundle SHA-256 : {rebuilt_hash}")
+    for path, digest in zip(official_files, official_hashes):
+        print(f"{INFO_EMOJI} Official {path.name} SHA-256: {digest}")
+    if not splits and official_hashes == [rebuilt_hash]:
+        print(f"{OK_EMOJI} Success: bundles match.")
+        return "identical"
+
+    with report.stage("map_id_scan", in_process=True):
+        official_maps, rebuilt_maps = scan_map_ids(target, official_maps)
+    patch_inputs = {"official": official_hashes, "rebuilt": rebuilt_hash}
+    patch_map_id(rebuilt_aab, r8_patched_aab, official_maps, rebuilt_maps, patch_inputs, checkpoints, report, tools_dir, streaming=True)
+    # Bundles carry v1 (JAR) signatures at most; the signing entries are simply left out of the comparison.
+    checkpoints.discard("signature_copy")
+
+    candidate = r8_patched_aab if r8_patched_aab.exists() else rebuilt_aab
+    report_path = work_dir / BUNDLE_REPORT
+    diff_inputs = {
+        "official": official_hashes,
+        "rebuilt": sha256_files([candidate])[0],
+        "tools": checkpoint.tool_digest([tools_dir / name for name in ("bundlediff.py", "apkdiff.py", "apkzip.py")]),
+    }
+    if checkpoints.skip("diff_reports", diff_inputs):
+        print(f"{OK_EMOJI} Diff inputs unchanged since the last run; reusing {report_path}.")
+        diff = json.loads(report_path.read_text())
+    else:
+        with report.stage("bundlediff", in_process=True):
+            diff = bundlediff.diff_bundle(official_files, candidate)
+        report_path.write_text(json.dumps(diff, indent=2) + "\n")
+        checkpoints.record("diff_reports", [report_path])
+    bundlediff.print_summary(diff)
+    copy_reports(store, work_dir, reports_dir, ["official.aab", "rebuilt.aab", "r8_patched.aab", BUNDLE_REPORT])
+    if diff["identical"] and not diff["complete"]:
+        skipped = diff["not_comparable"]
+        shown = ", ".join(skipped[:NOT_COMPARED_SHOWN]) + (f", and {len(skipped) - NOT_COMPARED_SHOWN} more in {report_path}" if len(skipped) > NOT_COMPARED_SHOWN else "")
+        print(
+            f"{WARN_EMOJI} Partial match: the compared entries match the official split APKs, but {len(skipped)} entries "
+            f"bundletool converts were not compared: {shown}",
+            file=sys.stderr,
+        )
+        return "partial match"
+    if diff["identical"]:
+        print(f"{OK_EMOJI} Bundle matches the official {'split APKs' if splits else 'bundle'} entry by entry, signing entries aside.")
+        return "entries match"
+    print(f"{FAIL_EMOJI} Mismatch: bundle entries differ (see {report_path}).", file=sys.stderr)
+    return "mismatch"
+
+
+def patch_map_id(
+    rebuilt: Path,
+    patched: Path,
+    official_maps: dict[str, str | None],
+    rebuilt_maps: dict[str, str | None],
+    inputs: dict,
+    checkpoints: checkpoint.Checkpoints,
+    report: runreport.RunReport,
+    tools_dir: Path,
+    streaming: bool = False,
+    prefix: str = "",
+    label: str = "",
+) -> None:
+    """Write rebuilt with the official map-id to patched when they differ (checkpointed as map_id_patch); otherwise leave patched absent."""
+    mismatched = report_map_ids(official_maps, rebuilt_maps)
+    official_ids = sorted({map_id for map_id in official_maps.values() if map_id})
+    rebuilt_ids = sorted({rebuilt_maps[name] for name in mismatched})
+    official_map = official_ids[0] if len(official_ids) == 1 else None
+    patch_inputs = {
+        **inputs,
+        "map_id": official_map,
+        "tools": checkpoint.tool_digest([tools_dir / name for name in ("fix_pg_map_id.py", "apkzip.py", "dexfile.py")]),
+    }
+    if len(official_ids) > 1:
+        print(f"{WARN_EMOJI} {label}Official dex files carry different map-ids ({', '.join(official_ids)}); skipping patch.")
+        checkpoints.discard("map_id_patch")
+    elif official_map and mismatched and checkpoints.skip("map_id_patch", patch_inputs):
+        print(f"{OK_EMOJI} {label}Reusing {patched.name} from the last run (map-id {official_map}).")
+    elif official_map and mismatched:
+        print(f"{STEP_EMOJI} {label}Patching map-id {', '.join(rebuilt_ids)} -> {official_map} in {', '.join(mismatched)} ...")
+        if streaming:
+            # Bundles can be large: patch one dex at a time, spilling to a temp file above VERIFY_PATCH_MAX_MEMORY.
+            max_memory = os.environ.get("VERIFY_PATCH_MAX_MEMORY")
+            try:
+                patch_options = {"streaming": True, "max_memory": fix_pg_map_id.parse_size(max_memory) if max_memory else None}
+            except argparse.ArgumentTypeError as exc:
+                sys.stderr.write(f"VERIFY_PATCH_MAX_MEMORY: {exc}\n")
+                sys.exit(1)
+            stage_info = {"max_memory": max_memory}
+        else:
+            patch_jobs = os.environ.get("VERIFY_PATCH_JOBS", PATCH_JOBS_DEFAULT)
+            patch_options, stage_info = {"jobs": int(patch_jobs)}, {"jobs": patch_jobs}
+        # The patched file may be a link into the blob store; never write through it.
+        patched.unlink(missing_ok=True)
+        with report.stage(f"{prefix}map_id_patch", in_process=True, **stage_info):
+            fix_pg_map_id.fix_pg_map_id_apk(rebuilt, patched, official_map, **patch_options)
+        checkpoints.record("map_id_patch", [patched])
+        print(f"{OK_EMOJI} {label}Map-id patched to {official_map}")
+    elif official_map and any(rebuilt_maps.values()):
+        print(f"{OK_EMOJI} {label}Map-id already matches official; skipping patch.")
+        checkpoints.discard("map_id_patch")
+    else:
+        print(f"{WARN_EMOJI} {label}Map-id not found; skipping patch.")
+        checkpoints.discard("map_id_patch")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+"""
+Library API over the reproducible/ tools, for callers that verify many releases in one process.
+
+The scripts stay the command-line entry points; this module is for services
+that would otherwise start an interpreter per step. Put reproducible/ on
+sys.path (as batch_verify.py does for verify_apk.py) and import verifylib:
+
+    official = verifylib.apk_index("official.apk")
+    patched = verifylib.patch_map_id("rebuilt.apk", "r8_patched.apk", official)
+    report = verifylib.diff_dex(official, patched)
+    result = verifylib.verify(official, "rebuilt.apk", Path("work"))
+
+Every function takes a path or an already-open zipfile.ZipFile. The ApkIndex
+that apk_index returns (central directory, SHA-256, map-ids) is accepted
+wherever an APK is, so an archive is hashed and scanned once however many
+steps look at it, and load_dex results can be passed to diff_dex the same
+way. Nothing here builds: verify() takes an APK that was already rebuilt,
+e.g. by `verify_apk.py --stage build`. It decides the verdict through the
+same function as verify_apk.py's diff stage, so both give the same verdict
+for the same pair of APKs.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import os
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Union
+
+import apkdiff
+import dexdiff
+import fix_pg_map_id
+import runreport
+import verify_apk
+
+
+class ApkIndex(NamedTuple):
+    path: Path | None  # None for an archive that only exists in memory
+    sha256: str | None
+    entries: Dict[str, zipfile.ZipInfo]
+    map_ids: Dict[str, str | None]
+
+    @property
+    def map_id(self) -> str | None:
+        """The map-id every dex carries, or None if there is none or they disagree."""
+        ids = {map_id for map_id in self.map_ids.values() if map_id}
+        return ids.pop() if len(ids) == 1 else None
+
+
+class Verification(NamedTuple):
+    verdict: str  # "identical", "payload match", "signature copy match" or "mismatch"
+    official: ApkIndex
+    rebuilt: ApkIndex
+    patched: ApkIndex | None  # rebuilt with the official map-id, when it had to be patched
+    signed: Path | None  # rebuilt with the official signature copied, on a signature copy match
+    apk_diff: Dict[str, Any] | None  # entry-level diff, on a mismatch
+
+
+ApkSource = Union[str, os.PathLike, zipfile.ZipFile, ApkIndex]
+
+
+def apk_index(apk: ApkSource) -> ApkIndex:
+    """Central directory, SHA-256 and per-dex map-ids of apk; an ApkIndex is returned as is."""
+    if isinstance(apk, ApkIndex):
+        return apk
+    path = _path(apk)
+    with _open(apk) as zf:
+        entries = {info.filename: info for info in zf.infolist()}
+        map_ids = verify_apk.get_map_ids(zf)
+    return ApkIndex(path, verify_apk.sha256_file(path) if path else None, entries, map_ids)
+
+
+def patch_map_id(
+    apk: ApkSource,
+    output: str | os.PathLike,
+    map_id: str | ApkIndex,
+    jobs: int = 1,
+    streaming: bool = False,
+    max_memory: int | None = None,
+    raw_copy: bool = True,
+) -> ApkIndex:
+    """Write apk to output with map_id (or the official ApkIndex's map-id) patched in, as fix_pg_map_id.py does; return output's index."""
+    if isinstance(map_id, ApkIndex):
+        official = map_id
+        map_id = official.map_id
+        if map_id is None:
+            raise ValueError(f"{official.path or 'the official APK'} has no single map-id to patch in")
+    output = Path(output)
+    # output may be a link into a blob store; never write through it.
+    output.unlink(missing_ok=True)
+    source = _on_disk(apk) if isinstance(apk, ApkIndex) else apk
+    fix_pg_map_id.fix_pg_map_id_apk(source, output, map_id, raw_copy, jobs, streaming, max_memory)
+    return apk_index(output)
+
+
+def load_dex(apk: ApkSource, mask_map_id: bool = True) -> List[dexdiff.DexModel]:
+    """Parsed classes*.dex of apk (or the single dex file at a path), for diff_dex."""
+    if isinstance(apk, zipfile.ZipFile):
+        return dexdiff.load_dex(apk, mask_map_id)
+    return dexdiff.load_dex(_on_disk(apk), mask_map_id)
+
+
+def diff_dex(
+    official: ApkSource | List[dexdiff.DexModel], rebuilt: ApkSource | List[dexdiff.DexModel], mask_map_id: bool = True
+) -> Dict[str, Any]:
+    """dexdiff.py's structural report; either side may be load_dex output, which is reused instead of parsed again."""
+    official_dex = official if isinstance(official, list) else load_dex(official, mask_map_id)
+    rebuilt_dex = rebuilt if isinstance(rebuilt, list) else load_dex(rebuilt, mask_map_id)
+    return dexdiff.diff_dex(official_dex, rebuilt_dex)
+
+
+def diff_apk(official: ApkSource, rebuilt: ApkSource) -> Dict[str, Any]:
+    """apkdiff.py's entry-level report."""
+    return apkdiff.diff_apks(_on_disk(official), _on_disk(rebuilt))
+
+
+def verify(
+    official: ApkSource, rebuilt: ApkSource, work_dir: Path, jobs: int = 1, report: runreport.RunReport | None = None
+) -> Verification:
+    """Compare a rebuilt APK with the official one the way verify_apk.py's diff stage does, diffoscope aside.
+
+    The map-id is patched into work_dir/r8_patched.apk when it differs, the
+    payload digests go to work_dir/payload_digest.json, and the official
+    signature is copied to work_dir/rebuilt_signed.apk when verify_apk.py would
+    (a v1 signature or VERIFY_APKSIGCOPIER=true). Stage timings go to report if given.
+    """
+    official, rebuilt = apk_index(official), apk_index(rebuilt)
+    official_apk, rebuilt_apk = _on_disk(official), _on_disk(rebuilt)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    patched: List[ApkIndex] = []
+
+    def patch() -> Path | None:
+        if official.map_id and verify_apk.report_map_ids(official.map_ids, rebuilt.map_ids):
+            patched.append(patch_map_id(rebuilt, work_dir / "r8_patched.apk", official, jobs))
+            return patched[0].path
+        return None
+
+    def sign(apk: Path, output: Path) -> str | None:
+        return verify_apk.copy_signing_block(official_apk, apk, output)
+
+    verdict, compared = verify_apk.apk_verdict(
+        official_apk, rebuilt_apk, official.sha256, rebuilt.sha256, work_dir, patch, sign, report or runreport.RunReport()
+    )
+    return Verification(
+        verdict,
+        official,
+        rebuilt,
+        patched[0] if patched else None,
+        compared if verdict == "signature copy match" else None,
+        diff_apk(official, compared) if verdict == "mismatch" else None,
+    )
+
+
+@contextlib.contextmanager
+def _open(apk: ApkSource) -> Iterator[zipfile.ZipFile]:
+    """apk as a ZipFile; one the caller opened is left open."""
+    if isinstance(apk, zipfile.ZipFile):
+        yield apk
+        return
+    with zipfile.ZipFile(_on_disk(apk)) as zf:
+        yield zf
+
+
+def _path(apk: ApkSource) -> Path | None:
+    if isinstance(apk, ApkIndex):
+        return apk.path
+    if isinstance(apk, zipfile.ZipFile):
+        return Path(apk.filename) if apk.filename and os.path.isfile(apk.filename) else None
+    return Path(apk)
+
+
+def _on_disk(apk: ApkSource) -> Path:
+    path = _path(apk)
+    if path is None:
+        raise ValueError("This step needs the APK as a file on disk, not an in-memory archive")
+    return path